@@ -1,32 +1,179 @@
+import csv
+import io
+import json
 import logging
 from functools import wraps
 
 import yaml
 from bson import ObjectId
 from flask import (
+    Blueprint,
     Flask,
     Response,
+    current_app,
     flash,
+    jsonify,
     redirect,
     render_template,
     request,
     session,
+    stream_with_context,
     url_for,
 )
 from flask_pymongo import PyMongo
-from werkzeug.security import check_password_hash, generate_password_hash
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError, PyMongoError
+from werkzeug.middleware.proxy_fix import ProxyFix
+from werkzeug.security import check_password_hash
+
+from blobs import BLOB_FIELDS, iter_with_blobs, load_blobs, release_blobs
+from ingest import (
+    TEMPLATE_FIELDS,
+    IngestError,
+    annotator_document,
+    ingest_task,
+    iter_records,
+)
+from converter import Viewport, compact_graph, trusted_graph
+from metrics import CommandTimer, RequestMetrics, instrument
+from rendering import DiagramRenderCache, RenderQueue, prepare_graph, render_view
+from progress import (
+    annotator_key,
+    annotator_name,
+    count_new_record,
+    count_status_change,
+    empty_progress,
+    reconcile_missing,
+    status_counts,
+)
+from sessions import LoginLimiter, PasswordHasher, UserCache
+from setup_indexes import ensure_indexes
+
+bp = Blueprint("main", __name__)
+
+mongo = PyMongo()
+
+
+def load_config(path: str = "config.yml") -> dict:
+    with open(path, "r") as ymlfile:
+        return yaml.safe_load(ymlfile)
+
+
+def create_app(config_path: str = "config.yml") -> Flask:
+    """Build the application from config.yml; see wsgi.py for serving it."""
+    cfg = load_config(config_path)
+
+    app = Flask(__name__)
+    app.secret_key = cfg["app"]["secret_key"]
+    app.config["SETTINGS"] = cfg
+    proxies = cfg.get("server", {}).get("proxies", 0)
+    if proxies:
+        # remote_addr is the client's, for the per-address login limit
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=proxies, x_proto=proxies)
+
+    # pool size, timeouts and read preference are MongoClient options
+    mongo.init_app(
+        app,
+        cfg["mongodb"]["uri"],
+        event_listeners=[CommandTimer()],
+        **cfg["mongodb"].get("client", {}),
+    )
+    try:
+        ensure_indexes(mongo.db)
+        reconcile_missing(mongo.db)
+    except PyMongoError as e:
+        logging.error(f"Could not prepare the database: {e}")
+
+    # per-route timings, see admin_metrics
+    app.extensions["request_metrics"] = RequestMetrics()
+    instrument(app, app.extensions["request_metrics"])
+
+    render_cfg = cfg.get("render_cache", {})
+    app.extensions["render_cache"] = DiagramRenderCache(
+        maxsize=render_cfg.get("size", 512),
+        collection=(
+            mongo.db.rendered_diagrams if render_cfg.get("persist", True) else None
+        ),
+    )
+    queue_cfg = cfg.get("render_queue", {})
+    app.extensions["render_queue"] = RenderQueue(
+        annotations=mongo.db.annotations,
+        tasks=mongo.db.tasks,
+        blobs=mongo.db.blobs,
+        workers=queue_cfg.get("workers"),
+        chunk_size=queue_cfg.get("chunk_size", 32),
+    )
+
+    sessions_cfg = cfg.get("sessions", {})
+    app.extensions["user_cache"] = UserCache(
+        mongo.db.users, ttl=sessions_cfg.get("user_cache_ttl", 30)
+    )
+    app.extensions["login_limiter"] = LoginLimiter(
+        max_failures=sessions_cfg.get("max_failures", 10),
+        max_failures_per_address=sessions_cfg.get("max_failures_per_address", 50),
+        window=sessions_cfg.get("failure_window", 300),
+        concurrent_checks=sessions_cfg.get("concurrent_checks", 2),
+        maxsize=sessions_cfg.get("max_tracked_logins", 100_000),
+    )
+    app.extensions["password_hasher"] = PasswordHasher(
+        mongo.db.users, method=sessions_cfg.get("password_method")
+    )
 
-from converter import GraphConvertConfig, MermaidJSFlowchartTemplate, convert_str_graph
+    app.register_blueprint(bp)
+    return app
 
-app = Flask(__name__)
 
-with open("config.yml", "r") as ymlfile:
-    cfg = yaml.safe_load(ymlfile)
+def settings(section: str) -> dict:
+    """A section of the config.yml the current app was created from."""
+    return current_app.config["SETTINGS"].get(section) or {}
 
-app.config["MONGO_URI"] = cfg["mongodb"]["uri"]
-app.secret_key = cfg["app"]["secret_key"]
 
-mongo = PyMongo(app)
+def view_max_nodes() -> int:
+    # Graphs with more nodes open as an overview with collapsed packages.
+    return settings("viewport").get("max_nodes", 300)
+
+
+# Tasks still being uploaded are not shown to anyone.
+READY_TASKS = {"state": {"$nin": ["ingesting", "failed"]}}
+
+
+# $lookup sub-pipelines join on this rather than localField/foreignField,
+# which cannot be combined with a pipeline before MongoDB 5.0.
+SAME_SAMPLE = {"$eq": ["$sample_id", "$$sample_id"]}
+
+
+def template_lookup(fields):
+    """Aggregation stages filling ``fields`` of annotator records from their
+    template; records that still carry their own copy keep it."""
+    return [
+        {
+            "$lookup": {
+                "from": "annotations",
+                "let": {"sample_id": "$sample_id"},
+                "pipeline": [
+                    {"$match": {"$expr": SAME_SAMPLE, "template": True}},
+                    {"$project": {"_id": 0, **{f: 1 for f in fields}}},
+                ],
+                "as": "_template",
+            }
+        },
+        {
+            "$set": {
+                f: {"$ifNull": [f"${f}", {"$arrayElemAt": [f"$_template.{f}", 0]}]}
+                for f in fields
+            }
+        },
+        {"$project": {"_template": 0}},
+    ]
+
+
+# Stored at ingest, cut from the inline code of records uploaded before blobs.
+SNIPPET = {"$ifNull": ["$snippet", {"$substrCP": [{"$ifNull": ["$code", ""]}, 0, 50]}]}
+
+
+def snippet_stages():
+    """Aggregation stages giving every record the snippet of its sample."""
+    return [*template_lookup(["snippet", "code"]), {"$set": {"snippet": SNIPPET}}]
 
 
 # ---------- Helper: Login Required Decorator ----------
@@ -35,27 +182,48 @@ def login_required(f):
     def decorated_function(*args, **kwargs):
         if "username" not in session:
             flash("Please login first", "warning")
-            return redirect(url_for("login"))
+            return redirect(url_for("main.login"))
         return f(*args, **kwargs)
 
     return decorated_function
 
 
+@bp.before_request
+def refresh_user():
+    """Apply role changes and deletions to sessions that are already open."""
+    username = session.get("username")
+    if username is None:
+        return
+    user = current_app.extensions["user_cache"].get(username)
+    if user is None:
+        session.clear()
+    elif session.get("role") != user.get("role", "annotator"):
+        session["role"] = user.get("role", "annotator")
+
+
 # ---------- Home / Index ----------
 
 
-@app.route("/")
+@bp.route("/")
 def index():
     if "username" in session:
-        return redirect(url_for("dashboard"))
+        return redirect(url_for("main.dashboard"))
     # For unauthenticated users: show only annotated (non "Not Annotated") data
-    annotations = list(mongo.db.annotations.find({"status": {"$ne": "Not Annotated"}}))
+    annotations = list(
+        mongo.db.annotations.aggregate(
+            [
+                {"$match": {"status": {"$ne": "Not Annotated"}}},
+                *snippet_stages(),
+                {"$project": {"status": 1, "snippet": 1}},
+            ]
+        )
+    )
     return render_template(
         "index.html", annotations=annotations, mode=session.get("mode", "light")
     )
 
 
-@app.route("/help")
+@bp.route("/help")
 @login_required
 def help():
     return render_template("help.html", mode=session.get("mode", "light"))
@@ -64,62 +232,78 @@ def help():
 # ---------- Login / Logout ----------
 
 
-@app.route("/login", methods=["GET", "POST"])
+@bp.route("/login", methods=["GET", "POST"])
 def login():
     if request.method == "POST":
-        username = request.form.get("username")
-        password = request.form.get("password")
-        user = mongo.db.users.find_one({"username": username})
-        if user and check_password_hash(user["password"], password):
+        username = request.form.get("username") or ""
+        password = request.form.get("password") or ""
+        address = request.remote_addr or ""
+        limiter = current_app.extensions["login_limiter"]
+        # refused before any password is hashed
+        if not limiter.allowed(username, address):
+            flash("Too many failed logins, please try again later", "danger")
+            return (
+                render_template("login.html", mode=session.get("mode", "light")),
+                429,
+            )
+
+        user = mongo.db.users.find_one(
+            {"username": username}, {"password": 1, "role": 1}
+        )
+        with limiter.checking() as slot:
+            if not slot:
+                flash("Too many logins at once, please try again", "warning")
+                return (
+                    render_template("login.html", mode=session.get("mode", "light")),
+                    503,
+                )
+            valid = user is not None and check_password_hash(user["password"], password)
+
+        if valid:
+            limiter.succeeded(username)
+            current_app.extensions["password_hasher"].upgrade_later(user, password)
             session["username"] = username
             session["role"] = user.get("role", "annotator")
             flash("Logged in successfully", "success")
-            return redirect(url_for("dashboard"))
+            return redirect(url_for("main.dashboard"))
+        limiter.failed(username, address)
         flash("Invalid credentials", "danger")
     return render_template("login.html", mode=session.get("mode", "light"))
 
 
-@app.route("/logout")
+@bp.route("/logout")
 @login_required
 def logout():
     session.clear()
     flash("Logged out", "info")
-    return redirect(url_for("login"))
+    return redirect(url_for("main.login"))
 
 
 # ---------- Dashboard for Annotators ----------
 
 
-@app.route("/dashboard")
+@bp.route("/dashboard")
 @login_required
 def dashboard():
     # Redirect admin users to a separate admin dashboard
     if session["role"] == "admin":
-        return redirect(url_for("admin_dashboard"))
-
-    # For annotators: list tasks (datasets) and their annotation statuses
-    tasks = list(mongo.db.tasks.find())
-
-    for task in tasks:
-        template_annotations = list(
-            mongo.db.annotations.find({"task_id": task["_id"], "template": True})
+        return redirect(url_for("main.admin_dashboard"))
+
+    # For annotators: list tasks (datasets) with their own counters, see progress.py
+    key = annotator_key(session["username"])
+    tasks = list(
+        mongo.db.tasks.find(
+            READY_TASKS,
+            {"name": 1, "progress.total": 1, f"progress.annotators.{key}": 1},
         )
-        total = len(template_annotations)
-
-        annotations = list(
-            mongo.db.annotations.find(
-                {"task_id": task["_id"], "annotator": session["username"]}
-            )
+    )
+    for task in tasks:
+        progress = task.get("progress", {})
+        task["total"] = progress.get("total", 0)
+        task["annotation_counts"] = status_counts(
+            progress.get("annotators", {}).get(key)
         )
 
-        counts = {"Not Annotated": 0, "In Progress": 0, "Finalized": 0}
-
-        for ann in annotations:
-            counts[ann["status"]] = counts.get(ann["status"], 0) + 1
-
-        task["annotation_counts"] = counts
-        task["total"] = total
-
     return render_template(
         "dashboard.html", tasks=tasks, mode=session.get("mode", "light")
     )
@@ -128,108 +312,188 @@ def dashboard():
 # ---------- Dataset Page ----------
 
 
-@app.route("/dataset")
+STATUSES = ["Not Annotated", "In Progress", "Finalized"]
+
+# Only what dataset.html shows, with the code cut down on the server.
+DATASET_PROJECTION = {
+    "sample_id": 1,
+    "status": 1,
+    "annotator": 1,
+    "snippet": SNIPPET,
+}
+
+
+@bp.route("/dataset")
 def dataset():
     # grab selected dataset (task) if any
     selected_task_id = request.args.get("task_id")
+    status = request.args.get("status") or None
+    annotator = request.args.get("annotator") or None
+    after = request.args.get("after") or None
+    page_size = settings("dataset").get("page_size", 50)
+    per_page = max(1, min(request.args.get("per_page", page_size, type=int), 500))
     # load all tasks so we can let the user choose one
-    tasks = list(mongo.db.tasks.find())
+    tasks = list(mongo.db.tasks.find(READY_TASKS, {"name": 1}))
 
     # build base filter: if a task_id was passed, only that dataset
-    query = {}
+    query = {"task_id": {"$in": [task["_id"] for task in tasks]}}
 
     if selected_task_id:
-        from bson import ObjectId
-
         try:
             query["task_id"] = ObjectId(selected_task_id)
         except:
             flash("Invalid dataset selected", "danger")
-            return redirect(url_for("dataset"))
+            return redirect(url_for("main.dataset"))
+
+    # keyset pagination: pages continue after the last sample_id shown
+    if after:
+        query["sample_id"] = {"$gt": after}
 
+    pipeline = []
+    annotators = []
     if "username" in session:
         if session["role"] != "admin":
-            # For annotators, merge the templates with any existing annotation records for the user.
-            template_annotations = list(
-                mongo.db.annotations.find({**query, "template": True})
-            )
-            user_annotations = list(
-                mongo.db.annotations.find(
-                    {**query, "annotator": session["username"], "template": False}
-                )
-            )
-            samples = {}
-
-            for t in template_annotations:
-                samples[t["sample_id"]] = t
-
-            for ua in user_annotations:
-                samples[ua["sample_id"]] = ua
-
-            annotations = list(samples.values())
+            # For annotators, overlay their own status on the template records.
+            pipeline = [
+                {"$match": {**query, "template": True}},
+                {"$sort": {"sample_id": 1}},
+                {
+                    "$lookup": {
+                        "from": "annotations",
+                        "let": {"sample_id": "$sample_id"},
+                        "pipeline": [
+                            {
+                                "$match": {
+                                    "$expr": SAME_SAMPLE,
+                                    "annotator": session["username"],
+                                }
+                            },
+                            {"$project": {"_id": 0, "status": 1}},
+                        ],
+                        "as": "own",
+                    }
+                },
+                {
+                    "$set": {
+                        "status": {
+                            "$ifNull": [{"$arrayElemAt": ["$own.status", 0]}, "$status"]
+                        }
+                    }
+                },
+            ]
+            if status:
+                pipeline.append({"$match": {"status": status}})
         else:
-            # Admin sees only the template records.
-            annotations = list(mongo.db.annotations.find({**query, "template": True}))
+            # Admin sees the template records, or one annotator's records.
+            if annotator:
+                query.update({"annotator": annotator, "template": False})
+            else:
+                query["template"] = True
+            if status:
+                query["status"] = status
+            pipeline = [{"$match": query}, {"$sort": {"sample_id": 1}}]
+            if annotator:
+                pipeline += [{"$limit": per_page + 1}, *snippet_stages()]
+            annotators = [
+                u["username"]
+                for u in mongo.db.users.find(
+                    {"role": {"$ne": "admin"}}, {"username": 1}
+                )
+            ]
     else:
         # Unauthenticated users see only annotated data.
-        annotations = list(
-            mongo.db.annotations.find(
-                {**query, "template": True, "status": {"$ne": "Not Annotated"}}
-            )
-        )
+        query.update({"template": True, "status": {"$ne": "Not Annotated"}})
+        if status:
+            query["status"] = {"$eq": status, "$ne": "Not Annotated"}
+        pipeline = [{"$match": query}, {"$sort": {"sample_id": 1}}]
+
+    pipeline += [{"$limit": per_page + 1}, {"$project": DATASET_PROJECTION}]
+    annotations = list(mongo.db.annotations.aggregate(pipeline))
+    next_after = None
+    if len(annotations) > per_page:
+        annotations = annotations[:per_page]
+        next_after = annotations[-1]["sample_id"]
 
     return render_template(
         "dataset.html",
         tasks=tasks,
         selected_task_id=selected_task_id,
         annotations=annotations,
+        statuses=STATUSES,
+        selected_status=status,
+        annotators=annotators,
+        selected_annotator=annotator,
+        per_page=per_page,
+        after=after,
+        next_after=next_after,
         mode=session.get("mode", "light"),
     )
 
 
-@app.route("/annotate/<sample_id>", methods=["GET", "POST"])
+@bp.route("/annotate/<sample_id>", methods=["GET", "POST"])
 @login_required
 def annotate(sample_id):
-    # Check if there's an annotation record for this sample for the current annotator.
-    annotation = mongo.db.annotations.find_one(
-        {"sample_id": sample_id, "annotator": session["username"]}
-    )
-
-    if not annotation:
-        # Clone the template record for this sample.
-        template = mongo.db.annotations.find_one(
-            {"sample_id": sample_id, "template": True}
+    # The template holds the sample, the annotator's record only their own
+    # fields; it is created on first open.
+    template = mongo.db.annotations.find_one({"sample_id": sample_id, "template": True})
+    if template is None:
+        flash("Sample not found", "danger")
+        return redirect(url_for("main.dashboard"))
+    # the diagram fields are loaded below, only the one that is drawn
+    load_blobs(mongo.db.blobs, [template], ["code"])
+
+    record = {"sample_id": sample_id, "annotator": session["username"]}
+    # with the _id chosen here, "no record before" means this request cloned it
+    new = {"_id": ObjectId(), **annotator_document(template)}
+    try:
+        own = mongo.db.annotations.find_one_and_update(
+            record,
+            {"$setOnInsert": new},
+            upsert=True,
+            return_document=ReturnDocument.BEFORE,
         )
-        template.pop("_id")
-        template.update(
-            {
-                "annotator": session["username"],
-                "template": False,
-                "nodes": {
-                    "Sufficiency": [],
-                    "Completeness": [],
-                    "Hallucinations": [],
-                    "Verbosity": [],
-                },
-                "notes": "",
-            }
-        )
-        oid = mongo.db.annotations.insert_one(template).inserted_id
-        annotation = mongo.db.annotations.find_one({"_id": oid})
-
-    mm_template = MermaidJSFlowchartTemplate(enable_links=True)
-    g_config = GraphConvertConfig(
-        outside_members=True, hide_empty_members=True, graph_template=mm_template
-    )
-
-    diagram = (
-        annotation["diagram"]
-        .replace("click", "cliсk")
-        .replace("constructor", "construсtor")
-        .replace("toString", "tоString")
-    )
-
-    annotation["diagram"] = convert_str_graph(diagram, g_config).replace("\t", "    ")
+    except DuplicateKeyError:
+        # a concurrent request has just created it
+        own = mongo.db.annotations.find_one(record)
+    if own is None:
+        own = {**record, **new}
+        count_new_record(mongo.db.tasks, own["task_id"], session["username"])
+    annotation = {**template, **own}
+
+    if annotation.get("render_error"):
+        flash("Diagram could not be converted: " + annotation["render_error"], "danger")
+        return redirect(url_for("main.dataset", task_id=annotation["task_id"]))
+
+    view = None
+    max_nodes = view_max_nodes()
+    render_cache = current_app.extensions["render_cache"]
+
+    def load_graph() -> dict:
+        if annotation.get("graph") is None:
+            load_blobs(mongo.db.blobs, [annotation], ["graph"])
+        return annotation["graph"]
+
+    graph_nodes = annotation.get("graph_nodes")
+    if graph_nodes is None:
+        # samples uploaded before graph_nodes was stored are measured here
+        load_blobs(mongo.db.blobs, [annotation], ["graph"])
+        graph = annotation.get("graph")
+        graph_nodes = len(graph["nodes"]) if graph is not None else 0
+    if graph_nodes > max_nodes:
+        graph_id = annotation.get("blobs", {}).get("graph")
+        if graph_id is not None:
+            # the template graph never changes, so its overview is cached
+            view = render_cache.get_overview(graph_id, max_nodes, load_graph)
+        else:
+            view = render_view(load_graph(), Viewport(), max_nodes=max_nodes)
+        annotation["diagram"] = view.pop("diagram")
+    else:
+        load_blobs(mongo.db.blobs, [annotation], ["rendered_diagram"])
+        if annotation.get("rendered_diagram"):
+            annotation["diagram"] = annotation["rendered_diagram"]
+        else:
+            load_blobs(mongo.db.blobs, [annotation], ["diagram"])
+            annotation["diagram"] = render_cache.get(annotation["diagram"])
 
     if request.method == "POST":
         data = request.get_json()
@@ -239,12 +503,9 @@ def annotate(sample_id):
         notes = data.get("notes", "")
         status = "Finalized" if action == "finalize" else "In Progress"
 
-        # save everything
-        logging.info(
-            f'Saving {annotation["_id"]}, setting {nodes_map}, status {status}'
-        )
+        logging.info("Saving %s, status %s", annotation["_id"], status)
 
-        mongo.db.annotations.update_one(
+        before = mongo.db.annotations.find_one_and_update(
             {"_id": annotation["_id"]},
             {
                 "$set": {
@@ -252,9 +513,19 @@ def annotate(sample_id):
                     "missing": missing,
                     "notes": notes,
                     "status": status,
-                }
+                },
+                "$inc": {"revision": 1},
             },
+            projection={"status": 1},
         )
+        if before is not None:
+            count_status_change(
+                mongo.db.tasks,
+                annotation["task_id"],
+                session["username"],
+                before["status"],
+                status,
+            )
         flash("Annotation saved", "success")
 
         # Save or Finalize go back to dataset
@@ -266,113 +537,366 @@ def annotate(sample_id):
 
         if action == "finalize":
             task_id = annotation["task_id"]
-            return redirect(url_for("dataset", task_id=task_id))
+            return redirect(url_for("main.dataset", task_id=task_id))
         else:
             return render_template(
                 "annotate.html",
                 annotation=annotation,
+                view=view,
                 mode=session.get("mode", "light"),
             )
 
     return render_template(
-        "annotate.html", annotation=annotation, mode=session.get("mode", "light")
+        "annotate.html",
+        annotation=annotation,
+        view=view,
+        mode=session.get("mode", "light"),
+    )
+
+
+NODE_METRICS = ("Sufficiency", "Completeness", "Hallucinations", "Verbosity")
+PATCH_STATUSES = ("In Progress", "Finalized")
+
+
+def annotation_patch_update(data: dict) -> dict:
+    """Translate a PATCH body into a MongoDB update, ValueError if malformed."""
+    update = {"$set": {}, "$inc": {"revision": 1}}
+
+    label = data.get("label")
+    if label is not None:
+        if not isinstance(label, dict):
+            raise ValueError("label must be an object")
+        node, metric = label.get("node"), label.get("metric")
+        if not isinstance(node, str) or metric not in (None, *NODE_METRICS):
+            raise ValueError("label needs a node and a metric (or null)")
+        # a node carries at most one label
+        update["$pull"] = {f"nodes.{m}": node for m in NODE_METRICS if m != metric}
+        if metric is not None:
+            update["$addToSet"] = {f"nodes.{metric}": node}
+
+    if "missing" in data:
+        missing = data["missing"]
+        if not isinstance(missing, list) or not all(
+            isinstance(m, str) for m in missing
+        ):
+            raise ValueError("missing must be a list of strings")
+        update["$set"]["missing"] = missing
+    if "notes" in data:
+        if not isinstance(data["notes"], str):
+            raise ValueError("notes must be a string")
+        update["$set"]["notes"] = data["notes"]
+    if "status" in data:
+        if data["status"] not in PATCH_STATUSES:
+            raise ValueError(f"status must be one of {', '.join(PATCH_STATUSES)}")
+        update["$set"]["status"] = data["status"]
+    elif label is not None or update["$set"]:
+        # like saving from the form, any change reopens the annotation
+        update["$set"]["status"] = "In Progress"
+
+    if not update["$set"]:
+        del update["$set"]
+    return update
+
+
+@bp.route("/api/annotations/<sample_id>", methods=["PATCH"])
+@login_required
+def patch_annotation(sample_id):
+    """Apply a field-level change to the current user's annotation.
+
+    The body holds the ``revision`` the client last saw and any of ``label``
+    (``{"node", "metric"}``, a null metric removes the label), ``missing``,
+    ``notes`` and ``status``. The update only applies if the revision still
+    matches, otherwise 409 is returned with the current revision.
+    """
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict) or not isinstance(data.get("revision"), int):
+        return jsonify({"error": "A JSON body with a revision is required"}), 400
+    try:
+        update = annotation_patch_update(data)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    revision = data["revision"]
+    record = {"sample_id": sample_id, "annotator": session["username"]}
+    # records cloned before revisions existed have none
+    seen = {"$in": [0, None]} if revision == 0 else revision
+    before = mongo.db.annotations.find_one_and_update(
+        {**record, "revision": seen}, update, projection={"status": 1, "task_id": 1}
+    )
+    if before is not None:
+        status = update.get("$set", {}).get("status")
+        if status is not None:
+            count_status_change(
+                mongo.db.tasks,
+                before["task_id"],
+                session["username"],
+                before["status"],
+                status,
+            )
+        return jsonify({"revision": revision + 1})
+
+    current = mongo.db.annotations.find_one(record, {"revision": 1})
+    if current is None:
+        return jsonify({"error": "Annotation not found"}), 404
+    return (
+        jsonify(
+            {
+                "error": "Annotation was changed elsewhere",
+                "revision": current.get("revision", 0),
+            }
+        ),
+        409,
+    )
+
+
+# bump when the output of annotation_graph changes shape
+GRAPH_FORMAT_VERSION = "1"
+
+
+@bp.route("/api/annotations/<sample_id>/graph")
+@login_required
+def annotation_graph(sample_id):
+    """Node ids, types, packages and adjacency of a sample's graph.
+
+    Graphs do not change after upload, so the ETag is derived from the template
+    record id and repeat requests are answered with 304 without reading the
+    graph.
+    """
+    template = mongo.db.annotations.find_one(
+        {"sample_id": sample_id, "template": True}, {"_id": 1}
+    )
+    if template is None:
+        return jsonify({"error": "Sample not found"}), 404
+
+    etag = f"{template['_id']}-{GRAPH_FORMAT_VERSION}"
+    if etag in request.if_none_match:
+        response = Response(status=304)
+    else:
+        annotation = mongo.db.annotations.find_one(
+            {"_id": template["_id"]}, {"graph": 1, "diagram": 1, "blobs": 1}
+        )
+        load_blobs(mongo.db.blobs, [annotation], ["graph"])
+        graph = annotation.get("graph")
+        if graph is None:
+            load_blobs(mongo.db.blobs, [annotation], ["diagram"])
+            try:
+                graph = prepare_graph(annotation["diagram"])
+            except Exception as e:
+                return jsonify({"error": f"{type(e).__name__}: {e}"}), 422
+        response = jsonify(compact_graph(trusted_graph(graph)))
+    response.set_etag(etag)
+    # cached by the browser, revalidated on every use
+    response.headers["Cache-Control"] = "private, no-cache"
+    return response
+
+
+@bp.route("/api/annotations/<sample_id>/diagram")
+@login_required
+def annotation_diagram(sample_id):
+    """Part of a sample's diagram, for expanding the overview of large graphs.
+
+    Query parameters: ``expand`` (repeatable) lists the open packages,
+    ``focus`` (repeatable) and ``hops``, ``package`` and ``top`` restrict the
+    graph to a neighbourhood, a package subtree or the most connected nodes.
+    """
+    annotation = mongo.db.annotations.find_one(
+        {"sample_id": sample_id, "template": True},
+        {"graph": 1, "diagram": 1, "blobs": 1},
+    )
+    if annotation is None:
+        return jsonify({"error": "Sample not found"}), 404
+
+    load_blobs(mongo.db.blobs, [annotation], ["graph"])
+    graph = annotation.get("graph")
+    if graph is None:
+        load_blobs(mongo.db.blobs, [annotation], ["diagram"])
+        try:
+            graph = prepare_graph(annotation["diagram"])
+        except Exception as e:
+            return jsonify({"error": f"{type(e).__name__}: {e}"}), 422
+
+    viewport = Viewport(
+        focus=request.args.getlist("focus"),
+        hops=min(request.args.get("hops", 1, type=int), 10),
+        package_id=request.args.get("package"),
+        top_degree=request.args.get("top", type=int),
+    )
+    return jsonify(
+        render_view(
+            graph,
+            viewport,
+            expanded=set(request.args.getlist("expand")),
+            max_nodes=view_max_nodes(),
+        )
     )
 
 
 # ---------- Admin Routes ----------
-@app.route("/admin")
+@bp.route("/admin")
 @login_required
 def admin_dashboard():
     if session["role"] != "admin":
         flash("Unauthorized", "danger")
-        return redirect(url_for("dashboard"))
+        return redirect(url_for("main.dashboard"))
 
     tasks = list(mongo.db.tasks.find())
+    for task in tasks:
+        progress = task.get("progress", {})
+        task["total"] = progress.get("total", 0)
+        task["annotation_counts"] = status_counts(progress.get("status"))
+        task["annotators"] = sorted(
+            (annotator_name(key), status_counts(counts))
+            for key, counts in progress.get("annotators", {}).items()
+        )
 
     return render_template(
         "admin_dashboard.html", tasks=tasks, mode=session.get("mode", "light")
     )
 
 
-@app.route("/admin/upload", methods=["GET", "POST"])
+@bp.route("/admin/metrics")
+def admin_metrics():
+    """Request timings per route, as a page or in the Prometheus text format.
+
+    Scrapers authenticate with the ``metrics.token`` of config.yml as a bearer
+    token. Totals are per process and reset when it restarts.
+    """
+    token = settings("metrics").get("token")
+    scraper = token and request.headers.get("Authorization") == f"Bearer {token}"
+    if not scraper and session.get("role") != "admin":
+        flash("Unauthorized", "danger")
+        return redirect(
+            url_for("main.dashboard" if "username" in session else "main.login")
+        )
+
+    request_metrics = current_app.extensions["request_metrics"]
+    if scraper or request.args.get("format") == "prometheus":
+        return Response(
+            request_metrics.prometheus(), mimetype="text/plain; version=0.0.4"
+        )
+    return render_template(
+        "admin_metrics.html",
+        rows=request_metrics.summary(),
+        mode=session.get("mode", "light"),
+    )
+
+
+def remove_task(task_id: ObjectId) -> None:
+    """Delete a task with all its annotations, and the blobs nothing else uses."""
+    release_blobs(
+        mongo.db,
+        mongo.db.annotations.find({"task_id": task_id, "template": True}, {"blobs": 1}),
+    )
+    mongo.db.annotations.delete_many({"task_id": task_id})
+    mongo.db.tasks.delete_one({"_id": task_id})
+
+
+@bp.route("/admin/upload", methods=["GET", "POST"])
 @login_required
 def admin_upload():
     if session["role"] != "admin":
         flash("Unauthorized", "danger")
-        return redirect(url_for("dashboard"))
+        return redirect(url_for("main.dashboard"))
     if request.method == "POST":
         task_name = request.form.get("task_name")
         file = request.files.get("dataset_file")
         if not task_name or not file:
             flash("Task name and dataset file are required.", "danger")
-            return redirect(url_for("admin_upload"))
-        try:
-            import json
+            return redirect(url_for("main.admin_upload"))
+        # Create a new task entry, hidden from the dashboards until ingested.
+        task_id = mongo.db.tasks.insert_one(
+            {
+                "name": task_name,
+                "state": "ingesting",
+                "render": {"total": 0, "done": 0, "failed": 0},
+                "progress": empty_progress(),
+            }
+        ).inserted_id
 
-            data = json.load(file)
-        except Exception as e:
-            flash("Failed to load JSON: " + str(e), "danger")
-            return redirect(url_for("admin_upload"))
-        # Create a new task entry.
-        task_id = mongo.db.tasks.insert_one({"name": task_name}).inserted_id
-        from bson import ObjectId
-
-        # For each dataset entry, create a template annotation entry.
-        for item in data:
-            sample_id = str(ObjectId())
-            mongo.db.annotations.insert_one(
-                {
-                    "task_id": task_id,
-                    "sample_id": sample_id,
-                    "language": item.get("language"),
-                    "code": item.get("code"),
-                    "repo": item.get("repo"),
-                    "path": item.get("path"),
-                    "query": item.get("query"),
-                    "diagram": item.get("diagram"),
-                    "version": item.get("version"),
-                    "text_answer": item.get("text_answer"),
-                    "nodes": "",
-                    "notes": "",
-                    "status": "Not Annotated",
-                    "annotator": "",
-                    "template": True,
-                }
+        def queue_rendering(docs):
+            mongo.db.tasks.update_one(
+                {"_id": task_id}, {"$inc": {"render.total": len(docs)}}
+            )
+            # Validate and convert the diagrams in the background, see
+            # admin_dashboard.
+            current_app.extensions["render_queue"].submit(
+                task_id, [(doc["_id"], doc.get("diagram") or "") for doc in docs]
+            )
+
+        # Create a template annotation entry for each dataset entry.
+        try:
+            report = ingest_task(
+                mongo.db,
+                task_id,
+                iter_records(file.stream),
+                batch_size=settings("ingest").get("batch_size", 1000),
+                on_batch=queue_rendering,
             )
-        flash("Task uploaded successfully", "success")
-        return redirect(url_for("admin_dashboard"))
+        except Exception as e:
+            if not isinstance(e, IngestError):
+                logging.exception(f"Ingestion of task {task_id} failed")
+            try:
+                # stays listed for removal if the cleanup fails as well
+                mongo.db.tasks.update_one(
+                    {"_id": task_id}, {"$set": {"state": "failed"}}
+                )
+                remove_task(task_id)
+            except PyMongoError as cleanup_error:
+                logging.error(f"Could not remove task {task_id}: {cleanup_error}")
+            flash("Failed to load dataset: " + str(e), "danger")
+            return redirect(url_for("main.admin_upload"))
+
+        mongo.db.tasks.update_one({"_id": task_id}, {"$set": {"state": "ready"}})
+        logging.info(f"Ingested task {task_id}: {report.summary()}")
+        for error in report.errors:
+            logging.warning(f"Ingestion of task {task_id}: {error}")
+        flash(
+            "Task uploaded: " + report.summary(),
+            "warning" if report.failed else "success",
+        )
+        return redirect(url_for("main.admin_dashboard"))
     return render_template("upload.html", mode=session.get("mode", "light"))
 
 
-@app.route("/admin/create_user", methods=["GET", "POST"])
+@bp.route("/admin/create_user", methods=["GET", "POST"])
 @login_required
 def create_user():
     if session["role"] != "admin":
         flash("Unauthorized", "danger")
-        return redirect(url_for("dashboard"))
+        return redirect(url_for("main.dashboard"))
 
     if request.method == "POST":
         username = request.form.get("username")
         password = request.form.get("password")
         role = request.form.get("role", "annotator")
-        hashed_pw = generate_password_hash(password)
-        mongo.db.users.insert_one(
-            {"username": username, "password": hashed_pw, "role": role}
-        )
-        flash("User created", "success")
-        return redirect(url_for("admin_dashboard"))
+        hashed_pw = current_app.extensions["password_hasher"].hash(password)
+        try:
+            mongo.db.users.insert_one(
+                {"username": username, "password": hashed_pw, "role": role}
+            )
+            flash("User created", "success")
+        except DuplicateKeyError:
+            flash("User already exists", "danger")
+        return redirect(url_for("main.admin_dashboard"))
 
     return render_template("create_user.html", mode=session.get("mode", "light"))
 
 
-@app.route("/admin/view_annotations")
+@bp.route("/admin/view_annotations")
 @login_required
 def admin_view_annotations():
     if session["role"] != "admin":
         flash("Unauthorized", "danger")
-        return redirect(url_for("dashboard"))
-
-    annotations = list(mongo.db.annotations.find())
+        return redirect(url_for("main.dashboard"))
+
+    annotations = list(
+        mongo.db.annotations.aggregate(
+            [
+                *snippet_stages(),
+                {"$project": {"task_id": 1, "annotator": 1, "status": 1, "snippet": 1}},
+            ]
+        )
+    )
     return render_template(
         "admin_annotations.html",
         annotations=annotations,
@@ -380,12 +904,12 @@ def admin_view_annotations():
     )
 
 
-@app.route("/admin/manage_users", methods=["GET", "POST"])
+@bp.route("/admin/manage_users", methods=["GET", "POST"])
 @login_required
 def manage_users():
     if session["role"] != "admin":
         flash("Unauthorized", "danger")
-        return redirect(url_for("dashboard"))
+        return redirect(url_for("main.dashboard"))
 
     if request.method == "POST":
         # Create a new user from the form input.
@@ -395,14 +919,17 @@ def manage_users():
 
         if not username or not password:
             flash("Username and password are required", "danger")
-            return redirect(url_for("manage_users"))
+            return redirect(url_for("main.manage_users"))
 
-        hashed_pw = generate_password_hash(password)
-        mongo.db.users.insert_one(
-            {"username": username, "password": hashed_pw, "role": role}
-        )
-        flash("User created", "success")
-        return redirect(url_for("manage_users"))
+        hashed_pw = current_app.extensions["password_hasher"].hash(password)
+        try:
+            mongo.db.users.insert_one(
+                {"username": username, "password": hashed_pw, "role": role}
+            )
+            flash("User created", "success")
+        except DuplicateKeyError:
+            flash("User already exists", "danger")
+        return redirect(url_for("main.manage_users"))
 
     users = list(mongo.db.users.find())
     return render_template(
@@ -410,112 +937,157 @@ def manage_users():
     )
 
 
-@app.route("/admin/manage_users/upgrade/<user_id>")
+@bp.route("/admin/manage_users/upgrade/<user_id>")
 @login_required
 def upgrade_user(user_id):
     if session["role"] != "admin":
         flash("Unauthorized", "danger")
-        return redirect(url_for("dashboard"))
+        return redirect(url_for("main.dashboard"))
 
-    mongo.db.users.update_one({"_id": ObjectId(user_id)}, {"$set": {"role": "admin"}})
+    user = mongo.db.users.find_one_and_update(
+        {"_id": ObjectId(user_id)}, {"$set": {"role": "admin"}}
+    )
+    if user is not None:
+        current_app.extensions["user_cache"].invalidate(user["username"])
     flash("User upgraded to admin", "success")
-    return redirect(url_for("manage_users"))
+    return redirect(url_for("main.manage_users"))
 
 
-@app.route("/admin/manage_users/delete/<user_id>")
+@bp.route("/admin/manage_users/delete/<user_id>")
 @login_required
 def delete_user(user_id):
     if session["role"] != "admin":
         flash("Unauthorized", "danger")
-        return redirect(url_for("dashboard"))
+        return redirect(url_for("main.dashboard"))
 
     user_to_delete = mongo.db.users.find_one({"_id": ObjectId(user_id)})
 
     if user_to_delete and user_to_delete["username"] == session["username"]:
         flash("You cannot delete yourself", "danger")
-        return redirect(url_for("manage_users"))
+        return redirect(url_for("main.manage_users"))
 
     mongo.db.users.delete_one({"_id": ObjectId(user_id)})
+    if user_to_delete:
+        current_app.extensions["user_cache"].invalidate(user_to_delete["username"])
     flash("User deleted", "success")
-    return redirect(url_for("manage_users"))
+    return redirect(url_for("main.manage_users"))
 
 
-@app.route("/admin/manage_tasks/delete/<task_id>")
+@bp.route("/admin/manage_tasks/delete/<task_id>")
 @login_required
 def delete_task(task_id):
     if session["role"] != "admin":
         flash("Unauthorized", "danger")
-        return redirect(url_for("dashboard"))
+        return redirect(url_for("main.dashboard"))
 
-    # Remove all annotations associated with this task
-    mongo.db.annotations.delete_many({"task_id": ObjectId(task_id)})
-    # Remove the task
-    mongo.db.tasks.delete_one({"_id": ObjectId(task_id)})
+    remove_task(ObjectId(task_id))
     flash("Task removed", "success")
-    return redirect(url_for("admin_dashboard"))
-
-
-@app.route("/admin/export_annotations")
+    return redirect(url_for("main.admin_dashboard"))
+
+
+EXPORT_COLUMNS = [
+    "_id",
+    "sample_id",
+    "task_id",
+    "annotator",
+    "language",
+    "code",
+    "repo",
+    "path",
+    "query",
+    "diagram",
+    "version",
+    "text_answer",
+    "nodes",
+    "notes",
+    "status",
+    "template",
+]
+
+
+def export_value(ann, column, for_csv):
+    value = ann.get(column, "")
+    if column in ("_id", "task_id", "template"):
+        return str(value)
+    if column == "code" and for_csv:
+        return (value or "").replace("\n", "\\n")
+    return value
+
+
+@bp.route("/admin/export_annotations")
 @login_required
 def export_annotations():
     if session["role"] != "admin":
         flash("Unauthorized", "danger")
-        return redirect(url_for("dashboard"))
-    import csv
-    import io
-
-    annotations = list(mongo.db.annotations.find())
-    output = io.StringIO()
-    writer = csv.writer(output)
-    # Define the header (include any fields you need)
-    header = [
-        "_id",
-        "sample_id",
-        "task_id",
-        "annotator",
-        "language",
-        "code",
-        "repo",
-        "path",
-        "query",
-        "diagram",
-        "version",
-        "text_answer",
-        "nodes",
-        "notes",
-        "status",
-        "template",
-    ]
-    writer.writerow(header)
-    for ann in annotations:
-        row = [
-            str(ann.get("_id", "")),
-            ann.get("sample_id", ""),
-            str(ann.get("task_id", "")),
-            ann.get("annotator", ""),
-            ann.get("language", ""),
-            ann.get("code", "").replace("\n", "\\n"),
-            ann.get("repo", ""),
-            ann.get("path", ""),
-            ann.get("query", ""),
-            ann.get("diagram", ""),
-            ann.get("version", ""),
-            ann.get("text_answer", ""),
-            ann.get("nodes", ""),
-            ann.get("notes", ""),
-            ann.get("status", ""),
-            str(ann.get("template", "")),
-        ]
-        writer.writerow(row)
-    output.seek(0)
+        return redirect(url_for("main.dashboard"))
+
+    export_format = request.args.get("format", "csv")
+    columns = [
+        c for c in request.args.get("columns", "").split(",") if c in EXPORT_COLUMNS
+    ] or EXPORT_COLUMNS
+
+    query = {}
+    if request.args.get("task_id"):
+        try:
+            query["task_id"] = ObjectId(request.args["task_id"])
+        except:
+            flash("Invalid dataset selected", "danger")
+            return redirect(url_for("main.admin_dashboard"))
+    for field in ("annotator", "status"):
+        if request.args.get(field):
+            query[field] = request.args[field]
+    if request.args.get("template"):
+        query["template"] = request.args["template"].lower() == "true"
+
+    projection = {c: 1 for c in columns}
+    if "_id" not in projection:
+        projection["_id"] = 0
+    blob_columns = [c for c in columns if c in BLOB_FIELDS]
+    if blob_columns:
+        projection["blobs"] = 1
+    shared = [c for c in columns if c in TEMPLATE_FIELDS]
+    if blob_columns:
+        shared.append("blobs")
+    if shared and query.get("template") is not True:
+        cursor = mongo.db.annotations.aggregate(
+            [{"$match": query}, *template_lookup(shared), {"$project": projection}],
+            batchSize=500,
+        )
+    else:
+        cursor = mongo.db.annotations.find(query, projection, batch_size=500)
+    if blob_columns:
+        cursor = iter_with_blobs(mongo.db.blobs, cursor, blob_columns)
+
+    def generate_csv():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(columns)
+        for ann in cursor:
+            writer.writerow([export_value(ann, c, True) for c in columns])
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        yield buffer.getvalue()
+
+    def generate_jsonl():
+        for ann in cursor:
+            row = {c: export_value(ann, c, False) for c in columns}
+            yield json.dumps(row, default=str) + "\n"
+
+    if export_format == "jsonl":
+        return Response(
+            stream_with_context(generate_jsonl()),
+            mimetype="application/x-ndjson",
+            headers={"Content-Disposition": "attachment;filename=annotations.jsonl"},
+        )
     return Response(
-        output.getvalue(),
+        stream_with_context(generate_csv()),
         mimetype="text/csv",
         headers={"Content-Disposition": "attachment;filename=annotations.csv"},
     )
 
 
-@app.route("/toggle_theme")
+@bp.route("/toggle_theme")
 def toggle_theme():
     current = session.get("mode", "light")
     logging.debug(f"Switching the theme from [{current}] to another ")
@@ -528,4 +1100,7 @@ if __name__ == "__main__":
         level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s"
     )
 
-    app.run(debug=True, host=cfg["app"]["host"], port=cfg["app"]["port"])
+    # the development server, see wsgi.py for production
+    app = create_app()
+    cfg = app.config["SETTINGS"]["app"]
+    app.run(debug=cfg.get("debug", True), host=cfg["host"], port=cfg["port"])
@@ -0,0 +1,313 @@
+import argparse
+import json
+import logging
+import platform
+import sys
+import time
+import tracemalloc
+from collections import defaultdict
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Set
+
+from converter import (
+    CompiledGraph,
+    Graph,
+    GraphConvertConfig,
+    GraphTemplate,
+    MermaidJSFlowchartTemplate,
+    MermaidJSTemplate,
+    PlantUMLTemplate,
+    convert_graph,
+    fix_format,
+    generate_edges_repr,
+    generate_nodes_repr,
+    generate_package_repr,
+    parse_graph_str,
+    process_graph,
+)
+from synthetic_graphs import synthetic_graph
+
+TEMPLATES: Dict[str, Callable[[], GraphTemplate]] = {
+    "plantuml": PlantUMLTemplate,
+    "mermaid": MermaidJSTemplate,
+    "flowchart": lambda: MermaidJSFlowchartTemplate(enable_links=True),
+}
+
+Stats = Dict[str, Dict[str, float]]
+
+
+class StageTimer:
+    """Times named stages, and their peak memory while tracemalloc is on."""
+
+    def __init__(self) -> None:
+        self.seconds: Dict[str, float] = {}
+        self.peak_kib: Dict[str, float] = {}
+
+    def __call__(self, stage: str, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        tracing = tracemalloc.is_tracing()
+        if tracing:
+            tracemalloc.reset_peak()
+            current, _ = tracemalloc.get_traced_memory()
+        start = time.perf_counter()
+        result = fn(*args, **kwargs)
+        self.seconds[stage] = time.perf_counter() - start
+        if tracing:
+            _, peak = tracemalloc.get_traced_memory()
+            self.peak_kib[stage] = (peak - current) / 1024
+        return result
+
+
+def run_stages(
+    graph_str: str,
+    graph_repr: str,
+    make_template: Callable[[], GraphTemplate],
+    outside_members: bool,
+    hide_empty_members: bool,
+    timer: StageTimer,
+) -> None:
+    """Run the legacy pipeline stage by stage, then the compiled converter.
+
+    ``graph_str`` is JSON, ``graph_repr`` the same graph as a Python repr.
+    """
+    timer("parse_python", parse_graph_str, graph_repr)
+    graph_dict, _ = timer("parse_json", parse_graph_str, graph_str)
+    graph_dict = timer("fix_format", fix_format, graph_dict)
+    graph = timer("pydantic", Graph, **graph_dict)
+
+    template = make_template()
+    package_graph: Dict[str, Set[str]] = {
+        p.package_id: set(p.children) for p in graph.packages
+    }
+    edges: Dict[str, Dict[str, Optional[str]]] = defaultdict(dict)
+    for e in graph.edges:
+        edges[e.node_id_from][e.node_id_to] = e.description
+
+    classes, nodes_to_show = timer(
+        "process_graph",
+        process_graph,
+        nodes=graph.nodes,
+        graph=edges,
+        package_graph=package_graph,
+        outside_members=outside_members,
+    )
+    nodes_repr = timer(
+        "generate_nodes_repr",
+        generate_nodes_repr,
+        nodes=graph.nodes,
+        classes=classes,
+        nodes_to_show=nodes_to_show,
+        hide_empty_members=hide_empty_members,
+        graph_template=template,
+    )
+    edges_repr = timer(
+        "generate_edges_repr",
+        generate_edges_repr,
+        graph=edges,
+        nodes_to_show=nodes_to_show,
+        graph_template=template,
+    )
+    package_repr = timer(
+        "generate_package_repr",
+        generate_package_repr,
+        package_graph=package_graph,
+        nodes_repr=nodes_repr,
+        graph_template=template,
+    )
+    content = "\n".join([*nodes_repr.values(), *package_repr.values(), *edges_repr])
+    timer(
+        "diagram_template",
+        template.diagram_template,
+        content=content,
+        hide_empty_members=hide_empty_members,
+    )
+
+    compiled = timer("compile", CompiledGraph, graph, outside_members)
+    timer("render", compiled.render, make_template(), hide_empty_members)
+    timer(
+        "convert_graph",
+        convert_graph,
+        graph,
+        GraphConvertConfig(
+            outside_members=outside_members,
+            hide_empty_members=hide_empty_members,
+            graph_template=make_template(),
+        ),
+    )
+
+
+def benchmark(
+    graph_str: str,
+    graph_repr: str,
+    items: int,
+    make_template: Callable[[], GraphTemplate],
+    outside_members: bool,
+    hide_empty_members: bool,
+    repeat: int,
+) -> Stats:
+    best: Dict[str, float] = {}
+    for _ in range(repeat):
+        timer = StageTimer()
+        run_stages(
+            graph_str,
+            graph_repr,
+            make_template,
+            outside_members,
+            hide_empty_members,
+            timer,
+        )
+        for stage, seconds in timer.seconds.items():
+            best[stage] = min(seconds, best.get(stage, seconds))
+
+    # a separate traced run, tracemalloc slows everything down
+    timer = StageTimer()
+    tracemalloc.start()
+    try:
+        run_stages(
+            graph_str,
+            graph_repr,
+            make_template,
+            outside_members,
+            hide_empty_members,
+            timer,
+        )
+    finally:
+        tracemalloc.stop()
+
+    return {
+        stage: {
+            "seconds": seconds,
+            "items_per_sec": items / seconds if seconds > 0 else 0.0,
+            "peak_kib": timer.peak_kib[stage],
+        }
+        for stage, seconds in best.items()
+    }
+
+
+def compare(results: Dict[str, Stats], baseline: Dict[str, Stats], tolerance: float):
+    regressions: List[str] = []
+    for template_name, stages in results.items():
+        for stage, stats in stages.items():
+            before = baseline.get(template_name, {}).get(stage)
+            if before is None:
+                continue
+            if stats["seconds"] > before["seconds"] * (1 + tolerance):
+                regressions.append(
+                    f"{template_name}/{stage}: {before['seconds'] * 1000:.2f} ms "
+                    f"-> {stats['seconds'] * 1000:.2f} ms"
+                )
+    return regressions
+
+
+def main() -> None:
+    """Main entry point for script execution."""
+    parser = argparse.ArgumentParser(
+        description="Benchmark every stage of the graph converter."
+    )
+    parser.add_argument("--nodes", type=int, default=1000, help="Top-level nodes")
+    parser.add_argument("--edges", type=int, default=3000, help="Edges")
+    parser.add_argument("--packages", type=int, default=100, help="Packages")
+    parser.add_argument(
+        "--package-depth", type=int, default=5, help="Package nesting depth"
+    )
+    parser.add_argument(
+        "--members-per-class", type=int, default=5, help="Max members per class"
+    )
+    parser.add_argument("--seed", type=int, default=0, help="Random seed")
+    parser.add_argument(
+        "--outside-members",
+        action=argparse.BooleanOptionalAction,
+        default=True,
+        help="Render class members as separate nodes",
+    )
+    parser.add_argument(
+        "--hide-empty-members",
+        action=argparse.BooleanOptionalAction,
+        default=True,
+        help="Hide empty member boxes",
+    )
+    parser.add_argument("--repeat", type=int, default=5, help="Timed runs per stage")
+    parser.add_argument("--output", type=Path, help="Write results as JSON here")
+    parser.add_argument(
+        "--baseline", type=Path, help="Fail on regressions against this JSON file"
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.25,
+        help="Allowed slowdown against the baseline (0.25 = 25%%)",
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s"
+    )
+
+    params = {
+        "nodes": args.nodes,
+        "edges": args.edges,
+        "packages": args.packages,
+        "package_depth": args.package_depth,
+        "members_per_class": args.members_per_class,
+        "seed": args.seed,
+    }
+    graph = synthetic_graph(**params)
+    graph_str = json.dumps(graph.model_dump())
+    graph_repr = str(graph.model_dump())
+    items = len(graph.nodes) + len(graph.edges)
+    logging.info(
+        "Graph with %d nodes, %d edges, %d packages (%d KiB as JSON)",
+        len(graph.nodes),
+        len(graph.edges),
+        len(graph.packages),
+        len(graph_str) // 1024,
+    )
+
+    results: Dict[str, Stats] = {}
+    for template_name, make_template in TEMPLATES.items():
+        results[template_name] = benchmark(
+            graph_str,
+            graph_repr,
+            items,
+            make_template,
+            args.outside_members,
+            args.hide_empty_members,
+            args.repeat,
+        )
+        for stage, stats in results[template_name].items():
+            logging.info(
+                "%-10s %-22s %9.2f ms %12.0f items/s %10.0f KiB",
+                template_name,
+                stage,
+                stats["seconds"] * 1000,
+                stats["items_per_sec"],
+                stats["peak_kib"],
+            )
+
+    report = {
+        "params": {
+            **params,
+            "outside_members": args.outside_members,
+            "hide_empty_members": args.hide_empty_members,
+            "repeat": args.repeat,
+        },
+        "python": platform.python_version(),
+        "results": results,
+    }
+    if args.output:
+        args.output.write_text(json.dumps(report, indent=2), encoding="utf-8")
+        logging.info("Results written to %s", args.output)
+
+    if args.baseline:
+        baseline = json.loads(args.baseline.read_text(encoding="utf-8"))
+        if baseline["params"] != report["params"]:
+            logging.warning("Baseline was recorded with different parameters.")
+        regressions = compare(results, baseline["results"], args.tolerance)
+        for regression in regressions:
+            logging.error("Regression in %s", regression)
+        if regressions:
+            sys.exit(1)
+        logging.info("No regressions against %s", args.baseline)
+
+
+if __name__ == "__main__":
+    main()
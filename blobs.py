@@ -0,0 +1,133 @@
+import hashlib
+import json
+from collections import Counter
+from itertools import islice
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+from pymongo import UpdateOne
+from pymongo.collection import Collection
+from pymongo.database import Database
+
+# Large sample fields, stored once in the blobs collection by content hash.
+# Documents keep the hashes under "blobs" and a short "snippet" of the code.
+# The graph is the prepared model dump, rendered_diagram is set by RenderQueue.
+BLOB_FIELDS = ["code", "diagram", "text_answer", "graph", "rendered_diagram"]
+SNIPPET_LENGTH = 50
+
+
+def blob_id(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def _encode(value: Any) -> Optional[str]:
+    """What a blob is hashed and sized by, None if the value stays inline."""
+    if isinstance(value, str):
+        return value
+    if isinstance(value, (dict, list)):
+        # tagged, so a document never shares the blob of a text equal to its JSON
+        return "\0json\0" + json.dumps(value, sort_keys=True, separators=(",", ":"))
+    return None
+
+
+def store_blobs(
+    collection: Collection,
+    docs: List[Dict[str, Any]],
+    fields: Optional[List[str]] = None,
+) -> None:
+    """Move the blob ``fields`` of ``docs`` (default: all) into ``collection``.
+
+    Each document gets the ``blobs`` hashes in place of the fields, and its
+    code ``snippet`` when the code is among them. Blobs count their
+    references, see ``release_blobs``.
+    """
+    fields = BLOB_FIELDS if fields is None else fields
+    refs: Counter = Counter()
+    data: Dict[str, Any] = {}
+    sizes: Dict[str, int] = {}
+    for doc in docs:
+        if "code" in fields:
+            doc["snippet"] = (doc.get("code") or "")[:SNIPPET_LENGTH]
+        hashes = doc.setdefault("blobs", {})
+        for field in fields:
+            value = doc.pop(field, None)
+            encoded = _encode(value)
+            if encoded is not None:
+                key = blob_id(encoded)
+                hashes[field] = key
+                data[key] = value
+                sizes[key] = len(encoded)
+                refs[key] += 1
+            elif value is not None:
+                # neither text nor JSON, kept inline as before
+                doc[field] = value
+
+    if refs:
+        collection.bulk_write(
+            [
+                UpdateOne(
+                    {"_id": key},
+                    {
+                        "$setOnInsert": {"data": data[key], "size": sizes[key]},
+                        "$inc": {"refs": count},
+                    },
+                    upsert=True,
+                )
+                for key, count in refs.items()
+            ],
+            ordered=False,
+        )
+
+
+def release_blobs(db: Database, docs: Iterable[Dict[str, Any]]) -> None:
+    """Drop the references of ``docs`` and delete the blobs left unused."""
+    refs = Counter(key for doc in docs for key in (doc.get("blobs") or {}).values())
+    if not refs:
+        return
+    db.blobs.bulk_write(
+        [UpdateOne({"_id": key}, {"$inc": {"refs": -n}}) for key, n in refs.items()],
+        ordered=False,
+    )
+    db.blobs.delete_many({"_id": {"$in": list(refs)}, "refs": {"$lte": 0}})
+
+
+def load_blobs(
+    collection: Collection,
+    docs: List[Dict[str, Any]],
+    fields: Optional[List[str]] = None,
+) -> None:
+    """Fill the blob ``fields`` of ``docs`` in place with one query.
+
+    Documents written before blobs existed keep their inline values.
+    """
+    fields = BLOB_FIELDS if fields is None else fields
+    wanted = {
+        doc["blobs"][f] for doc in docs for f in fields if f in (doc.get("blobs") or {})
+    }
+    data = {}
+    if wanted:
+        data = {
+            blob["_id"]: blob["data"]
+            for blob in collection.find({"_id": {"$in": list(wanted)}}, {"data": 1})
+        }
+    for doc in docs:
+        hashes = doc.get("blobs") or {}
+        for field in fields:
+            if field in hashes:
+                doc[field] = data.get(hashes[field])
+            else:
+                doc.setdefault(field, None)
+
+
+def iter_with_blobs(
+    collection: Collection,
+    docs: Iterator[Dict[str, Any]],
+    fields: List[str],
+    batch_size: int = 500,
+) -> Iterator[Dict[str, Any]]:
+    """Stream ``docs`` with their blob ``fields`` loaded a batch at a time."""
+    while True:
+        batch = list(islice(docs, batch_size))
+        if not batch:
+            return
+        load_blobs(collection, batch, fields)
+        yield from batch
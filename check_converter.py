@@ -0,0 +1,271 @@
+import argparse
+import json
+import logging
+import sys
+from collections import defaultdict
+from itertools import product
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Optional, Set, Tuple
+
+from converter import (
+    Graph,
+    GraphConvertConfig,
+    GraphTemplate,
+    IncrementalGraph,
+    MermaidJSFlowchartTemplate,
+    MermaidJSTemplate,
+    PlantUMLTemplate,
+    apply_diff,
+    collapse_packages,
+    convert_graph,
+    generate_nodes_repr,
+    generate_package_repr,
+    legacy_convert_graph,
+    load_graph,
+    process_graph,
+)
+from synthetic_graphs import synthetic_diff, synthetic_graph
+
+TEMPLATES: List[Tuple[str, Callable[[], GraphTemplate]]] = [
+    ("plantuml", PlantUMLTemplate),
+    ("mermaid", MermaidJSTemplate),
+    ("mermaid+links", lambda: MermaidJSTemplate(enable_links=True)),
+    ("flowchart", MermaidJSFlowchartTemplate),
+    ("flowchart+links", lambda: MermaidJSFlowchartTemplate(enable_links=True)),
+]
+
+SYNTHETIC_SHAPES = [
+    dict(nodes=20, edges=40, packages=4, package_depth=2),
+    dict(nodes=200, edges=600, packages=30, package_depth=4, shared_children=0.1),
+    dict(nodes=500, edges=1000, packages=60, package_depth=6, package_cycles=5),
+    dict(nodes=5000, edges=15000, packages=400, package_depth=12, shared_children=0.05),
+    dict(nodes=2000, edges=2000, packages=3000, package_depth=500, package_cycles=20),
+    # more top-level packages than an overview can show
+    dict(nodes=1000, edges=1000, packages=600, package_depth=1),
+]
+
+# node limits the overviews are checked with
+OVERVIEW_LIMITS = [50, 300]
+
+
+def first_difference(expected: str, actual: str) -> str:
+    for line_no, (a, b) in enumerate(
+        zip(expected.split("\n"), actual.split("\n")), start=1
+    ):
+        if a != b:
+            return f"line {line_no}: expected {a!r}, got {b!r}"
+    return f"lengths differ: expected {len(expected)}, got {len(actual)}"
+
+
+def compare(name: str, graph: Graph) -> int:
+    """Render ``graph`` with every configuration through both converters."""
+    mismatches = 0
+    for (template_name, make_template), outside, hide in product(
+        TEMPLATES, (True, False), (True, False)
+    ):
+        expected = legacy_convert_graph(
+            graph,
+            GraphConvertConfig(
+                outside_members=outside,
+                hide_empty_members=hide,
+                graph_template=make_template(),
+            ),
+        )
+        actual = convert_graph(
+            graph,
+            GraphConvertConfig(
+                outside_members=outside,
+                hide_empty_members=hide,
+                graph_template=make_template(),
+            ),
+        )
+        if expected != actual:
+            mismatches += 1
+            logging.error(
+                "%s [%s, outside_members=%s, hide_empty_members=%s]: %s",
+                name,
+                template_name,
+                outside,
+                hide,
+                first_difference(expected, actual),
+            )
+    return mismatches
+
+
+def recursive_package_repr(
+    package_graph: Dict[str, Set[str]],
+    nodes_repr: Dict[str, str],
+    graph_template: GraphTemplate,
+) -> Dict[str, str]:
+    """The original recursive generate_package_repr, kept as a reference."""
+    package_repr = {}
+    visited = set()
+
+    def dfs(package_id: str) -> Optional[str]:
+        if package_id in visited:
+            return None
+        visited.add(package_id)
+
+        components_repr = []
+        for component_id in package_graph[package_id]:
+            if component_id in nodes_repr:
+                components_repr.append(nodes_repr[component_id])
+                del nodes_repr[component_id]
+            elif component_id in package_graph:
+                if component_id in package_repr:
+                    components_repr.append(package_repr[component_id])
+                    del package_repr[component_id]
+                else:
+                    cur_component_repr = dfs(component_id)
+                    if cur_component_repr is not None:
+                        components_repr.append(cur_component_repr)
+
+        return graph_template.package_template(
+            package_id=package_id, content="\n".join(components_repr)
+        )
+
+    for package_id in package_graph:
+        if package_id not in visited:
+            package_repr[package_id] = dfs(package_id)
+
+    return package_repr
+
+
+def compare_packages(name: str, graph: Graph) -> int:
+    """Compare generate_package_repr with the recursive reference."""
+    mismatches = 0
+    for (template_name, make_template), outside in product(TEMPLATES, (True, False)):
+        template = make_template()
+        package_graph = {p.package_id: set(p.children) for p in graph.packages}
+        edges: Dict[str, Dict[str, Optional[str]]] = defaultdict(dict)
+        for e in graph.edges:
+            edges[e.node_id_from][e.node_id_to] = e.description
+        classes, nodes_to_show = process_graph(
+            nodes=graph.nodes,
+            graph=edges,
+            package_graph=package_graph,
+            outside_members=outside,
+        )
+        nodes_repr = generate_nodes_repr(
+            nodes=graph.nodes,
+            classes=classes,
+            nodes_to_show=nodes_to_show,
+            hide_empty_members=True,
+            graph_template=template,
+        )
+        try:
+            expected_nodes = dict(nodes_repr)
+            expected = recursive_package_repr(package_graph, expected_nodes, template)
+        except RecursionError:
+            logging.info("%s: too deep for the recursive reference", name)
+            return mismatches
+        actual = generate_package_repr(package_graph, nodes_repr, template)
+        if expected != actual or expected_nodes != nodes_repr:
+            mismatches += 1
+            logging.error(
+                "%s [%s, outside_members=%s]: generate_package_repr differs",
+                name,
+                template_name,
+                outside,
+            )
+    return mismatches
+
+
+def compare_incremental(name: str, graph: Graph, steps: int = 4) -> int:
+    """Compare IncrementalGraph updates with full conversions of each version."""
+    mismatches = 0
+    for (template_name, make_template), outside in product(TEMPLATES, (True, False)):
+        config = GraphConvertConfig(
+            outside_members=outside, graph_template=make_template()
+        )
+        incremental = IncrementalGraph(graph, config)
+        current = graph
+        for step in range(steps):
+            diff = synthetic_diff(current, structural=step % 2 == 1, seed=step)
+            current = apply_diff(current, diff)
+            expected = convert_graph(current, config)
+            actual = incremental.update(diff)
+            if expected != actual:
+                mismatches += 1
+                logging.error(
+                    "%s [%s, outside_members=%s, step %d]: incremental update: %s",
+                    name,
+                    template_name,
+                    outside,
+                    step,
+                    first_difference(expected, actual),
+                )
+                break
+    return mismatches
+
+
+def check_overview(name: str, graph: Graph) -> int:
+    """Check that collapse_packages stays within max_nodes and counts the rest."""
+    mismatches = 0
+    full, _, _ = collapse_packages(graph)
+    for max_nodes in OVERVIEW_LIMITS:
+        view, collapsed, hidden = collapse_packages(graph, max_nodes=max_nodes)
+        shown = {node.node_id for node in view.nodes}
+        if (
+            len(view.nodes) > max_nodes
+            or len(view.nodes) + hidden != len(full.nodes)
+            or not shown.issuperset(collapsed)
+        ):
+            mismatches += 1
+            logging.error(
+                "%s [max_nodes=%d]: overview has %d nodes and %d hidden of %d",
+                name,
+                max_nodes,
+                len(view.nodes),
+                hidden,
+                len(full.nodes),
+            )
+    return mismatches
+
+
+def dataset_graphs(path: Path) -> Iterator[Tuple[str, Graph]]:
+    with path.open("r", encoding="utf-8") as f:
+        data = json.load(f)
+    for i, item in enumerate(data):
+        yield f"{path.name}[{i}]", load_graph(item["diagram"])
+
+
+def synthetic_graphs(seeds: int) -> Iterator[Tuple[str, Graph]]:
+    for shape, seed in product(SYNTHETIC_SHAPES, range(seeds)):
+        yield f"synthetic{shape}, seed={seed}", synthetic_graph(**shape, seed=seed)
+
+
+def main() -> None:
+    """Main entry point for script execution."""
+    parser = argparse.ArgumentParser(
+        description="Check that convert_graph matches the legacy pipeline."
+    )
+    parser.add_argument(
+        "--dataset",
+        type=Path,
+        default=Path("data/example_dataset.json"),
+        help="Dataset whose diagrams are compared",
+    )
+    parser.add_argument(
+        "--seeds", type=int, default=3, help="Random graphs per synthetic shape"
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s"
+    )
+
+    checked = mismatches = 0
+    for name, graph in [*dataset_graphs(args.dataset), *synthetic_graphs(args.seeds)]:
+        mismatches += compare(name, graph)
+        mismatches += compare_packages(name, graph)
+        mismatches += compare_incremental(name, graph)
+        mismatches += check_overview(name, graph)
+        checked += 1
+
+    logging.info("Compared %d graphs, %d mismatches.", checked, mismatches)
+    sys.exit(1 if mismatches else 0)
+
+
+if __name__ == "__main__":
+    main()
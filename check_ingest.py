@@ -0,0 +1,115 @@
+import argparse
+import io
+import json
+import logging
+import random
+import sys
+from typing import Any, Iterator, List, Tuple
+
+import ingest
+from ingest import IngestError, iter_records
+
+# read sizes the uploads are parsed with, so values cross chunk boundaries
+READ_SIZES = [1, 2, 3, 4, 7, 8, 16, 64, ingest.READ_SIZE]
+
+# payloads that must parse like json.loads
+VALID = [
+    '[\t-2500.0, {"a": 1}]',
+    "[1e5, -0.25E-3, 12345678901234567890, 3]",
+    '[true, false, null, "x", 1.5]',
+    '[ {"code": "a\\nb", "n": [1, 2.5]} ,\n {"diagram": "{}"} ]\n\n',
+    "\ufeff[]",
+]
+
+# payloads that must be rejected
+INVALID = [
+    "[1]x",
+    '[{"a": 1}][{"a": 2}]',
+    "[1, 2",
+    "[1 2]",
+    "[-2500.x]",
+]
+
+
+def parse(payload: str, read_size: int) -> List[Any]:
+    ingest.READ_SIZE = read_size
+    return list(iter_records(io.BytesIO(payload.encode("utf-8"))))
+
+
+def random_value(rng: random.Random, depth: int = 0) -> Any:
+    kind = rng.choice(["int", "float", "str", "const", "list", "dict"][: 6 - depth])
+    if kind == "int":
+        return rng.randint(-(10**6), 10**6)
+    if kind == "float":
+        return rng.uniform(-1e4, 1e4)
+    if kind == "str":
+        return "".join(rng.choice('ab ,]}.\n"é') for _ in range(rng.randint(0, 8)))
+    if kind == "const":
+        return rng.choice([True, False, None])
+    if kind == "list":
+        return [random_value(rng, depth + 2) for _ in range(rng.randint(0, 3))]
+    return {f"k{i}": random_value(rng, depth + 2) for i in range(rng.randint(0, 3))}
+
+
+def random_payloads(seeds: int) -> Iterator[Tuple[str, str]]:
+    for seed in range(seeds):
+        rng = random.Random(seed)
+        values = [random_value(rng) for _ in range(rng.randint(0, 12))]
+        spaces = [rng.choice(["", " ", "\t", "\n "]) for _ in range(len(values) + 1)]
+        body = ",".join(s + json.dumps(v) for s, v in zip(spaces, values))
+        yield f"random seed={seed}", f"[{body}{spaces[-1]}]"
+
+
+def check(name: str, payload: str, valid: bool) -> int:
+    """Parse ``payload`` at every read size, return the number of mismatches."""
+    mismatches = 0
+    expected = json.loads(payload.lstrip("\ufeff")) if valid else None
+    for read_size in READ_SIZES:
+        try:
+            actual = parse(payload, read_size)
+        except IngestError as e:
+            if valid:
+                mismatches += 1
+                logging.error("%s [READ_SIZE=%d]: %s", name, read_size, e)
+            continue
+        if not valid:
+            mismatches += 1
+            logging.error("%s [READ_SIZE=%d]: accepted %r", name, read_size, actual)
+        elif actual != expected:
+            mismatches += 1
+            logging.error(
+                "%s [READ_SIZE=%d]: got %r, expected %r",
+                name,
+                read_size,
+                actual,
+                expected,
+            )
+    return mismatches
+
+
+def main() -> None:
+    """Main entry point for script execution."""
+    parser = argparse.ArgumentParser(
+        description="Check that uploads parse the same whatever the read size."
+    )
+    parser.add_argument(
+        "--seeds", type=int, default=200, help="Random payloads to check"
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s"
+    )
+
+    cases = [
+        *((repr(p), p, True) for p in VALID),
+        *((repr(p), p, False) for p in INVALID),
+        *((name, p, True) for name, p in random_payloads(args.seeds)),
+    ]
+    mismatches = sum(check(name, payload, valid) for name, payload, valid in cases)
+    logging.info("Checked %d payloads, %d mismatches.", len(cases), mismatches)
+    sys.exit(1 if mismatches else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,214 @@
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from itertools import islice
+from pathlib import Path
+from typing import Any, Callable, Deque, Dict, Iterator, List, Optional, Tuple
+
+from converter import (
+    GraphConvertConfig,
+    GraphTemplate,
+    MermaidJSFlowchartTemplate,
+    MermaidJSTemplate,
+    PlantUMLTemplate,
+    convert_str_graph,
+    load_graph,
+)
+from ingest import IngestError, iter_records
+
+TEMPLATES: Dict[str, Callable[[bool], GraphTemplate]] = {
+    "plantuml": lambda links: PlantUMLTemplate(),
+    "mermaid": lambda links: MermaidJSTemplate(enable_links=links),
+    "flowchart": lambda links: MermaidJSFlowchartTemplate(enable_links=links),
+}
+
+# copied into the errors file to identify failing samples
+ERROR_FIELDS = ["repo", "path", "query", "version"]
+
+Result = Tuple[Optional[str], Optional[str]]
+
+
+def convert_chunk(
+    diagrams: List[Any],
+    template: str,
+    outside_members: bool,
+    hide_empty_members: bool,
+    links: bool,
+    validate_only: bool,
+) -> List[Result]:
+    """Worker entry point: convert diagrams into (output, error) pairs."""
+    config = GraphConvertConfig(
+        outside_members=outside_members,
+        hide_empty_members=hide_empty_members,
+        graph_template=TEMPLATES[template](links),
+    )
+    results: List[Result] = []
+    for diagram in diagrams:
+        try:
+            if not isinstance(diagram, str):
+                raise ValueError("diagram is missing or not a string")
+            if validate_only:
+                load_graph(diagram)
+                results.append(("", None))
+                continue
+            results.append((convert_str_graph(diagram, config), None))
+        except Exception as e:
+            results.append((None, f"{type(e).__name__}: {e}"))
+    return results
+
+
+def chunked(items: Iterator[Any], size: int) -> Iterator[List[Any]]:
+    while True:
+        chunk = list(islice(items, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def convert_dataset(
+    records: Iterator[Any],
+    write_output: Callable[[Dict[str, Any]], None],
+    write_error: Callable[[Dict[str, Any]], None],
+    workers: Optional[int],
+    chunk_size: int,
+    convert_args: Tuple[Any, ...],
+) -> Tuple[int, int]:
+    """Convert records on a process pool, writing results in input order.
+
+    At most two chunks per worker are in flight, so memory stays bounded no
+    matter how large the dataset is.
+    """
+    converted = failed = 0
+    index = 0
+
+    workers = workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        window = 2 * workers
+        pending: Deque[Tuple[List[Any], Future]] = deque()
+
+        def drain_one() -> None:
+            nonlocal index, converted, failed
+            items, future = pending.popleft()
+            for item, (output, error) in zip(items, future.result()):
+                if error is None:
+                    converted += 1
+                    write_output({"index": index, **item, "rendered": output})
+                else:
+                    failed += 1
+                    fields = {f: item.get(f) for f in ERROR_FIELDS if f in item}
+                    write_error({"index": index, **fields, "error": error})
+                index += 1
+
+        for chunk in chunked(records, chunk_size):
+            items = [item if isinstance(item, dict) else {} for item in chunk]
+            diagrams = [item.get("diagram") for item in items]
+            pending.append((items, pool.submit(convert_chunk, diagrams, *convert_args)))
+            if len(pending) >= window:
+                drain_one()
+        while pending:
+            drain_one()
+
+    return converted, failed
+
+
+def main() -> None:
+    """Main entry point for script execution."""
+    parser = argparse.ArgumentParser(
+        description="Convert every diagram of a JSON/JSONL dataset in parallel."
+    )
+    parser.add_argument("dataset", type=Path, help="Dataset file (JSON or JSONL)")
+    parser.add_argument(
+        "--template",
+        choices=sorted(TEMPLATES),
+        default="flowchart",
+        help="Output diagram format",
+    )
+    parser.add_argument(
+        "--output",
+        type=Path,
+        default=Path("converted.jsonl"),
+        help="JSONL file receiving each sample with its 'rendered' diagram",
+    )
+    parser.add_argument(
+        "--errors",
+        type=Path,
+        default=Path("conversion_errors.jsonl"),
+        help="JSONL file receiving the samples that failed to convert",
+    )
+    parser.add_argument(
+        "--workers", type=int, default=None, help="Worker processes (default: CPUs)"
+    )
+    parser.add_argument(
+        "--chunk-size", type=int, default=64, help="Diagrams sent to a worker at once"
+    )
+    parser.add_argument(
+        "--outside-members",
+        action=argparse.BooleanOptionalAction,
+        default=True,
+        help="Render class members as separate nodes",
+    )
+    parser.add_argument(
+        "--hide-empty-members",
+        action=argparse.BooleanOptionalAction,
+        default=True,
+        help="Hide empty member boxes",
+    )
+    parser.add_argument(
+        "--links", action="store_true", help="Add click links to Mermaid nodes"
+    )
+    parser.add_argument(
+        "--validate-only",
+        action="store_true",
+        help="Only check that diagrams parse and validate",
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s"
+    )
+
+    started = time.perf_counter()
+    convert_args = (
+        args.template,
+        args.outside_members,
+        args.hide_empty_members,
+        args.links,
+        args.validate_only,
+    )
+    try:
+        with args.dataset.open("rb") as dataset, args.output.open(
+            "w", encoding="utf-8"
+        ) as output, args.errors.open("w", encoding="utf-8") as errors:
+            converted, failed = convert_dataset(
+                iter_records(dataset),
+                lambda row: output.write(json.dumps(row) + "\n"),
+                lambda row: errors.write(json.dumps(row) + "\n"),
+                args.workers,
+                args.chunk_size,
+                convert_args,
+            )
+    except (IngestError, OSError) as e:
+        logging.error("Failed to read %s: %s", args.dataset, e)
+        sys.exit(2)
+
+    elapsed = time.perf_counter() - started
+    total = converted + failed
+    logging.info(
+        "Converted %d of %d diagrams in %.1fs (%.0f/sec), %d failed, see %s",
+        converted,
+        total,
+        elapsed,
+        total / elapsed if elapsed > 0 else total,
+        failed,
+        args.errors,
+    )
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
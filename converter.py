@@ -1,8 +1,24 @@
+import heapq
+import json
+import logging
 import re
 from abc import ABC
 from ast import literal_eval
 from collections import defaultdict
-from typing import Any, Dict, List, Literal, Optional, Set, Tuple, cast
+from typing import (
+    Any,
+    ClassVar,
+    Container,
+    Dict,
+    List,
+    Literal,
+    Optional,
+    Set,
+    Tuple,
+    Union,
+    cast,
+    get_args,
+)
 
 from pydantic import BaseModel, ConfigDict
 
@@ -10,6 +26,7 @@ VISIBILITY_TYPES = Literal[
     "private", "protected", "package private", "package_private", "internal", "public"
 ]
 NODE_TYPES = Literal["class", "variable", "function", "entity", "method", "field"]
+NODE_TYPE_SET = frozenset(get_args(NODE_TYPES))
 
 
 def clean_id(data_id: str) -> str:
@@ -59,13 +76,110 @@ class Graph(SubscriptableBaseModel):
     packages: List[Package]
 
 
+class TrustedRecord:
+    """Plain stand-in for the models above, for data validated beforehand."""
+
+    __slots__ = ()
+
+    def __getitem__(self, key: Any) -> Any:
+        return getattr(self, key)
+
+
+class TrustedNode(TrustedRecord):
+    __slots__ = tuple(Node.model_fields)
+
+    def __init__(
+        self,
+        type: NODE_TYPES,
+        name: str,
+        node_id: str,
+        description: Optional[str],
+        visibility: VISIBILITY_TYPES,
+        return_type: Optional[str] = None,
+        params: Optional[str] = None,
+        source_class_id: Optional[str] = None,
+    ):
+        self.type = type
+        self.name = name
+        self.node_id = node_id
+        self.description = description
+        self.visibility = visibility
+        self.return_type = return_type
+        self.params = params
+        self.source_class_id = source_class_id
+
+
+class TrustedEdge(TrustedRecord):
+    __slots__ = tuple(Edge.model_fields)
+
+    def __init__(
+        self, node_id_from: str, node_id_to: str, description: Optional[str] = None
+    ):
+        self.node_id_from = node_id_from
+        self.node_id_to = node_id_to
+        self.description = description
+
+
+class TrustedPackage(TrustedRecord):
+    __slots__ = tuple(Package.model_fields)
+
+    def __init__(
+        self, package_id: str, children: List[str], description: Optional[str] = None
+    ):
+        self.package_id = package_id
+        self.children = children
+        self.description = description
+
+
+class TrustedGraph(TrustedRecord):
+    __slots__ = tuple(Graph.model_fields)
+
+    def __init__(
+        self,
+        nodes: List[TrustedNode],
+        edges: List[TrustedEdge],
+        packages: List[TrustedPackage],
+    ):
+        self.nodes = nodes
+        self.edges = edges
+        self.packages = packages
+
+
+class RenderContext:
+    """Per-conversion state, so that one template can serve many conversions."""
+
+    __slots__ = ("links",)
+
+    def __init__(self) -> None:
+        self.links: List[str] = []
+
+
 class GraphTemplate(ABC):
+    """Turns graph elements into diagram text.
+
+    Templates hold no per-conversion state and can be shared between threads;
+    anything collected while converting goes into a RenderContext.
+    """
+
+    __slots__ = ()
+
+    VISIBILITY_MAP: ClassVar[Dict[VISIBILITY_TYPES, str]] = {
+        cast(VISIBILITY_TYPES, "private"): "-",
+        cast(VISIBILITY_TYPES, "protected"): "#",
+        cast(VISIBILITY_TYPES, "package private"): "~",
+        cast(VISIBILITY_TYPES, "package_private"): "~",
+        cast(VISIBILITY_TYPES, "internal"): "~",
+        cast(VISIBILITY_TYPES, "public"): "+",
+    }
+    NODE_TYPE_MAP: ClassVar[Dict[NODE_TYPES, str]] = {}
+
     def node_to_str(
         self,
         node: Node,
         methods: List[Node],
         fields: List[Node],
         hide_empty_members: bool,
+        context: Optional[RenderContext] = None,
     ) -> Optional[str]:
         if node.type in ("class", "entity"):
             fields_repr = [
@@ -107,6 +221,11 @@ class GraphTemplate(ABC):
         else:
             return None
 
+        if context is not None:
+            link = self.link_template(name=node.name, node_id=node.node_id)
+            if link is not None:
+                context.links.append(link)
+
         return self.node_template(
             name=node.name,
             node_id=node.node_id,
@@ -137,6 +256,10 @@ class GraphTemplate(ABC):
     def package_template(self, package_id: str, content: str) -> str:
         raise NotImplementedError()
 
+    def link_template(self, name: str, node_id: str) -> Optional[str]:
+        """Click link emitted after the diagram content, if any."""
+        return None
+
     def function_template(
         self,
         name: str,
@@ -155,26 +278,33 @@ class GraphTemplate(ABC):
     def diagram_template(self, content: str, hide_empty_members: bool):
         raise NotImplementedError()
 
+    # streaming counterparts of package_template and diagram_template:
+    # open + content + close gives the same text
 
-class PlantUMLTemplate(GraphTemplate):
-    def __init__(self):
-        self.VISIBILITY_MAP: Dict[VISIBILITY_TYPES, str] = {
-            cast(VISIBILITY_TYPES, "private"): "-",
-            cast(VISIBILITY_TYPES, "protected"): "#",
-            cast(VISIBILITY_TYPES, "package private"): "~",
-            cast(VISIBILITY_TYPES, "package_private"): "~",
-            cast(VISIBILITY_TYPES, "internal"): "~",
-            cast(VISIBILITY_TYPES, "public"): "+",
-        }
+    def package_open(self, package_id: str) -> str:
+        raise NotImplementedError()
+
+    def package_close(self, package_id: str) -> str:
+        raise NotImplementedError()
+
+    def diagram_open(self, hide_empty_members: bool) -> str:
+        raise NotImplementedError()
+
+    def diagram_close(self, hide_empty_members: bool) -> str:
+        raise NotImplementedError()
 
-        self.NODE_TYPE_MAP: Dict[NODE_TYPES, str] = {
-            cast(NODE_TYPES, "class"): "",
-            cast(NODE_TYPES, "variable"): "<< (V,cyan) >>",
-            cast(NODE_TYPES, "function"): "<< (F,orange) >>",
-            cast(NODE_TYPES, "entity"): "<< (E,orchid) >>",
-            cast(NODE_TYPES, "method"): "<< (M,tomato) >>",
-            cast(NODE_TYPES, "field"): "<< (f,lightblue) >>",
-        }
+
+class PlantUMLTemplate(GraphTemplate):
+    __slots__ = ()
+
+    NODE_TYPE_MAP: ClassVar[Dict[NODE_TYPES, str]] = {
+        cast(NODE_TYPES, "class"): "",
+        cast(NODE_TYPES, "variable"): "<< (V,cyan) >>",
+        cast(NODE_TYPES, "function"): "<< (F,orange) >>",
+        cast(NODE_TYPES, "entity"): "<< (E,orchid) >>",
+        cast(NODE_TYPES, "method"): "<< (M,tomato) >>",
+        cast(NODE_TYPES, "field"): "<< (f,lightblue) >>",
+    }
 
     def node_template(
         self,
@@ -242,27 +372,37 @@ class PlantUMLTemplate(GraphTemplate):
             ]
         )
 
+    def package_open(self, package_id: str) -> str:
+        return f"package {package_id}" + " {\n"
+
+    def package_close(self, package_id: str) -> str:
+        return "\n}"
+
+    def diagram_open(self, hide_empty_members: bool) -> str:
+        return "@startuml\nset separator none\n" + (
+            "hide empty members\n" if hide_empty_members else ""
+        )
+
+    def diagram_close(self, hide_empty_members: bool) -> str:
+        return "\n@enduml"
+
 
 class MermaidJSTemplate(GraphTemplate):
+    __slots__ = ("enable_links",)
+
+    NODE_TYPE_MAP: ClassVar[Dict[NODE_TYPES, str]] = {
+        cast(NODE_TYPES, "class"): "",
+        cast(NODE_TYPES, "variable"): "<<Variable>>",
+        cast(NODE_TYPES, "function"): "<<Function>>",
+        cast(NODE_TYPES, "entity"): "<<Entity>>",
+        cast(NODE_TYPES, "method"): "<<Method>>",
+        cast(NODE_TYPES, "field"): "<<Field>>",
+    }
+
     def __init__(self, enable_links: bool = False):
-        self.VISIBILITY_MAP: Dict[VISIBILITY_TYPES, str] = {
-            cast(VISIBILITY_TYPES, "private"): "-",
-            cast(VISIBILITY_TYPES, "protected"): "#",
-            cast(VISIBILITY_TYPES, "package private"): "~",
-            cast(VISIBILITY_TYPES, "package_private"): "~",
-            cast(VISIBILITY_TYPES, "internal"): "~",
-            cast(VISIBILITY_TYPES, "public"): "+",
-        }
-        self.NODE_TYPE_MAP: Dict[NODE_TYPES, str] = {
-            cast(NODE_TYPES, "class"): "",
-            cast(NODE_TYPES, "variable"): "<<Variable>>",
-            cast(NODE_TYPES, "function"): "<<Function>>",
-            cast(NODE_TYPES, "entity"): "<<Entity>>",
-            cast(NODE_TYPES, "method"): "<<Method>>",
-            cast(NODE_TYPES, "field"): "<<Field>>",
-        }
+        # class diagrams never rendered their click links, the flag is kept
+        # for configurations and cache keys that mention it
         self.enable_links = enable_links
-        self.links = []
 
     def node_template(
         self,
@@ -290,8 +430,6 @@ class MermaidJSTemplate(GraphTemplate):
         if len(methods) > 0:
             template += methods
         template.append("}")
-        if self.enable_links:
-            self.links.append(f"click {name} href \"javascript:markNode('{name}')\"")
         return "\n".join(template)
 
     def edge_template(
@@ -335,27 +473,37 @@ class MermaidJSTemplate(GraphTemplate):
             ]
         )
 
+    def package_open(self, package_id: str) -> str:
+        return f"namespace {package_id}" + " {\n"
+
+    def package_close(self, package_id: str) -> str:
+        return "\n}"
+
+    def diagram_open(self, hide_empty_members: bool) -> str:
+        return (
+            "---\nconfig:\n\tclass:\n\t\thideEmptyMembersBox: true\n---\n\n"
+            if hide_empty_members
+            else ""
+        ) + "classDiagram\n"
+
+    def diagram_close(self, hide_empty_members: bool) -> str:
+        return ""
+
 
 class MermaidJSFlowchartTemplate(GraphTemplate):
+    __slots__ = ("enable_links",)
+
+    NODE_TYPE_MAP: ClassVar[Dict[NODE_TYPES, str]] = {
+        cast(NODE_TYPES, "class"): "baseClass",
+        cast(NODE_TYPES, "variable"): "variable",
+        cast(NODE_TYPES, "function"): "function",
+        cast(NODE_TYPES, "entity"): "entity",
+        cast(NODE_TYPES, "method"): "method",
+        cast(NODE_TYPES, "field"): "field",
+    }
+
     def __init__(self, enable_links: bool = False):
-        self.VISIBILITY_MAP: Dict[VISIBILITY_TYPES, str] = {
-            cast(VISIBILITY_TYPES, "private"): "-",
-            cast(VISIBILITY_TYPES, "protected"): "#",
-            cast(VISIBILITY_TYPES, "package private"): "~",
-            cast(VISIBILITY_TYPES, "package_private"): "~",
-            cast(VISIBILITY_TYPES, "internal"): "~",
-            cast(VISIBILITY_TYPES, "public"): "+",
-        }
-        self.NODE_TYPE_MAP: Dict[NODE_TYPES, str] = {
-            cast(NODE_TYPES, "class"): "baseClass",
-            cast(NODE_TYPES, "variable"): "variable",
-            cast(NODE_TYPES, "function"): "function",
-            cast(NODE_TYPES, "entity"): "entity",
-            cast(NODE_TYPES, "method"): "method",
-            cast(NODE_TYPES, "field"): "field",
-        }
         self.enable_links = enable_links
-        self.links = []
 
     def node_template(
         self,
@@ -377,12 +525,13 @@ class MermaidJSFlowchartTemplate(GraphTemplate):
             node_content += methods
         template.append('<hr color="black"/>'.join(node_content))
         template.append(f'"]:::{self.NODE_TYPE_MAP[node_type]}')
-        if self.enable_links:
-            self.links.append(
-                f"click {node_id} href \"javascript:markNode('{node_id}')\""
-            )
         return "\n".join(template)
 
+    def link_template(self, name: str, node_id: str) -> Optional[str]:
+        if not self.enable_links:
+            return None
+        return f"click {node_id} href \"javascript:markNode('{node_id}')\""
+
     def edge_template(
         self, node_id_from: str, node_id_to: str, description: Optional[str] = None
     ) -> str:
@@ -431,6 +580,27 @@ class MermaidJSFlowchartTemplate(GraphTemplate):
             ]
         )
 
+    def package_open(self, package_id: str) -> str:
+        return f"subgraph {package_id}\n"
+
+    def package_close(self, package_id: str) -> str:
+        return "\nend"
+
+    def diagram_open(self, hide_empty_members: bool) -> str:
+        return "flowchart TB\n"
+
+    def diagram_close(self, hide_empty_members: bool) -> str:
+        return "\n" + "\n".join(
+            [
+                "classDef baseClass fill:lightgreen",
+                "classDef variable fill:PaleTurquoise",
+                "classDef function fill:PapayaWhip",
+                "classDef entity fill:Thistle",
+                "classDef method fill:Coral",
+                "classDef field fill:lightblue",
+            ]
+        )
+
 
 def generate_nodes_repr(
     nodes: List[Node],
@@ -438,6 +608,7 @@ def generate_nodes_repr(
     nodes_to_show: Set[str],
     hide_empty_members: bool,
     graph_template: GraphTemplate,
+    context: Optional[RenderContext] = None,
 ) -> Dict[str, str]:
     nodes_repr = {}
     for node in nodes:
@@ -445,7 +616,7 @@ def generate_nodes_repr(
             methods = classes.get(node.node_id, {}).get("methods", [])
             fields = classes.get(node.node_id, {}).get("fields", [])
             cur_repr = graph_template.node_to_str(
-                node, methods, fields, hide_empty_members
+                node, methods, fields, hide_empty_members, context
             )
             if cur_repr is not None:
                 nodes_repr[node.node_id] = cur_repr
@@ -469,42 +640,116 @@ def generate_edges_repr(
     return edges_repr
 
 
+class PackageTree:
+    """Package containment resolved once with an explicit stack.
+
+    Placement follows the depth-first order packages were always rendered in:
+    a node goes to the first package reaching it, a package first rendered at
+    top level moves into the first package listing it afterwards, and any
+    other repeated reference is dropped. Dropped references are recorded as
+    ``(parent, package)`` pairs in ``cycles`` when the package is an ancestor
+    of its parent and in ``shared`` when it already has another parent.
+    """
+
+    def __init__(
+        self, package_graph: Dict[str, Set[str]], node_ids: Container[str]
+    ) -> None:
+        placed: Set[str] = set()
+        visited: Set[str] = set()
+        on_path: Set[str] = set()
+        roots: Dict[str, None] = {}
+        contents: Dict[str, List[Tuple[bool, str]]] = {}
+        self.cycles: List[Tuple[str, str]] = []
+        self.shared: List[Tuple[str, str]] = []
+
+        for root_id in package_graph:
+            if root_id in visited:
+                continue
+            visited.add(root_id)
+            on_path.add(root_id)
+            contents[root_id] = []
+            stack = [(root_id, iter(package_graph[root_id]))]
+            while stack:
+                package_id, children = stack[-1]
+                items = contents[package_id]
+                for component_id in children:
+                    if component_id in node_ids and component_id not in placed:
+                        placed.add(component_id)
+                        items.append((False, component_id))
+                    elif component_id in package_graph:
+                        if component_id in roots:
+                            del roots[component_id]
+                            items.append((True, component_id))
+                        elif component_id not in visited:
+                            visited.add(component_id)
+                            on_path.add(component_id)
+                            contents[component_id] = []
+                            items.append((True, component_id))
+                            stack.append(
+                                (component_id, iter(package_graph[component_id]))
+                            )
+                            break
+                        elif component_id in on_path:
+                            self.cycles.append((package_id, component_id))
+                        else:
+                            self.shared.append((package_id, component_id))
+                else:
+                    on_path.discard(package_id)
+                    stack.pop()
+            roots[root_id] = None
+
+        self.placed = placed
+        self.roots = list(roots)
+        self.contents = contents
+
+    def write(
+        self,
+        out: List[str],
+        root_id: str,
+        node_text: Dict[str, str],
+        graph_template: GraphTemplate,
+        slots: Optional[Dict[str, int]] = None,
+    ) -> None:
+        """Append the text of package ``root_id`` to ``out``.
+
+        ``slots`` receives the index in ``out`` of every node block.
+        """
+        out.append(graph_template.package_open(root_id))
+        stack = [(root_id, iter(self.contents[root_id]))]
+        first = True
+        while stack:
+            package_id, items = stack[-1]
+            for is_package, item_id in items:
+                if not first:
+                    out.append("\n")
+                first = False
+                if is_package:
+                    out.append(graph_template.package_open(item_id))
+                    stack.append((item_id, iter(self.contents[item_id])))
+                    first = True
+                    break
+                if slots is not None:
+                    slots[item_id] = len(out)
+                out.append(node_text[item_id])
+            else:
+                out.append(graph_template.package_close(package_id))
+                stack.pop()
+                first = False
+
+
 def generate_package_repr(
     package_graph: Dict[str, Set[str]],
     nodes_repr: Dict[str, str],
     graph_template: GraphTemplate,
 ) -> Dict[str, str]:
+    tree = PackageTree(package_graph, nodes_repr)
     package_repr = {}
-    visited = set()
-
-    def dfs(package_id: str) -> Optional[str]:
-        if package_id in visited:
-            # return None to avoid recursion
-            return None
-        visited.add(package_id)
-
-        components_repr = []
-        for component_id in package_graph[package_id]:
-            if component_id in nodes_repr:
-                components_repr.append(nodes_repr[component_id])
-                del nodes_repr[component_id]
-            elif component_id in package_graph:
-                if component_id in package_repr:
-                    components_repr.append(package_repr[component_id])
-                    del package_repr[component_id]
-                else:
-                    cur_component_repr = dfs(component_id)
-                    if cur_component_repr is not None:
-                        components_repr.append(cur_component_repr)
-
-        return graph_template.package_template(
-            package_id=package_id, content="\n".join(components_repr)
-        )
-
-    for package_id in package_graph:
-        if package_id not in visited:
-            package_repr[package_id] = dfs(package_id)
-
+    for root_id in tree.roots:
+        out: List[str] = []
+        tree.write(out, root_id, nodes_repr, graph_template)
+        package_repr[root_id] = "".join(out)
+    for node_id in tree.placed:
+        del nodes_repr[node_id]
     return package_repr
 
 
@@ -569,16 +814,18 @@ def process_graph(
 
 
 class GraphConvertConfig(SubscriptableBaseModel):
-    model_config = ConfigDict(arbitrary_types_allowed=True)
+    # frozen, and templates are stateless, so configs can be shared freely
+    model_config = ConfigDict(arbitrary_types_allowed=True, frozen=True)
 
     outside_members: bool = True
     hide_empty_members: bool = True
     graph_template: GraphTemplate = PlantUMLTemplate()
 
 
-def convert_graph(
+def legacy_convert_graph(
     generated_graph: Graph, graph_convert_config: GraphConvertConfig
 ) -> str:
+    """Multi-pass reference pipeline; convert_graph must match it byte for byte."""
     nodes = generated_graph.nodes
     edges = generated_graph.edges
     packages = generated_graph.packages
@@ -598,12 +845,14 @@ def convert_graph(
         outside_members=graph_convert_config["outside_members"],
     )
 
+    context = RenderContext()
     nodes_repr = generate_nodes_repr(
         nodes=nodes,
         classes=classes,
         nodes_to_show=nodes_to_show,
         hide_empty_members=graph_convert_config["hide_empty_members"],
         graph_template=graph_convert_config["graph_template"],
+        context=context,
     )
     edges_repr = generate_edges_repr(
         graph=graph,
@@ -616,15 +865,9 @@ def convert_graph(
         graph_template=graph_convert_config["graph_template"],
     )
 
-    links = []
-
-    if type(graph_convert_config.graph_template) is MermaidJSFlowchartTemplate:
-        if graph_convert_config.graph_template.enable_links:
-            links = graph_convert_config.graph_template.links
-
     result = graph_convert_config.graph_template.diagram_template(
         content="\n".join(
-            [*nodes_repr.values(), *package_repr.values(), *edges_repr, *links]
+            [*nodes_repr.values(), *package_repr.values(), *edges_repr, *context.links]
         ),
         hide_empty_members=graph_convert_config["hide_empty_members"],
     )
@@ -632,6 +875,833 @@ def convert_graph(
     return result
 
 
+class CompiledGraph:
+    """A graph indexed once for rendering.
+
+    Members are attached to their classes, package containment is resolved and
+    visible edges are listed, so that rendering is a single traversal writing
+    into one buffer. The output is identical to legacy_convert_graph.
+    """
+
+    def __init__(
+        self, generated_graph: Union[Graph, TrustedGraph], outside_members: bool
+    ):
+        nodes = generated_graph.nodes
+
+        # sets are built and mutated exactly like in process_graph so that
+        # package contents are iterated in the same order
+        package_graph: Dict[str, Set[str]] = {
+            p.package_id: set(p.children) for p in generated_graph.packages
+        }
+        graph: Dict[str, Dict[str, Optional[str]]] = {}
+        for e in generated_graph.edges:
+            graph.setdefault(e.node_id_from, {})[e.node_id_to] = e.description
+
+        node_to_package: Dict[str, str] = {
+            child_id: parent_id
+            for parent_id, children in package_graph.items()
+            for child_id in children
+        }
+        nodes_types: Dict[str, str] = {node.node_id: node.type for node in nodes}
+
+        classes: Dict[str, Dict[str, List[Node]]] = {}
+        shown: List[Node] = []
+        for node in nodes:
+            source_class_id = node.source_class_id
+            if (
+                node.type in ("method", "field")
+                and source_class_id is not None
+                and nodes_types.get(source_class_id) == "class"
+            ):
+                node_pkg = node_to_package.get(node.node_id, None)
+                if not outside_members:
+                    members = classes.setdefault(
+                        source_class_id, {"methods": [], "fields": []}
+                    )
+                    members[f"{node.type}s"].append(node)
+                    if node_pkg is not None:
+                        package_graph[node_pkg].discard(node.node_id)
+                    continue
+                class_pkg = node_to_package.get(source_class_id, None)
+                if class_pkg is not None:
+                    if node_pkg is None:
+                        package_graph[class_pkg].add(node.node_id)
+                    else:
+                        package_graph[class_pkg].add(node_pkg)
+                        package_graph[node_pkg].discard(class_pkg)
+            shown.append(node)
+
+        if not outside_members:
+            for source_class_id, members in classes.items():
+                for member in members["methods"] + members["fields"]:
+                    # attach all edges from members to parent class
+                    class_edges = graph.setdefault(source_class_id, {})
+                    class_edges.update(graph.setdefault(member.node_id, {}))
+                    graph[member.node_id] = {}
+
+        nodes_to_show = {node.node_id for node in shown}
+        self.shown = shown
+        self.classes = classes
+        self.adjacency = graph
+        self.edges: List[Tuple[str, str, Optional[str]]] = [
+            (node_id_from, node_id_to, description)
+            for node_id_from, children in graph.items()
+            if node_id_from in nodes_to_show
+            for node_id_to, description in children.items()
+            if node_id_to in nodes_to_show
+        ]
+        node_ids = {n.node_id: None for n in shown if n.type in NODE_TYPE_SET}
+        self.packages = PackageTree(package_graph, node_ids)
+        self.top_nodes = [
+            node_id for node_id in node_ids if node_id not in self.packages.placed
+        ]
+        if self.packages.cycles or self.packages.shared:
+            logging.debug(
+                f"Dropped {len(self.packages.cycles)} cyclic and "
+                f"{len(self.packages.shared)} shared package references"
+            )
+
+    def render(self, graph_template: GraphTemplate, hide_empty_members: bool) -> str:
+        context = RenderContext()
+        node_text: Dict[str, str] = {}
+        for node in self.shown:
+            members = self.classes.get(node.node_id, {})
+            cur_repr = graph_template.node_to_str(
+                node,
+                members.get("methods", []),
+                members.get("fields", []),
+                hide_empty_members,
+                context,
+            )
+            if cur_repr is not None:
+                node_text[node.node_id] = cur_repr
+
+        out = [graph_template.diagram_open(hide_empty_members)]
+        first = True
+
+        def separate() -> None:
+            nonlocal first
+            if not first:
+                out.append("\n")
+            first = False
+
+        for node_id in self.top_nodes:
+            separate()
+            out.append(node_text[node_id])
+
+        for root_id in self.packages.roots:
+            separate()
+            self.packages.write(out, root_id, node_text, graph_template)
+
+        for node_id_from, node_id_to, description in self.edges:
+            separate()
+            out.append(
+                graph_template.edge_template(
+                    node_id_from=node_id_from,
+                    node_id_to=node_id_to,
+                    description=description,
+                )
+            )
+
+        for link in context.links:
+            separate()
+            out.append(link)
+
+        out.append(graph_template.diagram_close(hide_empty_members))
+        return "".join(out)
+
+
+def convert_graph(
+    generated_graph: Union[Graph, TrustedGraph],
+    graph_convert_config: GraphConvertConfig,
+) -> str:
+    compiled = CompiledGraph(
+        generated_graph, outside_members=graph_convert_config["outside_members"]
+    )
+    return compiled.render(
+        graph_template=graph_convert_config["graph_template"],
+        hide_empty_members=graph_convert_config["hide_empty_members"],
+    )
+
+
+class GraphDiff(SubscriptableBaseModel):
+    """Changes between two versions of a graph.
+
+    Nodes and packages are identified by their ids, edges by their
+    ``(node_id_from, node_id_to)`` pair.
+    """
+
+    added_nodes: List[Node] = []
+    removed_nodes: List[str] = []
+    changed_nodes: List[Node] = []
+    added_edges: List[Edge] = []
+    removed_edges: List[Tuple[str, str]] = []
+    changed_edges: List[Edge] = []
+    added_packages: List[Package] = []
+    removed_packages: List[str] = []
+    changed_packages: List[Package] = []
+
+
+def diff_graphs(old: Graph, new: Graph) -> GraphDiff:
+    old_nodes = {n.node_id: n for n in old.nodes}
+    new_nodes = {n.node_id: n for n in new.nodes}
+    old_edges = {(e.node_id_from, e.node_id_to): e for e in old.edges}
+    new_edges = {(e.node_id_from, e.node_id_to): e for e in new.edges}
+    old_packages = {p.package_id: p for p in old.packages}
+    new_packages = {p.package_id: p for p in new.packages}
+    return GraphDiff(
+        added_nodes=[n for k, n in new_nodes.items() if k not in old_nodes],
+        removed_nodes=[k for k in old_nodes if k not in new_nodes],
+        changed_nodes=[
+            n for k, n in new_nodes.items() if k in old_nodes and old_nodes[k] != n
+        ],
+        added_edges=[e for k, e in new_edges.items() if k not in old_edges],
+        removed_edges=[k for k in old_edges if k not in new_edges],
+        changed_edges=[
+            e
+            for k, e in new_edges.items()
+            if k in old_edges and old_edges[k].description != e.description
+        ],
+        added_packages=[p for k, p in new_packages.items() if k not in old_packages],
+        removed_packages=[k for k in old_packages if k not in new_packages],
+        changed_packages=[
+            p
+            for k, p in new_packages.items()
+            if k in old_packages and old_packages[k] != p
+        ],
+    )
+
+
+def apply_diff(generated_graph: Graph, diff: GraphDiff) -> Graph:
+    """Apply ``diff``: changed items keep their place, added ones go last.
+
+    Edges come out grouped by source node, in the order the converter reads
+    them, so a group emptied by the diff and filled again moves to the end.
+    """
+    removed_nodes = set(diff.removed_nodes)
+    changed_nodes = {n.node_id: n for n in diff.changed_nodes}
+    removed_packages = set(diff.removed_packages)
+    changed_packages = {p.package_id: p for p in diff.changed_packages}
+
+    edges: Dict[str, Dict[str, Edge]] = {}
+    for e in generated_graph.edges:
+        edges.setdefault(e.node_id_from, {})[e.node_id_to] = e
+    for node_id_from, node_id_to in diff.removed_edges:
+        children = edges.get(node_id_from, {})
+        if children.pop(node_id_to, None) is not None and not children:
+            del edges[node_id_from]
+    for e in diff.changed_edges:
+        children = edges.get(e.node_id_from, {})
+        if e.node_id_to in children:
+            children[e.node_id_to] = e
+    for e in diff.added_edges:
+        edges.setdefault(e.node_id_from, {})[e.node_id_to] = e
+
+    return Graph.model_construct(
+        nodes=[
+            changed_nodes.get(n.node_id, n)
+            for n in generated_graph.nodes
+            if n.node_id not in removed_nodes
+        ]
+        + diff.added_nodes,
+        edges=[e for children in edges.values() for e in children.values()],
+        packages=[
+            changed_packages.get(p.package_id, p)
+            for p in generated_graph.packages
+            if p.package_id not in removed_packages
+        ]
+        + diff.added_packages,
+    )
+
+
+class IncrementalGraph:
+    """A rendered graph that is kept up to date with GraphDiffs.
+
+    The diagram is kept as a list of text segments with one slot per node
+    block, plus cached edge lines. Attribute changes of nodes and added,
+    removed or changed edges are applied in place, rendering only the touched
+    blocks and lines. Diffs that move nodes between packages or change class
+    membership re-index the graph but still reuse every cached block.
+    ``update`` always returns the same text as
+    ``convert_graph(apply_diff(graph, diff), config)``.
+    """
+
+    def __init__(
+        self,
+        generated_graph: Union[Graph, TrustedGraph],
+        graph_convert_config: GraphConvertConfig,
+    ):
+        self.config = graph_convert_config
+        self.nodes: Dict[str, Node] = {n.node_id: n for n in generated_graph.nodes}
+        self.edges: Dict[str, Dict[str, Optional[str]]] = {}
+        for e in generated_graph.edges:
+            self.edges.setdefault(e.node_id_from, {})[e.node_id_to] = e.description
+        self.packages: Dict[str, Package] = {
+            p.package_id: p for p in generated_graph.packages
+        }
+        # repeated ids cannot be tracked by id, such graphs are fully
+        # re-rendered on every update
+        self.graph: Optional[Union[Graph, TrustedGraph]] = None
+        if len(self.nodes) != len(generated_graph.nodes) or len(self.packages) != len(
+            generated_graph.packages
+        ):
+            self.graph = generated_graph
+
+        self.node_text: Dict[str, str] = {}
+        self.links: Dict[str, Optional[str]] = {}
+        self._edge_lines: Dict[Tuple[str, str, Optional[str]], str] = {}
+        self._rebuild(set())
+
+    def _render_node(self, node: Node) -> None:
+        members = self.compiled.classes.get(node.node_id, {})
+        context = RenderContext()
+        text = self.config.graph_template.node_to_str(
+            node,
+            members.get("methods", []),
+            members.get("fields", []),
+            self.config.hide_empty_members,
+            context,
+        )
+        if text is None:
+            self.node_text.pop(node.node_id, None)
+        else:
+            self.node_text[node.node_id] = text
+        self.links[node.node_id] = context.links[0] if context.links else None
+
+    def _edge_line(
+        self, node_id_from: str, node_id_to: str, description: Optional[str]
+    ) -> Optional[str]:
+        if node_id_from not in self.shown or node_id_to not in self.shown:
+            return None
+        key = (node_id_from, node_id_to, description)
+        line = self._edge_lines.get(key)
+        if line is None:
+            line = self.config.graph_template.edge_template(
+                node_id_from=node_id_from,
+                node_id_to=node_id_to,
+                description=description,
+            )
+            self._edge_lines[key] = line
+        return line
+
+    def _group_text(self, node_id_from: str, children: Dict[str, Any]) -> str:
+        return "\n".join(
+            line
+            for node_id_to, description in children.items()
+            for line in [self._edge_line(node_id_from, node_id_to, description)]
+            if line is not None
+        )
+
+    def _snapshot(self) -> TrustedGraph:
+        return TrustedGraph(
+            nodes=list(self.nodes.values()),
+            edges=[
+                TrustedEdge(node_id_from, node_id_to, description)
+                for node_id_from, children in self.edges.items()
+                for node_id_to, description in children.items()
+            ],
+            packages=list(self.packages.values()),
+        )
+
+    def _rebuild(self, stale: Set[str]) -> None:
+        """Re-index the whole graph, rendering only ``stale`` and unseen nodes."""
+        compiled = self.compiled = CompiledGraph(
+            self._snapshot(), self.config.outside_members
+        )
+        self.shown = {node.node_id for node in compiled.shown}
+        self.members = {
+            member.node_id: class_id
+            for class_id, members in compiled.classes.items()
+            for member in members["methods"] + members["fields"]
+        }
+
+        node_text, links = self.node_text, self.links
+        self.node_text, self.links = {}, {}
+        for node in compiled.shown:
+            node_id = node.node_id
+            if node_id in stale or node_id not in links:
+                self._render_node(node)
+            else:
+                if node_id in node_text:
+                    self.node_text[node_id] = node_text[node_id]
+                self.links[node_id] = links[node_id]
+
+        edge_lines = self._edge_lines
+        self._edge_lines = {}
+        for node_id_from, children in compiled.adjacency.items():
+            for node_id_to, description in children.items():
+                key = (node_id_from, node_id_to, description)
+                if key in edge_lines:
+                    self._edge_lines[key] = edge_lines[key]
+        self.group_text = {
+            node_id_from: self._group_text(node_id_from, children)
+            for node_id_from, children in compiled.adjacency.items()
+        }
+
+        # same layout as CompiledGraph.render, remembering where each node
+        # block sits; edges and links are filled in by render
+        template = self.config.graph_template
+        segments = [template.diagram_open(self.config.hide_empty_members)]
+        self.slots: Dict[str, int] = {}
+        for i, node_id in enumerate(compiled.top_nodes):
+            if i:
+                segments.append("\n")
+            self.slots[node_id] = len(segments)
+            segments.append(self.node_text[node_id])
+        for i, root_id in enumerate(compiled.packages.roots):
+            if i or compiled.top_nodes:
+                segments.append("\n")
+            compiled.packages.write(
+                segments, root_id, self.node_text, template, self.slots
+            )
+        self.has_blocks = bool(compiled.top_nodes or compiled.packages.roots)
+        segments += ["", "", template.diagram_close(self.config.hide_empty_members)]
+        self.segments = segments
+        self._edges_dirty = self._links_dirty = True
+
+    def _is_local_group(self, node_id_from: str) -> bool:
+        # without outside members, edges of members are folded into the groups
+        # of their classes, which are appended after all other groups
+        if self.config.outside_members:
+            return True
+        if node_id_from in self.members or node_id_from in self.compiled.classes:
+            return False
+        return node_id_from in self.edges or not self.compiled.classes
+
+    def update(self, diff: GraphDiff) -> str:
+        """Apply ``diff`` and return the new diagram text."""
+        if self.graph is None and (
+            any(n.node_id in self.nodes for n in diff.added_nodes)
+            or any(p.package_id in self.packages for p in diff.added_packages)
+        ):
+            self.graph = self._snapshot()
+        if self.graph is not None:
+            self.graph = apply_diff(cast(Graph, self.graph), diff)
+            return convert_graph(self.graph, self.config)
+
+        structural = bool(
+            diff.added_nodes
+            or diff.removed_nodes
+            or diff.added_packages
+            or diff.removed_packages
+            or diff.changed_packages
+        )
+        stale: Set[str] = set()
+        changed: List[Node] = []
+        for node in diff.changed_nodes:
+            old = self.nodes.get(node.node_id)
+            if old is None:
+                continue
+            if old.type != node.type or old.source_class_id != node.source_class_id:
+                structural = True
+            self.nodes[node.node_id] = node
+            stale.add(node.node_id)
+            stale.update(c for c in (old.source_class_id, node.source_class_id) if c)
+            changed.append(node)
+
+        for node_id in diff.removed_nodes:
+            old = self.nodes.pop(node_id, None)
+            if old is not None and old.source_class_id:
+                stale.add(old.source_class_id)
+        for node in diff.added_nodes:
+            self.nodes[node.node_id] = node
+            if node.source_class_id:
+                stale.add(node.source_class_id)
+        for package_id in diff.removed_packages:
+            self.packages.pop(package_id, None)
+        for package in diff.changed_packages:
+            if package.package_id in self.packages:
+                self.packages[package.package_id] = package
+        for package in diff.added_packages:
+            self.packages[package.package_id] = package
+
+        # groups keep their place unless they are emptied, groups created
+        # again or for the first time go last
+        edge_groups: Dict[str, None] = {}
+        new_groups: Dict[str, None] = {}
+        for node_id_from, node_id_to in diff.removed_edges:
+            children = self.edges.get(node_id_from, {})
+            if node_id_to in children:
+                del children[node_id_to]
+                if not children:
+                    del self.edges[node_id_from]
+                edge_groups[node_id_from] = None
+        for edge in diff.changed_edges:
+            children = self.edges.get(edge.node_id_from, {})
+            if edge.node_id_to in children:
+                children[edge.node_id_to] = edge.description
+                edge_groups[edge.node_id_from] = None
+        for edge in diff.added_edges:
+            if not structural and not self._is_local_group(edge.node_id_from):
+                structural = True
+            if edge.node_id_from not in self.edges:
+                new_groups[edge.node_id_from] = None
+            self.edges.setdefault(edge.node_id_from, {})[
+                edge.node_id_to
+            ] = edge.description
+            edge_groups[edge.node_id_from] = None
+        if not structural and not all(map(self._is_local_group, edge_groups)):
+            structural = True
+
+        if structural:
+            self._rebuild(stale)
+            return self.render()
+
+        for node in changed:
+            if node.node_id not in self.members:
+                self._render_node(node)
+        for class_id, members in self.compiled.classes.items():
+            if class_id in stale:
+                for kind in ("methods", "fields"):
+                    members[kind] = [self.nodes[m.node_id] for m in members[kind]]
+                self._render_node(self.nodes[class_id])
+        for node_id in stale:
+            if node_id in self.slots:
+                self.segments[self.slots[node_id]] = self.node_text[node_id]
+        self._links_dirty = self._links_dirty or any(
+            self.links.get(node.node_id) is not None for node in changed
+        )
+
+        for node_id_from in edge_groups:
+            if node_id_from in new_groups or node_id_from not in self.edges:
+                self.group_text.pop(node_id_from, None)
+        for node_id_from in [
+            *(g for g in edge_groups if g not in new_groups),
+            *new_groups,
+        ]:
+            if node_id_from in self.edges:
+                self.group_text[node_id_from] = self._group_text(
+                    node_id_from, self.edges[node_id_from]
+                )
+        self._edges_dirty = self._edges_dirty or bool(edge_groups)
+        return self.render()
+
+    def render(self) -> str:
+        segments = self.segments
+        if self._edges_dirty:
+            block = "\n".join(text for text in self.group_text.values() if text)
+            segments[-3] = "\n" + block if block and self.has_blocks else block
+            self._edges_dirty = False
+            self._links_dirty = True
+        if self._links_dirty:
+            block = "\n".join(
+                link
+                for node in self.compiled.shown
+                for link in [self.links.get(node.node_id)]
+                if link is not None
+            )
+            before = self.has_blocks or segments[-3]
+            segments[-2] = "\n" + block if block and before else block
+            self._links_dirty = False
+        return "".join(segments)
+
+
+class Viewport(SubscriptableBaseModel):
+    """Part of a graph to render.
+
+    Nodes up to ``hops`` edges away from the ``focus`` nodes, the contents of
+    package ``package_id`` and the ``top_degree`` most connected nodes are
+    combined. An empty viewport selects the whole graph.
+    """
+
+    focus: List[str] = []
+    hops: int = 1
+    package_id: Optional[str] = None
+    top_degree: Optional[int] = None
+
+    def is_empty(self) -> bool:
+        return not (self.focus or self.package_id or self.top_degree)
+
+
+def node_degrees(generated_graph: Union[Graph, TrustedGraph]) -> Dict[str, int]:
+    degrees = {node.node_id: 0 for node in generated_graph.nodes}
+    for e in generated_graph.edges:
+        if e.node_id_from in degrees:
+            degrees[e.node_id_from] += 1
+        if e.node_id_to in degrees:
+            degrees[e.node_id_to] += 1
+    return degrees
+
+
+def restrict_graph(
+    generated_graph: Union[Graph, TrustedGraph], node_ids: Set[str]
+) -> TrustedGraph:
+    """Keep ``node_ids``, the edges between them and the packages holding them."""
+    packages = {p.package_id: p for p in generated_graph.packages}
+    parents: Dict[str, List[str]] = defaultdict(list)
+    for p in generated_graph.packages:
+        for child_id in p.children:
+            parents[child_id].append(p.package_id)
+
+    kept_packages: Set[str] = set()
+    pending = [parent for node_id in node_ids for parent in parents.get(node_id, [])]
+    while pending:
+        package_id = pending.pop()
+        if package_id not in kept_packages:
+            kept_packages.add(package_id)
+            pending.extend(parents.get(package_id, []))
+
+    return TrustedGraph(
+        nodes=[n for n in generated_graph.nodes if n.node_id in node_ids],
+        edges=[
+            e
+            for e in generated_graph.edges
+            if e.node_id_from in node_ids and e.node_id_to in node_ids
+        ],
+        packages=[
+            TrustedPackage(
+                package_id,
+                [
+                    c
+                    for c in packages[package_id].children
+                    if c in node_ids or c in kept_packages
+                ],
+                packages[package_id].description,
+            )
+            for package_id in packages
+            if package_id in kept_packages
+        ],
+    )
+
+
+def subgraph(
+    generated_graph: Union[Graph, TrustedGraph], viewport: Viewport
+) -> Union[Graph, TrustedGraph]:
+    """Restrict a graph to a viewport; members always follow their classes."""
+    if viewport.is_empty():
+        return generated_graph
+
+    node_ids = {node.node_id for node in generated_graph.nodes}
+    selected: Set[str] = set()
+
+    if viewport.focus:
+        neighbours: Dict[str, List[str]] = defaultdict(list)
+        for e in generated_graph.edges:
+            neighbours[e.node_id_from].append(e.node_id_to)
+            neighbours[e.node_id_to].append(e.node_id_from)
+        frontier = [node_id for node_id in viewport.focus if node_id in node_ids]
+        selected.update(frontier)
+        for _ in range(viewport.hops):
+            frontier = [
+                neighbour
+                for node_id in frontier
+                for neighbour in neighbours.get(node_id, [])
+                if neighbour not in selected
+            ]
+            selected.update(frontier)
+
+    if viewport.package_id is not None:
+        children = {p.package_id: p.children for p in generated_graph.packages}
+        seen = {viewport.package_id}
+        pending = [viewport.package_id]
+        while pending:
+            for child_id in children.get(pending.pop(), []):
+                if child_id in node_ids:
+                    selected.add(child_id)
+                elif child_id in children and child_id not in seen:
+                    seen.add(child_id)
+                    pending.append(child_id)
+
+    if viewport.top_degree:
+        degrees = node_degrees(generated_graph)
+        selected.update(heapq.nlargest(viewport.top_degree, degrees, key=degrees.get))
+
+    selected.update(
+        node.node_id
+        for node in generated_graph.nodes
+        if node.source_class_id in selected
+    )
+    return restrict_graph(generated_graph, selected & node_ids)
+
+
+def collapse_packages(
+    generated_graph: Union[Graph, TrustedGraph],
+    expanded: Container[str] = (),
+    max_nodes: Optional[int] = None,
+) -> Tuple[TrustedGraph, List[str], int]:
+    """Draw every package outside ``expanded`` as a single node.
+
+    A package is owned by the first package listing it, references closing a
+    cycle are ignored. Collapsed packages become entity nodes with the package
+    id, and edges are redirected to them. When more than ``max_nodes`` nodes
+    remain visible, the largest collapsed packages are kept within half of the
+    budget, then contents of expanded packages and the most connected nodes.
+
+    Returns the graph, the ids of the collapsed packages it shows and the
+    number of nodes and collapsed packages left out to stay within
+    ``max_nodes``.
+    """
+    packages = {p.package_id: p for p in generated_graph.packages}
+    nodes = {node.node_id: node for node in generated_graph.nodes}
+
+    parent: Dict[str, str] = {}
+    for p in generated_graph.packages:
+        for child_id in p.children:
+            if child_id in parent or child_id == p.package_id:
+                continue
+            if child_id in packages:
+                ancestor: Optional[str] = p.package_id
+                while ancestor is not None and ancestor != child_id:
+                    ancestor = parent.get(ancestor)
+                if ancestor == child_id:
+                    continue
+            parent[child_id] = p.package_id
+
+    # outermost collapsed package on the way from the root, None if all open
+    collapsed_at: Dict[str, Optional[str]] = {}
+    for package_id in packages:
+        chain = []
+        current: Optional[str] = package_id
+        while current is not None and current not in collapsed_at:
+            chain.append(current)
+            current = parent.get(current)
+        above = collapsed_at[current] if current is not None else None
+        for current in reversed(chain):
+            if above is None and current not in expanded:
+                above = current
+            collapsed_at[current] = above
+
+    def owner(node_id: str) -> str:
+        # members are drawn wherever their class is
+        node = nodes[node_id]
+        placed_id = node_id
+        if node.type in ("method", "field") and node.source_class_id in nodes:
+            placed_id = node.source_class_id
+        package_id = parent.get(placed_id)
+        collapsed = collapsed_at[package_id] if package_id is not None else None
+        return collapsed if collapsed is not None else node_id
+
+    owners = {node_id: owner(node_id) for node_id in nodes}
+    shown_packages = [p for p, c in collapsed_at.items() if c == p]
+    sizes: Dict[str, int] = defaultdict(int)
+    for node_id, owner_id in owners.items():
+        if owner_id != node_id:
+            sizes[owner_id] += 1
+
+    edges: Dict[Tuple[str, str], Union[Edge, TrustedEdge]] = {}
+    for e in generated_graph.edges:
+        node_id_from = owners.get(e.node_id_from, e.node_id_from)
+        node_id_to = owners.get(e.node_id_to, e.node_id_to)
+        key = (node_id_from, node_id_to)
+        if key == (e.node_id_from, e.node_id_to):
+            edges[key] = e
+        elif node_id_from != node_id_to and key not in edges:
+            edges[key] = TrustedEdge(node_id_from, node_id_to)
+
+    visible = {node_id for node_id, owner_id in owners.items() if owner_id == node_id}
+    hidden = 0
+    if max_nodes is not None and len(visible) + len(shown_packages) > max_nodes:
+        degrees: Dict[str, int] = defaultdict(int)
+        for node_id_from, node_id_to in edges:
+            degrees[node_id_from] += 1
+            degrees[node_id_to] += 1
+        # packages get half the budget, or more if fewer nodes need the rest
+        package_budget = max(max_nodes - len(visible), max_nodes // 2)
+        if len(shown_packages) > package_budget:
+            largest = set(
+                heapq.nlargest(
+                    package_budget,
+                    shown_packages,
+                    key=lambda package_id: (sizes[package_id], degrees[package_id]),
+                )
+            )
+            hidden += len(shown_packages) - len(largest)
+            shown_packages = [p for p in shown_packages if p in largest]
+        # members count against the budget of their class
+        members: Dict[str, List[str]] = defaultdict(list)
+        candidates = []
+        for node_id in visible:
+            class_id = nodes[node_id].source_class_id
+            if nodes[node_id].type in ("method", "field") and class_id in nodes:
+                members[class_id].append(node_id)
+            else:
+                candidates.append(node_id)
+        # contents of expanded packages go first, they were asked for
+        candidates.sort(
+            key=lambda node_id: (node_id in parent, degrees[node_id]), reverse=True
+        )
+        budget = max_nodes - len(shown_packages)
+        keep: Set[str] = set()
+        for node_id in candidates:
+            cost = 1 + len(members[node_id])
+            if cost > budget:
+                break
+            budget -= cost
+            keep.add(node_id)
+            keep.update(members[node_id])
+        hidden += len(visible) - len(keep)
+        visible = keep
+
+    graph = TrustedGraph(
+        nodes=[
+            *(n for n in generated_graph.nodes if n.node_id in visible),
+            *(
+                TrustedNode(
+                    type="entity",
+                    name=f"{package_id} (+{sizes[package_id]})",
+                    node_id=package_id,
+                    description=packages[package_id].description,
+                    visibility="public",
+                )
+                for package_id in shown_packages
+            ),
+        ],
+        edges=list(edges.values()),
+        packages=[
+            TrustedPackage(
+                package_id,
+                [
+                    child_id
+                    for child_id in packages[package_id].children
+                    if parent.get(child_id) == package_id
+                ],
+                packages[package_id].description,
+            )
+            for package_id, collapsed in collapsed_at.items()
+            if collapsed is None
+        ],
+    )
+    return restrict_graph(graph, visible | set(shown_packages)), shown_packages, hidden
+
+
+def compact_graph(generated_graph: Union[Graph, TrustedGraph]) -> Dict[str, Any]:
+    """Index-based form of a graph for clients.
+
+    ``nodes`` and ``types`` are parallel lists, ``adjacency[i]`` lists the
+    targets of the edges leaving node ``i`` and ``packages`` maps each
+    package id to the indices of its nodes and the ids of its sub-packages.
+    """
+    position: Dict[str, int] = {}
+    for node in generated_graph.nodes:
+        position.setdefault(node.node_id, len(position))
+    types = [""] * len(position)
+    for node in generated_graph.nodes:
+        types[position[node.node_id]] = node.type
+
+    adjacency: List[List[int]] = [[] for _ in position]
+    seen: Set[Tuple[int, int]] = set()
+    for e in generated_graph.edges:
+        key = (position.get(e.node_id_from, -1), position.get(e.node_id_to, -1))
+        if -1 not in key and key not in seen:
+            seen.add(key)
+            adjacency[key[0]].append(key[1])
+
+    package_ids = {p.package_id for p in generated_graph.packages}
+    packages = {
+        p.package_id: {
+            "nodes": [position[c] for c in p.children if c in position],
+            "packages": [c for c in p.children if c in package_ids],
+        }
+        for p in generated_graph.packages
+    }
+    return {
+        "nodes": list(position),
+        "types": types,
+        "adjacency": adjacency,
+        "packages": packages,
+    }
+
+
 def fix_format(generated_graph_dict: Dict[str, Any]) -> Dict[str, Any]:
     # modify fields
     nodes_ids_map = {
@@ -675,11 +1745,30 @@ def fix_format(generated_graph_dict: Dict[str, Any]) -> Dict[str, Any]:
     return generated_graph_dict
 
 
+PARSED_AS_JSON = "json"
+PARSED_AS_PYTHON = "literal_eval"
+
+NULL_PATTERN = re.compile(r"(?<![a-zA-Z0-9_])null(?![a-zA-Z0-9_])")
+
+
+def parse_graph_str(generated_graph_str: str) -> Tuple[Any, str]:
+    """Parse a generated graph, returning it with the parser that succeeded.
+
+    Strict JSON is tried first; Python reprs (single quotes, True/None) fall
+    back to literal_eval, where a bare null is also accepted.
+    """
+    generated_graph_str = generated_graph_str.strip()
+    try:
+        return json.loads(generated_graph_str), PARSED_AS_JSON
+    except json.JSONDecodeError:
+        pass
+    generated_graph_str_clean = NULL_PATTERN.sub("None", generated_graph_str)
+    return literal_eval(generated_graph_str_clean), PARSED_AS_PYTHON
+
+
 def migration(generated_graph_str: str) -> str:
-    generated_graph_str_clean = re.sub(
-        r"(?<![a-zA-Z0-9_])null(?![a-zA-Z0-9_])", "None", generated_graph_str.strip()
-    )
-    generated_graph_dict = literal_eval(generated_graph_str_clean)
+    generated_graph_dict, parser = parse_graph_str(generated_graph_str)
+    logging.debug(f"Parsed graph with {parser}")
 
     generated_graph_dict_migrated = Graph(nodes=[], edges=[], packages=[])
 
@@ -741,15 +1830,26 @@ def migration(generated_graph_str: str) -> str:
     return str(generated_graph_dict_migrated)
 
 
+def load_graph(generated_graph_str: str) -> Graph:
+    generated_graph_dict, parser = parse_graph_str(generated_graph_str)
+    logging.debug(f"Parsed graph with {parser}")
+    return Graph(**fix_format(generated_graph_dict))
+
+
+def trusted_graph(graph_dict: Dict[str, Any]) -> "TrustedGraph":
+    """Wrap a dict that already went through fix_format and validation (e.g.
+    ``Graph.model_dump()`` stored at ingest) without validating it again."""
+    return TrustedGraph(
+        nodes=[TrustedNode(**node) for node in graph_dict["nodes"]],
+        edges=[TrustedEdge(**edge) for edge in graph_dict["edges"]],
+        packages=[TrustedPackage(**package) for package in graph_dict["packages"]],
+    )
+
+
 def convert_str_graph(
     generated_graph_str: str, graph_convert_config: GraphConvertConfig
 ) -> str:
-    generated_graph_str_clean = re.sub(
-        r"(?<![a-zA-Z0-9_])null(?![a-zA-Z0-9_])", "None", generated_graph_str.strip()
-    )
-    generated_graph_dict = literal_eval(generated_graph_str_clean)
-    generated_graph = Graph(**fix_format(generated_graph_dict))
-    return convert_graph(generated_graph, graph_convert_config)
+    return convert_graph(load_graph(generated_graph_str), graph_convert_config)
 
 
 if __name__ == "__main__":
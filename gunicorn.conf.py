@@ -0,0 +1,17 @@
+import yaml
+
+# gunicorn -c gunicorn.conf.py wsgi:app
+with open("config.yml", "r") as ymlfile:
+    cfg = yaml.safe_load(ymlfile)
+
+server = cfg.get("server", {})
+
+bind = f"{cfg['app']['host']}:{cfg['app']['port']}"
+workers = server.get("workers", 4)
+# threads keep a worker responsive while one request converts or exports
+worker_class = "gthread"
+threads = server.get("threads", 8)
+timeout = server.get("timeout", 120)
+# every worker builds its own app and MongoClient, pymongo is not fork-safe
+preload_app = False
+accesslog = "-"
@@ -0,0 +1,312 @@
+import codecs
+import json
+import time
+from itertools import chain
+from typing import IO, Any, Callable, Dict, Iterator, List, Optional
+
+from bson import ObjectId
+from pydantic import BaseModel
+from pymongo.database import Database
+from pymongo.errors import BulkWriteError, PyMongoError
+
+from blobs import release_blobs, store_blobs
+
+READ_SIZE = 1 << 16
+MAX_REPORTED_ERRORS = 20
+
+_decoder = json.JSONDecoder()
+
+
+class IngestError(ValueError):
+    pass
+
+
+class IngestReport(BaseModel):
+    rows: int = 0
+    failed: int = 0
+    seconds: float = 0.0
+    errors: List[str] = []
+
+    @property
+    def rows_per_sec(self) -> float:
+        return self.rows / self.seconds if self.seconds > 0 else float(self.rows)
+
+    def add_error(self, message: str) -> None:
+        self.failed += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append(message)
+
+    def summary(self) -> str:
+        return (
+            f"{self.rows} rows in {self.seconds:.1f}s "
+            f"({self.rows_per_sec:.0f} rows/sec), {self.failed} failed"
+        )
+
+
+def _read_text(stream: IO[bytes]) -> Iterator[str]:
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    while True:
+        chunk = stream.read(READ_SIZE)
+        if not chunk:
+            tail = decoder.decode(b"", final=True)
+            if tail:
+                yield tail
+            return
+        try:
+            text = decoder.decode(chunk)
+        except UnicodeDecodeError as e:
+            raise IngestError(f"Upload is not valid UTF-8: {e}") from e
+        if text:
+            yield text
+
+
+def _iter_array(chunks: Iterator[str], buf: str) -> Iterator[Any]:
+    # buf starts right after the opening bracket
+    pos = 0
+    first = True
+    expect_value = True
+    exhausted = False
+
+    def refill() -> bool:
+        # grow the buffer geometrically so huge items are not re-parsed per chunk
+        nonlocal buf, pos
+        buf, pos = buf[pos:], 0
+        wanted = max(len(buf), READ_SIZE)
+        added = 0
+        for chunk in chunks:
+            buf += chunk
+            added += len(chunk)
+            if added >= wanted:
+                return True
+        return added > 0
+
+    while True:
+        while pos < len(buf) and buf[pos].isspace():
+            pos += 1
+        if pos == len(buf):
+            if exhausted:
+                raise IngestError("Unexpected end of JSON array")
+            exhausted = not refill()
+            continue
+
+        char = buf[pos]
+        if char == "]" and (first or not expect_value):
+            _expect_end(chunks, buf[pos + 1 :])
+            return
+        if not expect_value:
+            if char != ",":
+                raise IngestError(f"Expected ',' or ']' in JSON array, got {char!r}")
+            pos += 1
+            expect_value = True
+            continue
+
+        try:
+            value, end = _decoder.raw_decode(buf, pos)
+        except json.JSONDecodeError as e:
+            if exhausted:
+                raise IngestError(f"Invalid JSON: {e}") from e
+            # the value may just be cut by a chunk boundary
+            exhausted = not refill()
+            continue
+        if (
+            not exhausted
+            and not isinstance(value, (dict, list, str))
+            and (end == len(buf) or not _ends_value(buf[end]))
+        ):
+            # a number could continue in the next chunk, like -2500|.0
+            exhausted = not refill()
+            continue
+
+        yield value
+        pos = end
+        first = False
+        expect_value = False
+
+
+def _ends_value(char: str) -> bool:
+    return char in ",]" or char.isspace()
+
+
+def _expect_end(chunks: Iterator[str], rest: str) -> None:
+    for text in chain([rest], chunks):
+        if text.strip():
+            raise IngestError(
+                f"Unexpected content after the JSON array: {text.strip()[:20]!r}"
+            )
+
+
+def _iter_lines(chunks: Iterator[str], buf: str) -> Iterator[Any]:
+    line_no = 0
+    pending: List[str] = []
+    for chunk in chain([buf], chunks):
+        if "\n" not in chunk:
+            pending.append(chunk)
+            continue
+        head, *lines, tail = chunk.split("\n")
+        pending.append(head)
+        for line in ["".join(pending), *lines]:
+            line_no += 1
+            if line.strip():
+                yield _parse_line(line, line_no)
+        pending = [tail]
+    line = "".join(pending)
+    if line.strip():
+        yield _parse_line(line, line_no + 1)
+
+
+def _parse_line(line: str, line_no: int) -> Any:
+    try:
+        return json.loads(line)
+    except json.JSONDecodeError as e:
+        raise IngestError(f"Invalid JSON on line {line_no}: {e}") from e
+
+
+def iter_records(stream: IO[bytes]) -> Iterator[Any]:
+    """Yield the items of a JSON array or JSON lines upload one at a time."""
+    chunks = _read_text(stream)
+    buf = ""
+    for chunk in chunks:
+        buf += chunk
+        if buf.strip():
+            break
+    buf = buf.lstrip()
+    if buf.startswith("["):
+        return _iter_array(chunks, buf[1:])
+    return _iter_lines(chunks, buf)
+
+
+def template_document(task_id: ObjectId, item: Dict[str, Any]) -> Dict[str, Any]:
+    # the diagram is validated later, on the RenderQueue workers
+    return {
+        "task_id": task_id,
+        "sample_id": str(ObjectId()),
+        "language": item.get("language"),
+        "code": item.get("code"),
+        "repo": item.get("repo"),
+        "path": item.get("path"),
+        "query": item.get("query"),
+        "diagram": item.get("diagram"),
+        "render_error": None,
+        "version": item.get("version"),
+        "text_answer": item.get("text_answer"),
+        "nodes": "",
+        "notes": "",
+        "status": "Not Annotated",
+        "annotator": "",
+        "template": True,
+    }
+
+
+# Sample fields kept only on the template, annotator records reference them.
+TEMPLATE_FIELDS = [
+    "language",
+    "blobs",
+    "snippet",
+    "code",
+    "repo",
+    "path",
+    "query",
+    "diagram",
+    "graph",
+    "graph_nodes",
+    "render_error",
+    "rendered_diagram",
+    "version",
+    "text_answer",
+]
+
+
+def annotator_document(template: Dict[str, Any]) -> Dict[str, Any]:
+    """Fields of a new annotator record, other than sample_id and annotator."""
+    return {
+        "task_id": template["task_id"],
+        "template_id": template["_id"],
+        "template": False,
+        "nodes": {
+            "Sufficiency": [],
+            "Completeness": [],
+            "Hallucinations": [],
+            "Verbosity": [],
+        },
+        "missing": [],
+        "notes": "",
+        "status": "Not Annotated",
+        "revision": 0,
+    }
+
+
+def _insert_batch(
+    db: Database,
+    batch: List[Dict[str, Any]],
+    report: IngestReport,
+    on_batch: Optional[Callable[[List[Dict[str, Any]]], None]],
+) -> None:
+    failed_indexes = set()
+    # on_batch renders the diagrams, which move to blobs with the other fields
+    diagrams = [doc.get("diagram") for doc in batch]
+    store_blobs(db.blobs, batch)
+    try:
+        db.annotations.insert_many(batch, ordered=False)
+    except BulkWriteError as e:
+        for error in e.details.get("writeErrors", []):
+            failed_indexes.add(error["index"])
+            report.add_error(error.get("errmsg", "write error"))
+        release_blobs(db, (batch[i] for i in failed_indexes))
+    except PyMongoError:
+        # the caller removes what was inserted, release the rest of the batch
+        ids = [doc["_id"] for doc in batch if "_id" in doc]
+        try:
+            inserted_ids = {
+                doc["_id"]
+                for doc in db.annotations.find({"_id": {"$in": ids}}, {"_id": 1})
+            }
+            release_blobs(
+                db, (doc for doc in batch if doc.get("_id") not in inserted_ids)
+            )
+        except PyMongoError:
+            pass
+        raise
+    inserted = []
+    for i, (doc, diagram) in enumerate(zip(batch, diagrams)):
+        if i not in failed_indexes:
+            doc["diagram"] = diagram
+            inserted.append(doc)
+    report.rows += len(inserted)
+    if inserted:
+        db.tasks.update_one(
+            {"_id": inserted[0]["task_id"]},
+            {"$inc": {"progress.total": len(inserted)}},
+        )
+    if on_batch is not None and inserted:
+        on_batch(inserted)
+
+
+def ingest_task(
+    db: Database,
+    task_id: ObjectId,
+    records: Iterator[Any],
+    batch_size: int = 1000,
+    on_batch: Optional[Callable[[List[Dict[str, Any]]], None]] = None,
+) -> IngestReport:
+    """Insert template annotations for ``task_id`` in unordered batches.
+
+    ``on_batch`` is called with the documents of every inserted batch. Parse
+    errors abort ingestion with an ``IngestError``.
+    """
+    report = IngestReport()
+    started = time.perf_counter()
+    batch: List[Dict[str, Any]] = []
+
+    for i, item in enumerate(records):
+        if not isinstance(item, dict):
+            report.add_error(f"Item {i} is not an object")
+            continue
+        batch.append(template_document(task_id, item))
+        if len(batch) >= batch_size:
+            _insert_batch(db, batch, report, on_batch)
+            batch = []
+    if batch:
+        _insert_batch(db, batch, report, on_batch)
+
+    report.seconds = time.perf_counter() - started
+    return report
@@ -0,0 +1,277 @@
+import argparse
+import json
+import logging
+import random
+import re
+import sys
+import threading
+import time
+from collections import defaultdict
+from http.cookiejar import CookieJar
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+from urllib.error import HTTPError, URLError
+from urllib.parse import urlencode
+from urllib.request import HTTPCookieProcessor, Request, build_opener
+
+import yaml
+from bson import ObjectId
+from pymongo import MongoClient
+from werkzeug.security import generate_password_hash
+
+from progress import reconcile
+
+USER_PREFIX = "loadtest_"
+METRICS = ["Sufficiency", "Completeness", "Hallucinations", "Verbosity", None]
+
+
+def load_config(path: Path) -> dict:
+    """Load YAML configuration from a file."""
+    with path.open("r", encoding="utf-8") as f:
+        return yaml.safe_load(f)
+
+
+def get_db_client(uri: str) -> MongoClient:
+    """Initialize and return a MongoDB client."""
+    return MongoClient(uri)
+
+
+class Recorder:
+    """Latencies and failures per route, shared by the annotator threads."""
+
+    def __init__(self) -> None:
+        self.seconds: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, int] = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def add(self, route: str, seconds: float, ok: bool) -> None:
+        with self._lock:
+            self.seconds[route].append(seconds)
+            if not ok:
+                self.errors[route] += 1
+
+    def report(self, elapsed: float) -> None:
+        total = sum(len(s) for s in self.seconds.values())
+        logging.info(
+            "%d requests in %.1fs (%.1f/sec), %d failed",
+            total,
+            elapsed,
+            total / elapsed,
+            sum(self.errors.values()),
+        )
+        for route, seconds in sorted(self.seconds.items()):
+            seconds = sorted(seconds)
+            logging.info(
+                "%-22s %6d req %5d err  p50 %7.1f ms  p95 %7.1f ms  max %7.1f ms",
+                route,
+                len(seconds),
+                self.errors[route],
+                seconds[len(seconds) // 2] * 1000,
+                seconds[int(len(seconds) * 0.95)] * 1000,
+                seconds[-1] * 1000,
+            )
+
+
+class Annotator:
+    """One simulated annotator with their own session cookie."""
+
+    def __init__(self, base_url: str, recorder: Recorder) -> None:
+        self.base_url = base_url.rstrip("/")
+        self.recorder = recorder
+        self.opener = build_opener(HTTPCookieProcessor(CookieJar()))
+
+    def call(
+        self,
+        route: str,
+        path: str,
+        method: str = "GET",
+        data: Optional[bytes] = None,
+        headers: Optional[Dict[str, str]] = None,
+    ) -> Tuple[int, bytes]:
+        request = Request(
+            self.base_url + path, data=data, method=method, headers=headers or {}
+        )
+        start = time.perf_counter()
+        try:
+            with self.opener.open(request, timeout=60) as response:
+                status, body = response.status, response.read()
+        except HTTPError as e:
+            status, body = e.code, e.read()
+        except URLError as e:
+            logging.debug("%s %s failed: %s", method, path, e)
+            status, body = 0, b""
+        self.recorder.add(route, time.perf_counter() - start, 200 <= status < 400)
+        return status, body
+
+    def login(self, username: str, password: str) -> bool:
+        form = urlencode({"username": username, "password": password}).encode()
+        status, body = self.call("login", "/login", "POST", form)
+        return status == 200 and b"Invalid credentials" not in body
+
+    def session(
+        self, task_id: str, sample_ids: List[str], deadline: float, think: float
+    ) -> None:
+        """Browse, open samples and label nodes until ``deadline``."""
+        while time.time() < deadline:
+            self.call("dashboard", "/dashboard")
+            self.call("dataset", f"/dataset?task_id={task_id}")
+            sample_id = random.choice(sample_ids)
+            status, page = self.call("annotate", f"/annotate/{sample_id}")
+            match = re.search(rb"let revision = (\d+);", page)
+            if status != 200 or match is None:
+                continue
+            revision = int(match.group(1))
+            status, body = self.call("graph", f"/api/annotations/{sample_id}/graph")
+            nodes = json.loads(body)["nodes"] if status == 200 else []
+
+            for _ in range(random.randint(1, 5)):
+                if not nodes or time.time() >= deadline:
+                    break
+                time.sleep(random.uniform(0, think))
+                patch = {
+                    "revision": revision,
+                    "label": {
+                        "node": random.choice(nodes),
+                        "metric": random.choice(METRICS),
+                    },
+                }
+                status, body = self.call(
+                    "autosave",
+                    f"/api/annotations/{sample_id}",
+                    "PATCH",
+                    json.dumps(patch).encode(),
+                    {"Content-Type": "application/json"},
+                )
+                if status != 200:
+                    break
+                revision = json.loads(body)["revision"]
+            time.sleep(random.uniform(0, think))
+
+
+def create_users(db, count: int, password: str) -> List[str]:
+    hashed_pw = generate_password_hash(password)
+    usernames = [f"{USER_PREFIX}{i}" for i in range(count)]
+    for username in usernames:
+        db.users.update_one(
+            {"username": username},
+            {"$set": {"password": hashed_pw, "role": "annotator"}},
+            upsert=True,
+        )
+    return usernames
+
+
+def remove_users(db) -> None:
+    pattern = {"$regex": f"^{USER_PREFIX}"}
+    query = {"annotator": pattern, "template": False}
+    task_ids = db.annotations.distinct("task_id", query)
+    db.annotations.delete_many(query)
+    db.users.delete_many({"username": pattern})
+    reconcile(db, task_ids)
+
+
+def main() -> None:
+    """Main entry point for script execution."""
+    parser = argparse.ArgumentParser(
+        description="Simulate concurrent annotators against a running server."
+    )
+    parser.add_argument(
+        "--config",
+        type=Path,
+        default=Path("config.yml"),
+        help="Path to the YAML config file",
+    )
+    parser.add_argument(
+        "--url", help="Server to load (default: host and port from config)"
+    )
+    parser.add_argument(
+        "--annotators", type=int, default=20, help="Concurrent annotators"
+    )
+    parser.add_argument("--duration", type=float, default=60, help="Seconds to run")
+    parser.add_argument(
+        "--think", type=float, default=1.0, help="Max pause between actions (s)"
+    )
+    parser.add_argument("--task-id", help="Task to annotate (default: the first)")
+    parser.add_argument(
+        "--keep-users",
+        action="store_true",
+        help=f"Keep the {USER_PREFIX}* users and their annotations",
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s"
+    )
+
+    try:
+        cfg = load_config(args.config)
+        client = get_db_client(cfg["mongodb"]["uri"])
+        db = client.get_default_database()
+    except (yaml.YAMLError, FileNotFoundError) as e:
+        logging.error("Error loading config: %s", e)
+        sys.exit(2)
+
+    host = cfg["app"]["host"]
+    url = (
+        args.url
+        or f"http://{'127.0.0.1' if host == '0.0.0.0' else host}:{cfg['app']['port']}"
+    )
+
+    task_query = {"state": {"$nin": ["ingesting", "failed"]}}
+    if args.task_id:
+        task_query["_id"] = ObjectId(args.task_id)
+    task = db.tasks.find_one(task_query, {"_id": 1})
+    if task is None:
+        logging.error("No task to annotate, upload a dataset first.")
+        sys.exit(2)
+    sample_ids = [
+        a["sample_id"]
+        for a in db.annotations.find(
+            {"task_id": task["_id"], "template": True}, {"sample_id": 1}
+        ).limit(500)
+    ]
+    if not sample_ids:
+        logging.error("Task %s has no samples.", task["_id"])
+        sys.exit(2)
+
+    password = f"{USER_PREFIX}{random.getrandbits(32):x}"
+    usernames = create_users(db, args.annotators, password)
+    recorder = Recorder()
+    logging.info(
+        "%d annotators on %s for %.0fs, task %s with %d samples",
+        args.annotators,
+        url,
+        args.duration,
+        task["_id"],
+        len(sample_ids),
+    )
+
+    try:
+        annotators = [Annotator(url, recorder) for _ in usernames]
+        for annotator, username in zip(annotators, usernames):
+            if not annotator.login(username, password):
+                logging.error("Could not log in as %s at %s", username, url)
+                sys.exit(1)
+
+        started = time.perf_counter()
+        deadline = time.time() + args.duration
+        threads = [
+            threading.Thread(
+                target=a.session,
+                args=(str(task["_id"]), sample_ids, deadline, args.think),
+            )
+            for a in annotators
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        recorder.report(time.perf_counter() - started)
+    finally:
+        if not args.keep_users:
+            remove_users(db)
+
+    sys.exit(1 if sum(recorder.errors.values()) else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,202 @@
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from flask import Flask, before_render_template, request, template_rendered
+from pymongo import monitoring
+
+# upper bounds of the request latency histogram, in seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# parts of a request's wall time that are timed separately
+PARTS = ("mongo", "convert", "template")
+
+
+class RequestTimings:
+    """What a single request spent its time on."""
+
+    __slots__ = ("started", "commands", "seconds", "template_started")
+
+    def __init__(self) -> None:
+        self.started = time.perf_counter()
+        self.commands = 0
+        self.seconds = dict.fromkeys(PARTS, 0.0)
+        self.template_started = 0.0
+
+
+_current: ContextVar[Optional[RequestTimings]] = ContextVar(
+    "request_timings", default=None
+)
+
+
+def start_request() -> None:
+    _current.set(RequestTimings())
+
+
+@contextmanager
+def timed(part: str) -> Iterator[None]:
+    """Add the time spent in the block to ``part`` of the current request."""
+    timings = _current.get()
+    if timings is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.seconds[part] += time.perf_counter() - start
+
+
+class CommandTimer(monitoring.CommandListener):
+    """Counts the MongoDB commands of the current request and their duration.
+
+    pymongo reports command events on the thread that issued the command, so
+    they land on the request that caused them.
+    """
+
+    def started(self, event: monitoring.CommandStartedEvent) -> None:
+        pass
+
+    def succeeded(self, event: monitoring.CommandSucceededEvent) -> None:
+        self._add(event.duration_micros)
+
+    def failed(self, event: monitoring.CommandFailedEvent) -> None:
+        self._add(event.duration_micros)
+
+    @staticmethod
+    def _add(duration_micros: int) -> None:
+        timings = _current.get()
+        if timings is not None:
+            timings.commands += 1
+            timings.seconds["mongo"] += duration_micros / 1e6
+
+
+class EndpointStats:
+    __slots__ = ("requests", "seconds", "buckets", "commands", "parts")
+
+    def __init__(self) -> None:
+        self.requests = 0
+        self.seconds = 0.0
+        self.buckets = [0] * len(BUCKETS)
+        self.commands = 0
+        self.parts = dict.fromkeys(PARTS, 0.0)
+
+
+class RequestMetrics:
+    """Per-endpoint totals of the requests served by this process."""
+
+    def __init__(self) -> None:
+        self._stats: Dict[Tuple[str, str], EndpointStats] = {}
+        self._lock = threading.Lock()
+
+    def finish_request(self, endpoint: str, method: str) -> None:
+        timings = _current.get()
+        if timings is None:
+            return
+        _current.set(None)
+        elapsed = time.perf_counter() - timings.started
+        with self._lock:
+            stats = self._stats.setdefault((endpoint, method), EndpointStats())
+            stats.requests += 1
+            stats.seconds += elapsed
+            for i, bound in enumerate(BUCKETS):
+                if elapsed <= bound:
+                    stats.buckets[i] += 1
+            stats.commands += timings.commands
+            for part, seconds in timings.seconds.items():
+                stats.parts[part] += seconds
+
+    def summary(self) -> List[Dict[str, float]]:
+        """Average cost of a request per endpoint, slowest first."""
+        with self._lock:
+            rows = [
+                {
+                    "endpoint": endpoint,
+                    "method": method,
+                    "requests": s.requests,
+                    "total_seconds": s.seconds,
+                    "avg_ms": s.seconds / s.requests * 1000,
+                    "avg_commands": s.commands / s.requests,
+                    **{
+                        f"avg_{part}_ms": seconds / s.requests * 1000
+                        for part, seconds in s.parts.items()
+                    },
+                }
+                for (endpoint, method), s in self._stats.items()
+            ]
+        return sorted(rows, key=lambda row: row["total_seconds"], reverse=True)
+
+    def prometheus(self) -> str:
+        """The totals in the Prometheus text exposition format."""
+        lines = [
+            "# HELP app_request_seconds Wall time of requests.",
+            "# TYPE app_request_seconds histogram",
+        ]
+        with self._lock:
+            stats = sorted(self._stats.items())
+            for (endpoint, method), s in stats:
+                labels = f'endpoint="{endpoint}",method="{method}"'
+                for bound, count in zip(BUCKETS, s.buckets):
+                    lines.append(
+                        f'app_request_seconds_bucket{{{labels},le="{bound}"}} {count}'
+                    )
+                lines += [
+                    f'app_request_seconds_bucket{{{labels},le="+Inf"}} {s.requests}',
+                    f"app_request_seconds_sum{{{labels}}} {s.seconds}",
+                    f"app_request_seconds_count{{{labels}}} {s.requests}",
+                ]
+
+            lines += [
+                "# HELP app_mongo_commands_total MongoDB commands issued by requests.",
+                "# TYPE app_mongo_commands_total counter",
+            ]
+            for (endpoint, method), s in stats:
+                lines.append(
+                    f'app_mongo_commands_total{{endpoint="{endpoint}",'
+                    f'method="{method}"}} {s.commands}'
+                )
+            for part, help_text in (
+                ("mongo", "Time requests waited for MongoDB commands."),
+                ("convert", "Time requests spent converting diagrams."),
+                ("template", "Time requests spent rendering templates."),
+            ):
+                lines += [
+                    f"# HELP app_{part}_seconds_total {help_text}",
+                    f"# TYPE app_{part}_seconds_total counter",
+                ]
+                for (endpoint, method), s in stats:
+                    lines.append(
+                        f'app_{part}_seconds_total{{endpoint="{endpoint}",'
+                        f'method="{method}"}} {s.parts[part]}'
+                    )
+        return "\n".join(lines) + "\n"
+
+
+def instrument(app: Flask, metrics: RequestMetrics) -> None:
+    """Time every request of ``app``; Mongo needs a ``CommandTimer`` too."""
+
+    @app.before_request
+    def _start() -> None:
+        start_request()
+
+    @app.teardown_request
+    def _finish(exc: Optional[BaseException]) -> None:
+        metrics.finish_request(request.endpoint or "unmatched", request.method)
+
+    def _template_started(sender, **extra) -> None:
+        timings = _current.get()
+        if timings is not None:
+            timings.template_started = time.perf_counter()
+
+    def _template_finished(sender, **extra) -> None:
+        timings = _current.get()
+        if timings is not None and timings.template_started:
+            timings.seconds["template"] += (
+                time.perf_counter() - timings.template_started
+            )
+            timings.template_started = 0.0
+
+    before_render_template.connect(_template_started, app, weak=False)
+    template_rendered.connect(_template_finished, app, weak=False)
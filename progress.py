@@ -0,0 +1,178 @@
+import argparse
+import logging
+from collections import defaultdict
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+from urllib.parse import unquote
+
+import yaml
+from bson import ObjectId
+from pymongo import MongoClient, UpdateOne
+from pymongo.collection import Collection
+from pymongo.database import Database
+
+# Each task document carries
+#   progress.total                          number of samples (templates)
+#   progress.status.<status>                annotator records per status
+#   progress.annotators.<key>.<status>      the same, per annotator
+# maintained with $inc by ingest and app.py, rebuilt by reconcile().
+STATUSES = ["Not Annotated", "In Progress", "Finalized"]
+
+
+def annotator_key(username: str) -> str:
+    """Usernames as field names: '.' and '$' would be read as paths."""
+    return username.replace("%", "%25").replace(".", "%2E").replace("$", "%24")
+
+
+def annotator_name(key: str) -> str:
+    return unquote(key)
+
+
+def empty_progress() -> Dict[str, Any]:
+    return {"total": 0, "status": {}, "annotators": {}}
+
+
+def count_new_record(tasks: Collection, task_id: ObjectId, annotator: str) -> None:
+    """Count an annotator record just cloned from its template."""
+    key = annotator_key(annotator)
+    tasks.update_one(
+        {"_id": task_id},
+        {
+            "$inc": {
+                f"progress.status.{STATUSES[0]}": 1,
+                f"progress.annotators.{key}.{STATUSES[0]}": 1,
+            }
+        },
+    )
+
+
+def count_status_change(
+    tasks: Collection, task_id: ObjectId, annotator: str, old: str, new: str
+) -> None:
+    if old == new:
+        return
+    key = annotator_key(annotator)
+    tasks.update_one(
+        {"_id": task_id},
+        {
+            "$inc": {
+                f"progress.status.{old}": -1,
+                f"progress.status.{new}": 1,
+                f"progress.annotators.{key}.{old}": -1,
+                f"progress.annotators.{key}.{new}": 1,
+            }
+        },
+    )
+
+
+def status_counts(counts: Optional[Dict[str, int]]) -> Dict[str, int]:
+    """Counts for every status, zero where nothing was counted yet."""
+    counts = counts or {}
+    return {status: counts.get(status, 0) for status in STATUSES}
+
+
+def reconcile(db: Database, task_ids: Optional[List[ObjectId]] = None) -> int:
+    """Rebuild the counters of ``task_ids`` (default: all tasks) from scratch.
+
+    Returns the number of tasks updated. Saves made while this runs may be
+    lost from the counters, so run it when annotators are idle.
+    """
+    task_query: Dict[str, Any] = {}
+    match: Dict[str, Any] = {}
+    if task_ids is not None:
+        task_query["_id"] = {"$in": task_ids}
+        match["task_id"] = {"$in": task_ids}
+
+    progress: Dict[ObjectId, Dict[str, Any]] = defaultdict(empty_progress)
+    groups = db.annotations.aggregate(
+        [
+            {"$match": match},
+            {
+                "$group": {
+                    "_id": {
+                        "task_id": "$task_id",
+                        "template": "$template",
+                        "annotator": "$annotator",
+                        "status": "$status",
+                    },
+                    "count": {"$sum": 1},
+                }
+            },
+        ],
+        allowDiskUse=True,
+    )
+    for group in groups:
+        task = progress[group["_id"]["task_id"]]
+        count = group["count"]
+        if group["_id"]["template"]:
+            task["total"] += count
+            continue
+        status = group["_id"]["status"]
+        key = annotator_key(group["_id"]["annotator"])
+        task["status"][status] = task["status"].get(status, 0) + count
+        per_annotator = task["annotators"].setdefault(key, {})
+        per_annotator[status] = per_annotator.get(status, 0) + count
+
+    updates = [
+        UpdateOne({"_id": task["_id"]}, {"$set": {"progress": progress[task["_id"]]}})
+        for task in db.tasks.find(task_query, {"_id": 1})
+    ]
+    if updates:
+        db.tasks.bulk_write(updates, ordered=False)
+    return len(updates)
+
+
+def reconcile_missing(db: Database) -> int:
+    """Build the counters of tasks created before they existed."""
+    task_ids = [
+        task["_id"]
+        for task in db.tasks.find({"progress": {"$exists": False}}, {"_id": 1})
+    ]
+    return reconcile(db, task_ids) if task_ids else 0
+
+
+def load_config(path: Path) -> dict:
+    """Load YAML configuration from a file."""
+    with path.open("r", encoding="utf-8") as f:
+        return yaml.safe_load(f)
+
+
+def get_db_client(uri: str) -> MongoClient:
+    """Initialize and return a MongoDB client."""
+    return MongoClient(uri)
+
+
+def main() -> None:
+    """Main entry point for script execution."""
+    parser = argparse.ArgumentParser(
+        description="Rebuild the progress counters of tasks from their annotations."
+    )
+    parser.add_argument(
+        "--config",
+        type=Path,
+        default=Path("config.yml"),
+        help="Path to the YAML config file",
+    )
+    parser.add_argument(
+        "--task-id", action="append", help="Only this task (repeatable)"
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s"
+    )
+
+    try:
+        cfg = load_config(args.config)
+        client = get_db_client(cfg["mongodb"]["uri"])
+        db = client.get_default_database()
+    except (yaml.YAMLError, FileNotFoundError) as e:
+        logging.error("Error loading config: %s", e)
+        return
+
+    task_ids = [ObjectId(t) for t in args.task_id] if args.task_id else None
+    logging.info("Reconciled the progress of %d tasks.", reconcile(db, task_ids))
+
+
+if __name__ == "__main__":
+    main()
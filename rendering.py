@@ -0,0 +1,304 @@
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor
+from functools import partial
+from typing import Any, Callable, Container, Dict, List, Optional, Tuple
+
+from bson import ObjectId
+from pymongo import UpdateOne
+from pymongo.collection import Collection
+
+from blobs import release_blobs, store_blobs
+from converter import (
+    GraphConvertConfig,
+    MermaidJSFlowchartTemplate,
+    Viewport,
+    collapse_packages,
+    convert_graph,
+    convert_str_graph,
+    load_graph,
+    subgraph,
+    trusted_graph,
+)
+from metrics import timed
+
+# bump to invalidate persisted renders after converter output changes
+RENDERER_VERSION = "1"
+
+# words Mermaid treats as keywords are swapped for look-alike characters
+KEYWORD_REPLACEMENTS = (
+    ("click", "cliсk"),
+    ("constructor", "construсtor"),
+    ("toString", "tоString"),
+)
+
+
+def escape_diagram(diagram: str) -> str:
+    for keyword, replacement in KEYWORD_REPLACEMENTS:
+        diagram = diagram.replace(keyword, replacement)
+    return diagram
+
+
+# conversion settings used by the annotation view, shared by every request
+ANNOTATE_CONFIG = GraphConvertConfig(
+    outside_members=True,
+    hide_empty_members=True,
+    graph_template=MermaidJSFlowchartTemplate(enable_links=True),
+)
+
+
+def config_fingerprint(config: GraphConvertConfig) -> str:
+    template = config.graph_template
+    return "|".join(
+        [
+            RENDERER_VERSION,
+            type(template).__name__,
+            str(getattr(template, "enable_links", False)),
+            str(config.outside_members),
+            str(config.hide_empty_members),
+        ]
+    )
+
+
+def render_diagram(diagram: str) -> str:
+    """Convert a stored diagram into the Mermaid text shown to annotators."""
+    with timed("convert"):
+        rendered = convert_str_graph(escape_diagram(diagram), ANNOTATE_CONFIG)
+    return rendered.replace("\t", "    ")
+
+
+def prepare_graph(diagram: str) -> Dict[str, Any]:
+    """Validate a stored diagram once, returning the graph as annotators see it.
+
+    The result can be rendered with render_prepared without validating again.
+    """
+    return load_graph(escape_diagram(diagram)).model_dump()
+
+
+def render_prepared(graph: Dict[str, Any]) -> str:
+    """Same output as render_diagram, for a graph returned by prepare_graph."""
+    with timed("convert"):
+        rendered = convert_graph(trusted_graph(graph), ANNOTATE_CONFIG)
+    return rendered.replace("\t", "    ")
+
+
+def render_view(
+    graph: Dict[str, Any],
+    viewport: Viewport,
+    expanded: Container[str] = (),
+    max_nodes: Optional[int] = None,
+) -> Dict[str, Any]:
+    """Render part of a prepared graph, packages outside ``expanded`` collapsed.
+
+    Returns the diagram with the collapsed package ids and the number of nodes
+    left out to stay within ``max_nodes``.
+    """
+    with timed("convert"):
+        view, collapsed, hidden = collapse_packages(
+            subgraph(trusted_graph(graph), viewport), expanded, max_nodes
+        )
+        diagram = convert_graph(view, ANNOTATE_CONFIG)
+    return {
+        "diagram": diagram.replace("\t", "    "),
+        "collapsed": collapsed,
+        "hidden": hidden,
+    }
+
+
+RenderResult = Tuple[Optional[Dict[str, Any]], Optional[str], Optional[str]]
+
+
+def render_batch(diagrams: List[str]) -> List[RenderResult]:
+    """Worker entry point: validate and render each stored diagram into
+    (prepared graph, rendered, error)."""
+    results: List[RenderResult] = []
+    for diagram in diagrams:
+        graph = None
+        try:
+            graph = prepare_graph(diagram)
+            results.append((graph, render_prepared(graph), None))
+        except Exception as e:
+            results.append((graph, None, f"{type(e).__name__}: {e}"))
+    return results
+
+
+class DiagramRenderCache:
+    """Content-addressed cache of rendered diagrams.
+
+    Lookups go through an in-process LRU first and then, if a collection is
+    given, through a persisted tier keyed by the same hash. Default overviews
+    of large graphs are kept the same way, keyed by the graph blob hash.
+    """
+
+    def __init__(self, maxsize: int = 512, collection: Optional[Collection] = None):
+        self.maxsize = maxsize
+        self.collection = collection
+        self.fingerprint = config_fingerprint(ANNOTATE_CONFIG)
+        self._entries: "OrderedDict[str, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def key(self, diagram: str) -> str:
+        digest = hashlib.sha256(self.fingerprint.encode("utf-8"))
+        digest.update(b"\0")
+        digest.update(diagram.encode("utf-8"))
+        return digest.hexdigest()
+
+    def overview_key(self, graph_id: str, max_nodes: int) -> str:
+        digest = hashlib.sha256(self.fingerprint.encode("utf-8"))
+        digest.update(f"\0overview\0{max_nodes}\0{graph_id}".encode("utf-8"))
+        return digest.hexdigest()
+
+    def _remember(self, key: str, rendered: Any) -> None:
+        with self._lock:
+            self._entries[key] = rendered
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def get(self, diagram: str) -> str:
+        key = self.key(diagram)
+        with self._lock:
+            rendered = self._entries.get(key)
+            if rendered is not None:
+                self._entries.move_to_end(key)
+                return rendered
+
+        if self.collection is not None:
+            doc = self.collection.find_one({"_id": key}, {"rendered": 1})
+            if doc is not None:
+                self._remember(key, doc["rendered"])
+                return doc["rendered"]
+
+        rendered = render_diagram(diagram)
+        if self.collection is not None:
+            self.collection.update_one(
+                {"_id": key}, {"$set": {"rendered": rendered}}, upsert=True
+            )
+        self._remember(key, rendered)
+        return rendered
+
+    def get_overview(
+        self, graph_id: str, max_nodes: int, load: Callable[[], Dict[str, Any]]
+    ) -> Dict[str, Any]:
+        """render_view of the whole graph stored as blob ``graph_id``.
+
+        ``load`` returns the graph and is only called on a miss.
+        """
+        key = self.overview_key(graph_id, max_nodes)
+        with self._lock:
+            view = self._entries.get(key)
+            if view is not None:
+                self._entries.move_to_end(key)
+                return dict(view)
+
+        if self.collection is not None:
+            doc = self.collection.find_one({"_id": key}, {"view": 1})
+            if doc is not None:
+                self._remember(key, doc["view"])
+                return dict(doc["view"])
+
+        view = render_view(load(), Viewport(), max_nodes=max_nodes)
+        if self.collection is not None:
+            self.collection.update_one(
+                {"_id": key}, {"$set": {"view": view}}, upsert=True
+            )
+        self._remember(key, view)
+        return dict(view)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+class RenderQueue:
+    """Renders uploaded diagrams on a process pool and stores the results.
+
+    Diagrams are validated in the workers too. Each template annotation gets
+    ``graph`` and ``rendered_diagram`` blobs, ``graph_nodes`` and a
+    ``render_error`` field, and the task's ``render`` counters track progress.
+    """
+
+    def __init__(
+        self,
+        annotations: Collection,
+        tasks: Collection,
+        blobs: Collection,
+        workers: Optional[int] = None,
+        chunk_size: int = 32,
+    ):
+        self.annotations = annotations
+        self.tasks = tasks
+        self.blobs = blobs
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    @property
+    def executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            return self._executor
+
+    def submit(self, task_id: ObjectId, samples: List[Tuple[ObjectId, str]]) -> None:
+        """Queue ``(annotation _id, diagram)`` pairs of a task for rendering."""
+        for start in range(0, len(samples), self.chunk_size):
+            chunk = samples[start : start + self.chunk_size]
+            future = self.executor.submit(render_batch, [g for _, g in chunk])
+            future.add_done_callback(
+                partial(self._store, task_id, [oid for oid, _ in chunk])
+            )
+
+    def _store(self, task_id: ObjectId, oids: List[ObjectId], future: Future) -> None:
+        try:
+            results = future.result()
+        except Exception as e:
+            logging.error("Rendering failed for task %s: %s", task_id, e)
+            results = [(None, None, f"{type(e).__name__}: {e}")] * len(oids)
+
+        docs = [
+            {"_id": oid, "graph": graph, "rendered_diagram": rendered}
+            for oid, (graph, rendered, _) in zip(oids, results)
+        ]
+        store_blobs(self.blobs, docs, ["graph", "rendered_diagram"])
+        result = self.annotations.bulk_write(
+            [
+                UpdateOne(
+                    {"_id": doc["_id"]},
+                    {
+                        "$set": {
+                            **{f"blobs.{f}": key for f, key in doc["blobs"].items()},
+                            # lets pages choose overview or full diagram
+                            # without loading the graph
+                            "graph_nodes": len(graph["nodes"]) if graph else None,
+                            "render_error": error,
+                        }
+                    },
+                )
+                for doc, (graph, _, error) in zip(docs, results)
+            ],
+            ordered=False,
+        )
+        if result.matched_count < len(docs):
+            # templates removed while rendering, e.g. with their task
+            found = {
+                doc["_id"]
+                for doc in self.annotations.find({"_id": {"$in": oids}}, {"_id": 1})
+            }
+            release_blobs(
+                self.blobs.database, (d for d in docs if d["_id"] not in found)
+            )
+        failed = sum(1 for _, _, error in results if error is not None)
+        self.tasks.update_one(
+            {"_id": task_id},
+            {"$inc": {"render.done": len(results), "render.failed": failed}},
+        )
+
+    def shutdown(self) -> None:
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+                self._executor = None
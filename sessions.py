@@ -0,0 +1,176 @@
+import logging
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Deque, Dict, Iterator, Optional, Set, Tuple
+
+from pymongo.collection import Collection
+from werkzeug.security import generate_password_hash
+
+
+class UserCache:
+    """Recently read user records, so every request can check the role cheaply.
+
+    Entries expire after ``ttl`` seconds. Changes made through this process
+    invalidate them at once, other worker processes see them within ``ttl``.
+    """
+
+    def __init__(self, users: Collection, ttl: float = 30.0, maxsize: int = 1024):
+        self.users = users
+        self.ttl = ttl
+        self.maxsize = maxsize
+        # username -> (expiry, user or None)
+        self._entries: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, username: str) -> Optional[Dict[str, Any]]:
+        """The user's ``_id``, ``username`` and ``role``, None if deleted."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(username)
+            if entry is not None and entry[0] > now:
+                return entry[1]
+
+        user = self.users.find_one({"username": username}, {"username": 1, "role": 1})
+        with self._lock:
+            self._entries[username] = (now + self.ttl, user)
+            self._entries.move_to_end(username)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return user
+
+    def invalidate(self, username: str) -> None:
+        with self._lock:
+            self._entries.pop(username, None)
+
+
+class LoginLimiter:
+    """Caps failed logins per username and per client address, and how many
+    password checks run at once, so logins cannot tie up the workers.
+
+    Expired failures are swept once per ``window`` and at most ``maxsize``
+    usernames and addresses are tracked, the least recently failed are
+    forgotten first.
+    """
+
+    def __init__(
+        self,
+        max_failures: int = 10,
+        max_failures_per_address: int = 50,
+        window: float = 300.0,
+        concurrent_checks: int = 2,
+        maxsize: int = 100_000,
+    ):
+        self.limits = {"user": max_failures, "address": max_failures_per_address}
+        self.window = window
+        self.maxsize = maxsize
+        self._failures: "OrderedDict[Tuple[str, str], Deque[float]]" = OrderedDict()
+        self._next_sweep = time.monotonic() + window
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(concurrent_checks)
+
+    def _recent(self, key: Tuple[str, str], now: float) -> Deque[float]:
+        failures = self._failures.get(key, deque())
+        while failures and failures[0] <= now - self.window:
+            failures.popleft()
+        if not failures:
+            self._failures.pop(key, None)
+        return failures
+
+    def allowed(self, username: str, address: str) -> bool:
+        now = time.monotonic()
+        keys = (("user", username), ("address", address))
+        with self._lock:
+            return all(len(self._recent(k, now)) < self.limits[k[0]] for k in keys)
+
+    def failed(self, username: str, address: str) -> None:
+        now = time.monotonic()
+        with self._lock:
+            if now >= self._next_sweep:
+                self._sweep(now)
+            for key in (("user", username), ("address", address)):
+                self._recent(key, now)
+                self._failures.setdefault(key, deque()).append(now)
+                self._failures.move_to_end(key)
+            while len(self._failures) > self.maxsize:
+                self._failures.popitem(last=False)
+
+    def _sweep(self, now: float) -> None:
+        """Drop the keys whose failures have all left the window."""
+        # ordered by last failure, so the expired keys come first
+        while self._failures:
+            key, failures = next(iter(self._failures.items()))
+            if failures[-1] > now - self.window:
+                break
+            del self._failures[key]
+        self._next_sweep = now + self.window
+
+    def succeeded(self, username: str) -> None:
+        with self._lock:
+            self._failures.pop(("user", username), None)
+
+    @contextmanager
+    def checking(self, timeout: float = 2.0) -> Iterator[bool]:
+        """Hold one of the password check slots, yields False if none freed up."""
+        acquired = self._slots.acquire(timeout=timeout)
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                self._slots.release()
+
+
+class PasswordHasher:
+    """Hashes passwords with ``method`` (werkzeug's default if None).
+
+    Passwords stored with another method are rehashed on a background thread
+    after a successful login, never on the request path.
+    """
+
+    def __init__(self, users: Collection, method: Optional[str] = None):
+        self.users = users
+        self.method = method
+        self._prefix: Optional[str] = None
+        self._pending: Set[Any] = set()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="password-upgrade"
+        )
+
+    def hash(self, password: str) -> str:
+        if self.method is None:
+            return generate_password_hash(password)
+        return generate_password_hash(password, method=self.method)
+
+    def needs_upgrade(self, stored: str) -> bool:
+        if self._prefix is None:
+            # method and parameters, as werkzeug writes them before the salt
+            self._prefix = self.hash("").split("$", 1)[0]
+        return stored.split("$", 1)[0] != self._prefix
+
+    def upgrade_later(self, user: Dict[str, Any], password: str) -> None:
+        # the first check hashes once to learn the prefix, off the request path
+        if self._prefix is not None and not self.needs_upgrade(user["password"]):
+            return
+        with self._lock:
+            if user["_id"] in self._pending:
+                return
+            self._pending.add(user["_id"])
+        self._executor.submit(self._upgrade, user["_id"], user["password"], password)
+
+    def _upgrade(self, user_id: Any, stored: str, password: str) -> None:
+        try:
+            if self.needs_upgrade(stored):
+                # unless the password changed meanwhile
+                self.users.update_one(
+                    {"_id": user_id, "password": stored},
+                    {"$set": {"password": self.hash(password)}},
+                )
+                logging.info("Upgraded the password hash of user %s", user_id)
+        except Exception as e:
+            logging.error("Could not upgrade the password hash of %s: %s", user_id, e)
+        finally:
+            with self._lock:
+                self._pending.discard(user_id)
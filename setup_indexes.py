@@ -0,0 +1,143 @@
+import argparse
+import logging
+from pathlib import Path
+from typing import Any, Dict, List, Tuple
+
+import yaml
+from bson import ObjectId
+from pymongo import ASCENDING, IndexModel, MongoClient, errors
+from pymongo.database import Database
+
+# Every index the application relies on, per collection.
+INDEXES: Dict[str, List[IndexModel]] = {
+    "annotations": [
+        # also guarantees a single record per annotator and sample
+        IndexModel(
+            [("sample_id", ASCENDING), ("annotator", ASCENDING)],
+            name="sample_annotator",
+            unique=True,
+        ),
+        IndexModel(
+            [("sample_id", ASCENDING), ("template", ASCENDING)],
+            name="sample_template",
+        ),
+        # dataset pages are sorted by sample_id within a task
+        IndexModel(
+            [("task_id", ASCENDING), ("template", ASCENDING), ("sample_id", ASCENDING)],
+            name="task_template_sample",
+        ),
+        IndexModel(
+            [("task_id", ASCENDING), ("annotator", ASCENDING)],
+            name="task_annotator",
+        ),
+        IndexModel([("status", ASCENDING)], name="status"),
+    ],
+    "users": [
+        IndexModel([("username", ASCENDING)], name="username", unique=True),
+    ],
+    "tasks": [
+        IndexModel([("state", ASCENDING)], name="state"),
+    ],
+}
+
+# Representative filters of the queries issued by app.py.
+QUERY_SHAPES: List[Tuple[str, Dict[str, Any]]] = [
+    ("annotations", {"sample_id": "", "annotator": ""}),
+    ("annotations", {"sample_id": "", "template": True}),
+    ("annotations", {"task_id": ObjectId(), "template": True}),
+    ("annotations", {"task_id": ObjectId(), "annotator": ""}),
+    ("annotations", {"status": {"$ne": "Not Annotated"}}),
+    ("users", {"username": ""}),
+]
+
+
+def load_config(path: Path) -> dict:
+    """Load YAML configuration from a file."""
+    with path.open("r", encoding="utf-8") as f:
+        return yaml.safe_load(f)
+
+
+def get_db_client(uri: str) -> MongoClient:
+    """Initialize and return a MongoDB client."""
+    return MongoClient(uri)
+
+
+def ensure_indexes(db: Database) -> None:
+    """Create the declared indexes; existing ones are left untouched."""
+    for collection, indexes in INDEXES.items():
+        for index in indexes:
+            name = index.document["name"]
+            try:
+                db[collection].create_indexes([index])
+                logging.info("Index %s.%s is in place.", collection, name)
+            except errors.OperationFailure as e:
+                # e.g. duplicates in existing data prevent a unique index
+                logging.error("Failed to create index %s.%s: %s", collection, name, e)
+
+
+def _plan_stages(plan: Dict[str, Any]) -> List[str]:
+    stages = []
+    pending = [plan]
+    while pending:
+        stage = pending.pop()
+        stages.append(stage.get("stage", ""))
+        if "inputStage" in stage:
+            pending.append(stage["inputStage"])
+        pending.extend(stage.get("inputStages", []))
+    return stages
+
+
+def report_collscans(db: Database) -> List[Tuple[str, Dict[str, Any]]]:
+    """Explain every known query shape and return those scanning a collection."""
+    collscans = []
+    for collection, query in QUERY_SHAPES:
+        explanation = db[collection].find(query).explain()
+        plan = explanation["queryPlanner"]["winningPlan"]
+        if "COLLSCAN" in _plan_stages(plan):
+            logging.warning("COLLSCAN for %s.find(%s)", collection, query)
+            collscans.append((collection, query))
+    if not collscans:
+        logging.info("All %d query shapes use an index.", len(QUERY_SHAPES))
+    return collscans
+
+
+def main() -> None:
+    """Main entry point for script execution."""
+    parser = argparse.ArgumentParser(
+        description="Create the MongoDB indexes used by the application."
+    )
+    parser.add_argument(
+        "--config",
+        type=Path,
+        default=Path("config.yml"),
+        help="Path to the YAML config file",
+    )
+    parser.add_argument(
+        "--explain",
+        action="store_true",
+        help="Report query shapes that still fall back to a collection scan",
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s"
+    )
+
+    try:
+        cfg = load_config(args.config)
+        client = get_db_client(cfg["mongodb"]["uri"])
+        db = client.get_default_database()
+    except (yaml.YAMLError, FileNotFoundError) as e:
+        logging.error("Error loading config: %s", e)
+        return
+    except Exception as e:
+        logging.error("MongoDB connection error: %s", e)
+        return
+
+    ensure_indexes(db)
+    if args.explain:
+        report_collscans(db)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,54 +1,244 @@
+import argparse
+import logging
 import sys
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Set
 
-from pymongo import MongoClient
-from pymongo.errors import DuplicateKeyError
+import yaml
+from bson import ObjectId
+from pymongo import MongoClient, errors
+from pymongo.database import Database
 
-if __name__ == "__main__":
+from progress import reconcile
+
+# The fields an annotator record owns, the rest is read from its template.
+RECORD_FIELDS = [
+    "sample_id",
+    "task_id",
+    "template_id",
+    "template",
+    "nodes",
+    "missing",
+    "notes",
+    "status",
+    "revision",
+]
 
-    if len(sys.argv) != 3:
-        print(f"Usage: {sys.argv[0]} <old_username> <new_username>")
-        sys.exit(1)
 
-    old_username, new_username = sys.argv[1], sys.argv[2]
+def load_config(path: Path) -> dict:
+    """Load YAML configuration from a file."""
+    with path.open("r", encoding="utf-8") as f:
+        return yaml.safe_load(f)
 
-    client = MongoClient("mongodb://localhost:27017/annotationdb")
-    db = client.get_default_database()
 
-    # ensure the new user doesn't already exist
-    if db.users.find_one({"username": new_username}):
-        print(f"Error: user {new_username!r} already exists.")
-        sys.exit(1)
+def get_db_client(uri: str) -> MongoClient:
+    """Initialize and return a MongoDB client."""
+    return MongoClient(uri)
 
-    # fetch the old user document
+
+def clone_user_record(db: Database, old_username: str, new_username: str) -> bool:
+    """Copy the user record, with the same password hash and role."""
     old_user = db.users.find_one({"username": old_username})
     if not old_user:
-        print(f"Error: no such user {old_username!r}")
-        sys.exit(1)
-
-    # clone the user record
-    new_user = {
-        "username": new_username,
-        "password": old_user["password"],  # same hash
-        "role": old_user.get("role", "annotator"),
-    }
-    res = db.users.insert_one(new_user)
-    print(
-        f"✅ Cloned user {old_username!r} → {new_username!r} (new _id={res.inserted_id})"
-    )
-
-    # clone all that user's non-template annotations
-    query = {"annotator": old_username, "template": False}
-    cursor = db.annotations.find(query)
-    count = 0
-
-    for ann in cursor:
-        ann_copy = dict(ann)
-        ann_copy.pop("_id")  # drop old primary key
-        ann_copy["annotator"] = new_username
+        logging.error("No such user %r.", old_username)
+        return False
+    try:
+        res = db.users.insert_one(
+            {
+                "username": new_username,
+                "password": old_user["password"],
+                "role": old_user.get("role", "annotator"),
+            }
+        )
+    except errors.DuplicateKeyError:
+        logging.error("User %r already exists.", new_username)
+        return False
+    logging.info(
+        "Cloned user %r to %r (new _id=%s).",
+        old_username,
+        new_username,
+        res.inserted_id,
+    )
+    return True
+
+
+def _source_query(
+    old_username: str, task_ids: Optional[List[ObjectId]]
+) -> Dict[str, Any]:
+    query: Dict[str, Any] = {"annotator": old_username, "template": False}
+    if task_ids is not None:
+        query["task_id"] = {"$in": task_ids}
+    return query
+
+
+def copy_with_merge(
+    db: Database,
+    old_username: str,
+    new_username: str,
+    task_ids: Optional[List[ObjectId]],
+) -> int:
+    """Copy the records server-side; records the new user has are kept."""
+    target = _source_query(new_username, task_ids)
+    before = db.annotations.count_documents(target)
+    db.annotations.aggregate(
+        [
+            {"$match": _source_query(old_username, task_ids)},
+            {"$project": {"_id": 0, **dict.fromkeys(RECORD_FIELDS, 1)}},
+            {"$set": {"annotator": new_username}},
+            {
+                "$merge": {
+                    "into": "annotations",
+                    # served by the unique sample_annotator index
+                    "on": ["sample_id", "annotator"],
+                    "whenMatched": "keepExisting",
+                    "whenNotMatched": "insert",
+                }
+            },
+        ],
+        allowDiskUse=True,
+    )
+    return db.annotations.count_documents(target) - before
+
+
+def copy_with_inserts(
+    db: Database,
+    old_username: str,
+    new_username: str,
+    task_ids: Optional[List[ObjectId]],
+    batch_size: int,
+) -> int:
+    """Stream the records into unordered batch inserts, skipping duplicates."""
+    cursor = db.annotations.find(
+        _source_query(old_username, task_ids),
+        {"_id": 0, **dict.fromkeys(RECORD_FIELDS, 1)},
+        batch_size=batch_size,
+    )
+    inserted = 0
+    batch: List[Dict[str, Any]] = []
+    for record in cursor:
+        record["annotator"] = new_username
+        batch.append(record)
+        if len(batch) >= batch_size:
+            inserted += _insert_batch(db, batch)
+            batch = []
+    if batch:
+        inserted += _insert_batch(db, batch)
+    return inserted
+
+
+def _insert_batch(db: Database, batch: List[Dict[str, Any]]) -> int:
+    try:
+        return len(db.annotations.insert_many(batch, ordered=False).inserted_ids)
+    except errors.BulkWriteError as e:
+        # records the new user already has are kept as they are
+        other = [err for err in e.details["writeErrors"] if err.get("code") != 11000]
+        if other:
+            raise
+        return e.details["nInserted"]
+
+
+def main() -> None:
+    """Main entry point for script execution."""
+    parser = argparse.ArgumentParser(
+        description="Clone a user and their annotations to one or more new users."
+    )
+    parser.add_argument("old_username", help="User to clone")
+    parser.add_argument("new_usernames", nargs="+", help="Users to create")
+    parser.add_argument(
+        "--config",
+        type=Path,
+        default=Path("config.yml"),
+        help="Path to the YAML config file",
+    )
+    parser.add_argument(
+        "--task-id",
+        action="append",
+        help="Only copy the annotations of this task (repeatable)",
+    )
+    parser.add_argument(
+        "--method",
+        choices=["merge", "insert"],
+        default="merge",
+        help="Copy with a server-side $merge (MongoDB 4.4+) or batched inserts",
+    )
+    parser.add_argument(
+        "--batch-size", type=int, default=1000, help="Records per insert batch"
+    )
+    parser.add_argument(
+        "--existing-user",
+        action="store_true",
+        help="Copy annotations to users that already exist instead of failing",
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s"
+    )
+
+    try:
+        cfg = load_config(args.config)
+        client = get_db_client(cfg["mongodb"]["uri"])
+        db = client.get_default_database()
+    except (yaml.YAMLError, FileNotFoundError) as e:
+        logging.error("Error loading config: %s", e)
+        sys.exit(2)
+
+    task_ids = [ObjectId(t) for t in args.task_id] if args.task_id else None
+    affected: Set[ObjectId] = set()
+    failed = 0
+    total = 0
+    started = time.perf_counter()
+
+    for new_username in args.new_usernames:
+        if args.existing_user and db.users.find_one({"username": new_username}):
+            logging.info("Copying to the existing user %r.", new_username)
+        elif not clone_user_record(db, args.old_username, new_username):
+            failed += 1
+            continue
+
+        start = time.perf_counter()
         try:
-            db.annotations.insert_one(ann_copy)
-            count += 1
-        except DuplicateKeyError:
-            pass
+            if args.method == "merge":
+                count = copy_with_merge(db, args.old_username, new_username, task_ids)
+            else:
+                count = copy_with_inserts(
+                    db, args.old_username, new_username, task_ids, args.batch_size
+                )
+        except errors.PyMongoError as e:
+            logging.error("Failed to copy annotations to %r: %s", new_username, e)
+            failed += 1
+            continue
+        elapsed = time.perf_counter() - start
+        total += count
+        logging.info(
+            "Cloned %d annotations from %r to %r in %.2fs (%.0f/sec).",
+            count,
+            args.old_username,
+            new_username,
+            elapsed,
+            count / elapsed if elapsed else 0,
+        )
+        if count:
+            affected.update(
+                db.annotations.distinct(
+                    "task_id", _source_query(new_username, task_ids)
+                )
+            )
 
-    print(f"Cloned {count} annotations from {old_username!r} to {new_username!r}")
+    elapsed = time.perf_counter() - started
+    logging.info(
+        "Cloned %d annotations to %d users in %.2fs (%.0f/sec).",
+        total,
+        len(args.new_usernames) - failed,
+        elapsed,
+        total / elapsed if elapsed else 0,
+    )
+    if affected:
+        reconcile(db, list(affected))
+        logging.info("Updated the progress counters of %d tasks.", len(affected))
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
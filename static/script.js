@@ -17,37 +17,184 @@ const colorMappingHTML = {
 const STROKE = '5';
 const STROKE_BASE = '1';
 
+// Compact graph from the graph endpoint: node ids, types, adjacency, packages.
+let graphIndex = null;
+
+async function loadGraph(url) {
+  // revalidated with its ETag, repeat views get a 304 and the cached copy
+  const resp = await fetch(url);
+  if (!resp.ok) {
+    console.error("Could not load the graph: " + resp.status);
+    return;
+  }
+  graphIndex = await resp.json();
+  updateLocalProgress();
+}
 
-function applySavedAnnotations() {
+// node id -> its <rect> in the rendered diagram, rebuilt once per render
+let renderedNodes = new Map();
+
+function indexRenderedNodes(container) {
+  renderedNodes = new Map();
+  for (let a of container.querySelectorAll("a[*|href*='javascript:markNode']")) {
+    const name = a.href.baseVal.replace(/javascript:markNode\('(.*)'\)/, '$1');
+    renderedNodes.set(name, a.querySelector('rect'));
+  }
+}
+
+function highlightLabeledNodes() {
 
     // yeah, horrible
     for (let metric of ["Sufficiency","Completeness","Hallucinations","Verbosity"]) {
 
      (nodesMap[metric]||[]).forEach(name => {
-       const a = document.querySelector(`a[*|href="javascript:markNode('${name}')"]`);
-       if (!a) {
+       const rect = renderedNodes.get(name);
+       if (!rect) {
          console.log("Could not find " + name);
          return;
        }
-       const rect = a.querySelector('rect');
        rect.style.stroke = colorMappingSVG[metric];
        rect.style.strokeWidth = STROKE;
      });
    }
+}
 
+function applySavedAnnotations() {
    tagify.addTags(missing);
    document.querySelector("#notes-input").value = notes;
 }
 
+function isCollapsedPackage(nodeName) {
+  return diagramView !== null && diagramView.collapsed.includes(nodeName);
+}
+
+// Large diagrams start as an overview; packages are fetched when clicked.
+let expandedPackages = new Set();
+
+async function expandPackage(packageId) {
+  expandedPackages.add(packageId);
+  const params = new URLSearchParams();
+  expandedPackages.forEach(p => params.append('expand', p));
+
+  const resp = await fetch(diagramViewUrl + '?' + params.toString());
+  if (!resp.ok) {
+    console.error("Could not expand " + packageId + ": " + resp.status);
+    return;
+  }
+  diagramView = await resp.json();
+  document.querySelector('#view-hidden').textContent = diagramView.hidden;
+  await renderDiagram(diagramView.diagram);
+}
+
 function extractAllNodes() {
-  const aList = document.querySelectorAll("a[*|href*='javascript:markNode']");
-  var allNodes = [];
+  // every node of the graph, including the ones hidden in an overview
+  return new Set(graphIndex ? graphIndex.nodes : []);
+}
+
+// Autosave: changes are queued and sent as one PATCH at a time, each carrying
+// the revision acknowledged for the previous one.
+let pendingLabels = new Map();   // node -> metric, null to unlabel
+let pendingFields = {};          // missing, notes, status
+let saving = null;
+let retryDelay = 1000;           // ms, doubles after every failed autosave
+let retryTimer = null;
+
+function queueLabel(nodeName, metric) {
+  pendingLabels.delete(nodeName);
+  pendingLabels.set(nodeName, metric);
+  flushSaves();
+}
+
+function queueSave(fields) {
+  Object.assign(pendingFields, fields);
+  return flushSaves();
+}
+
+function flushSaves() {
+  // a running flush picks up whatever was queued meanwhile
+  if (saving)
+    return saving;
+  clearTimeout(retryTimer);
+  saving = sendPatches().finally(() => { saving = null; });
+  return saving;
+}
 
-  for (let node of aList) {
-    nodeName = node.href.baseVal.replace(/javascript:markNode\(\'(.*)\'\)/mg, '$1');
-    allNodes.push(nodeName);
+function hasPendingSaves() {
+  return pendingLabels.size > 0 || Object.keys(pendingFields).length > 0;
+}
+
+function requeue(body) {
+  // edits made while the request was out are newer, they stay
+  for (const [field, value] of Object.entries(body)) {
+    if (field !== 'revision' && field !== 'label' && !(field in pendingFields))
+      pendingFields[field] = value;
   }
-  return new Set(allNodes);
+  if (body.label && !pendingLabels.has(body.label.node))
+    pendingLabels = new Map([[body.label.node, body.label.metric], ...pendingLabels]);
+}
+
+function showSaveStatus(message) {
+  document.getElementById('save-status').textContent = message;
+}
+
+function saveFailed(body, reason) {
+  requeue(body);
+  const seconds = Math.round(retryDelay / 1000);
+  showSaveStatus(`Not saved (${reason}), retrying in ${seconds}s.`);
+  retryTimer = setTimeout(flushSaves, retryDelay);
+  retryDelay = Math.min(retryDelay * 2, 60000);
+  return false;
+}
+
+async function sendPatches() {
+  while (hasPendingSaves()) {
+    const body = {revision: revision, ...pendingFields};
+    pendingFields = {};
+    const next = pendingLabels.entries().next();
+    if (!next.done) {
+      const [node, metric] = next.value;
+      pendingLabels.delete(node);
+      body.label = {node: node, metric: metric};
+    }
+
+    let resp, ack;
+    try {
+      resp = await fetch(annotationUrl, {
+        method: 'PATCH',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify(body)
+      });
+      ack = await resp.json();
+    } catch (err) {
+      console.error("Autosave failed: payload " + JSON.stringify(body), err);
+      return saveFailed(body, "connection problem");
+    }
+    if (resp.status === 409) {
+      alert("This annotation was changed in another window, reloading it.");
+      window.location.reload();
+      return false;
+    }
+    if (!resp.ok) {
+      console.error("Error saving:", ack.error);
+      return saveFailed(body, ack.error || resp.statusText);
+    }
+    revision = ack.revision;
+    retryDelay = 1000;
+    showSaveStatus("");
+  }
+  return true;
+}
+
+function currentTags() {
+  return Array.from(document.querySelectorAll("tag")).map(el => el.getAttribute("value"));
+}
+
+function saveTagsIfChanged() {
+  const tags = currentTags();
+  if (JSON.stringify(tags) === JSON.stringify(missing))
+    return;
+  missing = tags;
+  queueSave({missing: tags});
 }
 
 function updateLocalProgress() {
@@ -67,16 +214,17 @@ function updateLocalProgress() {
 
 function markNode(nodeName) {
 
+    if (isCollapsedPackage(nodeName))
+      return expandPackage(nodeName);
+
     const metric = document.querySelector('input[name="option"]:checked').id;
-    const a = document.querySelector(`a[*|href="javascript:markNode('${nodeName}')"]`);
+    const rect = renderedNodes.get(nodeName);
 
-    if (!a) {
-        alert('${nodeName} not found');
+    if (!rect) {
+        alert(`${nodeName} not found`);
         return;
     }
 
-    const rect = a.querySelector('rect');
-
     if (metric !== "Unlabel") {
       if (nodesMap[metric].length > 0 && nodesMap[metric][0] == nodeName) {
         // remove from all
@@ -86,6 +234,7 @@ function markNode(nodeName) {
             nodesMap[m] = (nodesMap[m]||[]).filter(n => n !== nodeName);
         }
         console.log("UNLABELing (same color) nodesMap[metric]: " + nodesMap[metric] + " for " + metric);
+        queueLabel(nodeName, null);
       } else {
         // getting corresponding color
         rect.style.stroke = colorMappingSVG[metric];
@@ -98,6 +247,7 @@ function markNode(nodeName) {
         // adding as unique element of the array
         nodesMap[metric] = Array.from(new Set([...(nodesMap[metric]||[]), nodeName]));
         console.log("nodesMap[metric]: `" + nodesMap[metric] + "` for " + metric);
+        queueLabel(nodeName, metric);
       }
     } else {
       // remove from all
@@ -108,6 +258,7 @@ function markNode(nodeName) {
         nodesMap[m] = (nodesMap[m]||[]).filter(n => n !== nodeName);
       }
       console.log("UNLABEL nodesMap[metric] " + nodesMap[metric] + " for " + metric);
+      queueLabel(nodeName, null);
     }
     updateLocalProgress();
 }
@@ -115,6 +266,8 @@ function markNode(nodeName) {
 // Tagify Setup
 let input = document.querySelector('#missing-input');
 let tagify = new Tagify(input);
+tagify.on('add', saveTagsIfChanged);
+tagify.on('remove', saveTagsIfChanged);
 
 // Selection → Popup Logic
 let codeBlock = document.querySelector('.code-pre code');
@@ -128,6 +281,7 @@ document.addEventListener('DOMContentLoaded', () => {
   // Wire up button clicks to capture which action …
   const form = document.querySelector('#annotation_form');
   let clickedAction = null;
+  let notesTimer = null;
 
   form.querySelectorAll('button[type="submit"]').forEach(btn => {
     btn.addEventListener('click', e => {
@@ -141,47 +295,36 @@ document.addEventListener('DOMContentLoaded', () => {
     if (!clickedAction)
       return console.error("No action selected");
 
-    const tags = Array.from(document.querySelectorAll("tag")).map(el => el.getAttribute("value"));
+    const action = clickedAction;
+    clickedAction = null;
+    clearTimeout(notesTimer);
+    missing = currentTags();
     const notesInput = document.getElementById('notes-input').value;
-    const payload = {
-      action: clickedAction,
-      nodes:  nodesMap,
-      missing: tags,
-      notes: notesInput,
-    };
 
     console.log("Notes saved: " + notesInput);
 
-    try {
-      const resp = await fetch(window.location.pathname, {
-        method:      'POST',
-        headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify(payload)
-      });
+    // labels are already queued, this sends them along with the rest
+    const saved = await queueSave({
+      missing: missing,
+      notes: notesInput,
+      status: action === 'finalize' ? 'Finalized' : 'In Progress',
+    });
 
-      // Flask did a redirect (prev/next)?
-      if (resp.redirected) {
-        window.location.href = resp.url;
-        return;
-      }
+    if (!saved)
+      return;
+    console.log("Saved OK");
+    if (action === 'finalize')
+      window.location.href = datasetUrl;
+  });
 
-      // otherwise, assume JSON back
-      const result = await resp;
+  window.addEventListener('beforeunload', e => {
+    if (hasPendingSaves())
+      e.preventDefault();
+  });
 
-      if (result.ok) {
-        console.log("Saved OK");
-      } else {
-        console.error("Error saving:", result);
-      }
-    }
-    catch(err) {
-      console.error("Fetch error: payload " + JSON.stringify(payload))
-      console.error("Response: " + resp);
-      console.error("Fetch error:", err);
-    }
-    finally {
-      clickedAction = null;
-    }
+  document.querySelector('#notes-input').addEventListener('input', e => {
+    clearTimeout(notesTimer);
+    notesTimer = setTimeout(() => queueSave({notes: e.target.value}), 1000);
   });
 
   // selection logic
@@ -0,0 +1,191 @@
+import random
+from typing import List, Optional
+
+from converter import Edge, Graph, GraphDiff, Node, Package
+
+TOP_LEVEL_TYPES = ["class", "class", "entity", "function", "variable"]
+VISIBILITIES = ["public", "private", "protected", "package private", "internal"]
+
+
+def synthetic_graph(
+    nodes: int = 100,
+    edges: int = 200,
+    packages: int = 10,
+    package_depth: int = 3,
+    members_per_class: int = 3,
+    shared_children: float = 0.0,
+    package_cycles: int = 0,
+    seed: Optional[int] = 0,
+) -> Graph:
+    """Build a random graph shaped like the model outputs.
+
+    ``nodes`` counts top-level nodes; every class also gets up to
+    ``members_per_class`` methods and fields. Packages are nested up to
+    ``package_depth`` levels. ``shared_children`` is the share of nodes listed
+    in a second package and ``package_cycles`` adds that many back references
+    from nested packages to their ancestors.
+    """
+    rng = random.Random(seed)
+    graph_nodes: List[Node] = []
+    classes: List[str] = []
+
+    for i in range(nodes):
+        node_type = rng.choice(TOP_LEVEL_TYPES)
+        node_id = f"{node_type}_{i}"
+        graph_nodes.append(
+            Node(
+                type=node_type,
+                name=node_id if rng.random() < 0.8 else f"{node_type} {i}()",
+                node_id=node_id,
+                description=rng.choice([None, "", f"Description of {node_id}"]),
+                visibility=rng.choice(VISIBILITIES),
+                # variables are rendered with their type, which is required
+                return_type=rng.choice(
+                    ["int", "str"] if node_type == "variable" else [None, "int", "void"]
+                ),
+                params=rng.choice([None, "", "int a, int b"]),
+            )
+        )
+        if node_type == "class":
+            classes.append(node_id)
+
+    for class_id in classes:
+        for j in range(rng.randint(0, members_per_class)):
+            member_type = rng.choice(["method", "field"])
+            member_id = f"{class_id}_{member_type}_{j}"
+            graph_nodes.append(
+                Node(
+                    type=member_type,
+                    name=member_id,
+                    node_id=member_id,
+                    description=rng.choice([None, f"Member of {class_id}"]),
+                    visibility=rng.choice(VISIBILITIES),
+                    return_type=rng.choice(["int", "str", "void"]),
+                    params=rng.choice([None, "self"]),
+                    source_class_id=class_id,
+                )
+            )
+
+    node_ids = [node.node_id for node in graph_nodes]
+    graph_edges = [
+        Edge(
+            node_id_from=rng.choice(node_ids),
+            node_id_to=rng.choice(node_ids),
+            description=rng.choice([None, "", "calls", "uses"]),
+        )
+        for _ in range(edges)
+    ]
+
+    # packages[i] is nested in a package of the previous level
+    levels: List[List[str]] = [[] for _ in range(max(package_depth, 1))]
+    children = {}
+    for i in range(packages):
+        package_id = f"package_{i}"
+        depth = i % len(levels)
+        levels[depth].append(package_id)
+        children[package_id] = []
+        if depth > 0:
+            children[rng.choice(levels[depth - 1])].append(package_id)
+
+    package_ids = list(children)
+    if package_ids:
+        for node_id in node_ids:
+            if rng.random() < 0.7:
+                children[rng.choice(package_ids)].append(node_id)
+            if rng.random() < shared_children:
+                children[rng.choice(package_ids)].append(node_id)
+        for _ in range(package_cycles):
+            nested = [p for level in levels[1:] for p in level]
+            if nested:
+                children[rng.choice(nested)].append(rng.choice(levels[0]))
+
+    graph_packages = [
+        Package(package_id=package_id, children=package_children, description=None)
+        for package_id, package_children in children.items()
+    ]
+    rng.shuffle(graph_packages)
+
+    return Graph(nodes=graph_nodes, edges=graph_edges, packages=graph_packages)
+
+
+def synthetic_diff(
+    graph: Graph, changes: int = 10, structural: bool = True, seed: Optional[int] = 0
+) -> GraphDiff:
+    """Build a random diff touching about ``changes`` items of ``graph``.
+
+    Without ``structural`` only node attributes and edges change, otherwise
+    nodes and packages are also added, removed and rewired.
+    """
+    rng = random.Random(seed)
+    nodes = list({node.node_id: node for node in graph.nodes}.values())
+    node_ids = [node.node_id for node in nodes]
+    edge_keys = list({(e.node_id_from, e.node_id_to): e for e in graph.edges})
+    diff = GraphDiff()
+
+    def sample(items: list, k: int) -> list:
+        return rng.sample(items, min(k, len(items)))
+
+    for node in sample(nodes, changes):
+        diff.changed_nodes.append(
+            node.model_copy(
+                update={
+                    "description": f"Changed {rng.random():.3f}",
+                    "params": rng.choice([None, "int x"]),
+                }
+            )
+        )
+    for node_id_from, node_id_to in sample(edge_keys, changes):
+        diff.changed_edges.append(
+            Edge(node_id_from=node_id_from, node_id_to=node_id_to, description="new")
+        )
+    removed_edges = sample(edge_keys, changes)
+    diff.removed_edges.extend(removed_edges)
+    for node_id_from, node_id_to in removed_edges[: changes // 2]:
+        # removed and added again
+        diff.added_edges.append(
+            Edge(node_id_from=node_id_from, node_id_to=node_id_to, description=None)
+        )
+    for _ in range(changes):
+        diff.added_edges.append(
+            Edge(node_id_from=rng.choice(node_ids), node_id_to=rng.choice(node_ids))
+        )
+    if not structural:
+        return diff
+
+    diff.changed_nodes.extend(
+        node.model_copy(update={"type": "entity"})
+        for node in sample([n for n in nodes if n.type == "class"], 2)
+    )
+    removed = set(sample(node_ids, changes // 2))
+    diff.removed_nodes.extend(removed)
+    diff.changed_nodes = [n for n in diff.changed_nodes if n.node_id not in removed]
+    for i in range(changes // 2):
+        node_id = f"added_{seed}_{i}"
+        diff.added_nodes.append(
+            Node(
+                type="function",
+                name=node_id,
+                node_id=node_id,
+                description=None,
+                visibility="public",
+                return_type="void",
+            )
+        )
+        diff.added_edges.append(
+            Edge(node_id_from=node_id, node_id_to=rng.choice(node_ids))
+        )
+    for package in sample(graph.packages, 2):
+        children = package.children[1:] + sample(node_ids, 1)
+        diff.changed_packages.append(package.model_copy(update={"children": children}))
+    diff.removed_packages.extend(
+        p.package_id
+        for p in sample(graph.packages, 1)
+        if p not in diff.changed_packages
+    )
+    diff.added_packages.append(
+        Package(
+            package_id=f"added_package_{seed}",
+            children=[n.node_id for n in diff.added_nodes],
+        )
+    )
+    return diff
@@ -0,0 +1,25 @@
+import logging
+
+from app import create_app
+
+# gunicorn -c gunicorn.conf.py wsgi:app, or python wsgi.py to serve with waitress
+logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+
+app = create_app()
+
+
+def main() -> None:
+    """Serve the app with waitress, e.g. on hosts where gunicorn does not run."""
+    from waitress import serve
+
+    cfg = app.config["SETTINGS"]
+    serve(
+        app,
+        host=cfg["app"]["host"],
+        port=cfg["app"]["port"],
+        threads=cfg.get("server", {}).get("threads", 8),
+    )
+
+
+if __name__ == "__main__":
+    main()